@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# bench_broadcast.py - an owner broadcast (broadcast.py) through the real
+# outbox against the fake Bot API enforcing Telegram's send limits: send
+# rate, 429s, what a user chatting meanwhile waits for a reply, and a
+# stop / resume from the checkpoint (who got the message twice, who never).
+# Then the streaming exports (export.py): time, output size and peak memory.
+#
+#   python benchmarks/bench_broadcast.py [--users 400] [--rate 20] [--blocked 0.05]
+#       [--structures 20000]
+
+import argparse
+import collections
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fake_botapi import FakeBotAPI, percentile  # noqa: E402
+
+PROBE_CHAT = 1  # the "user chatting meanwhile"; not a broadcast recipient
+
+
+def seed(storage, users, structures, rng):
+    with storage.transaction() as conn:
+        for uid in range(1000, 1000 + users):
+            conn.execute("INSERT INTO users (tg_id, username, full_name, first_seen, structures_count) "
+                         "VALUES (?, ?, ?, ?, 0)", (uid, f"user{uid}", f"User {uid}", int(time.time())))
+    for _ in range(structures):
+        uid = 1000 + rng.randrange(users)
+        text = "\n".join(f"PATCH_LIB(\"libUE4.so\", \"0x{rng.randrange(1 << 28):X}\", \"00 20 70 47\");"
+                         for _ in range(rng.randint(1, 6)))
+        storage.save_structure(uid, text)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=400)
+    ap.add_argument("--rate", type=float, default=20, help="broadcast messages/s (BROADCAST_RATE)")
+    ap.add_argument("--blocked", type=float, default=0.05, help="fraction of users who blocked the bot")
+    ap.add_argument("--structures", type=int, default=20000, help="saved structures to export")
+    ap.add_argument("--latency-ms", type=float, default=30)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    rng = random.Random(args.seed)
+
+    tmp = tempfile.mkdtemp()
+    os.environ["BULK_DIR"] = tmp
+    import telebot
+    import storage
+    import writebehind
+    import broadcast
+    import export
+    from outbox import Outbox
+
+    storage.configure(os.path.join(tmp, "bench.db"))
+    storage.init_schema()
+    seed(storage, args.users, args.structures, rng)
+    fake = FakeBotAPI(latency=args.latency_ms / 1000, enforce_limits=True, seed=args.seed).start()
+    fake.install()
+    fake.blocked = {uid for uid in range(1000, 1000 + args.users) if rng.random() < args.blocked}
+    received = collections.Counter()
+    fake.on_call = lambda method, chat_id, params: received.update([chat_id]) if method == "sendMessage" else None
+
+    bot = telebot.TeleBot("123:bench", threaded=False)
+    outbox = Outbox(bot).start()
+    writer = writebehind.WriteBehindQueue()
+    done = threading.Event()
+    b = broadcast.Broadcaster(outbox, writer, rate=args.rate,
+                              on_progress=lambda row, finished: finished and done.set())
+
+    # a user chatting with the bot during the broadcast: a reply every 1.5s (the
+    # outbox paces one chat to 1/s, so faster would measure that instead)
+    probe = []
+    probing = threading.Event()
+
+    def prober():
+        while not probing.is_set():
+            t = time.perf_counter()
+            try:
+                outbox.call("send_message", PROBE_CHAT, "reply", timeout=60)
+                probe.append(time.perf_counter() - t)
+            except Exception:
+                pass
+            probing.wait(1.5)
+
+    threading.Thread(target=prober, daemon=True).start()
+    start = time.perf_counter()
+    broadcast_id = b.start("📣 hello everyone", owner_chat_id=PROBE_CHAT)
+    # stop a third of the way in, then resume from the checkpoint
+    time.sleep(args.users / args.rate / 3)
+    b.stop()
+    done.wait()
+    done.clear()
+    writer.flush()
+    at_stop = storage.get_broadcast(broadcast_id)
+    b.resume()
+    done.wait()
+    elapsed = time.perf_counter() - start
+    probing.set()
+    writer.flush()
+    row = storage.get_broadcast(broadcast_id)
+
+    recipients = range(1000, 1000 + args.users)
+    twice = sum(1 for uid in recipients if received[uid] > 1)
+    never = sum(1 for uid in recipients if not received[uid] and uid not in fake.blocked)
+    stats = fake.stats()
+    print(f"broadcast to {args.users} users at --rate {args.rate:g}/s: {elapsed:.1f}s "
+          f"-> {args.users / elapsed:.1f} users/s (including the stop)")
+    print(f"  stopped at tg_id {at_stop['last_tg_id']} ({at_stop['sent']} sent), resumed: "
+          f"{twice} users got it twice, {never} never")
+    print(f"  {row['status']}: {row['sent']} sent, {row['blocked']} blocked, {row['failed']} failed; "
+          f"429s answered by the fake: {sum(stats['rate_limited'].values())}, outbox retries {outbox.retries}")
+    if probe:
+        print(f"  chatting user's replies meanwhile: p50={percentile(probe, 50) * 1000:.0f}ms "
+              f"p99={percentile(probe, 99) * 1000:.0f}ms (n={len(probe)})")
+
+    for table in export.TABLES:
+        for fmt in export.FORMATS:
+            tracemalloc.start()
+            t = time.perf_counter()
+            paths = export.write_files(table, fmt)
+            took = time.perf_counter() - t
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            size = sum(os.path.getsize(p) for p in paths)
+            print(f"export {table:10s} {fmt:5s}: {took * 1000:6.0f} ms, {size / 1024:7.0f} KiB in "
+                  f"{len(paths)} file(s), peak memory {peak / 1024:.0f} KiB")
+            for p in paths:
+                os.remove(p)
+
+    outbox.close()
+    writer.close()
+    storage.close_all()
+    fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# bench_generator.py - lines/sec for each structure template: the old per-offset
+# f-string loop vs. the compiled templates in generator.py, plus memo hits.
+#
+#   python benchmarks/bench_generator.py [--offsets 100000] [--repeat 5]
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import generator  # noqa: E402
+
+LIB = "libUE4.so"
+PARAMS = "connect1, connect2"
+
+
+# the f-string loops generator.py replaced, for comparison
+def old_patch_lib(offsets, hex_bytes="00 20 70 47"):
+    return "\n".join(f'PATCH_LIB("{LIB}", {off}, "{hex_bytes}");' for off in offsets)
+
+
+def old_memory_patch(offsets, hex_bytes="73 6F 6E 52 65"):
+    return "\n".join(f'MemoryPatch::createWithHex("{LIB}",{off}, "{hex_bytes}").Modify();' for off in offsets)
+
+
+def old_hook_lib(offsets):
+    return "\n".join(f'HOOK_LIB("{LIB}", {off}, {PARAMS});' for off in offsets)
+
+
+OLD = {
+    generator.PATCH_LIB: old_patch_lib,
+    generator.MEMORY_PATCH: old_memory_patch,
+    generator.HOOK_LIB: old_hook_lib,
+}
+
+
+def best(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--offsets", type=int, default=100000)
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+    offsets = [f"0x{0xC23FA50 + i * 4:X}" for i in range(args.offsets)]
+    small = offsets[:50]
+
+    print(f"{'template':14s} {'old f-string':>14s} {'compiled':>14s} {'streamed':>14s} {'speedup':>8s}")
+    for stype, old in OLD.items():
+        params = PARAMS if stype == generator.HOOK_LIB else ""
+        assert old(small) == generator.compile_template(stype, LIB, None, params).render(small)
+        t_old = best(lambda: old(offsets), args.repeat)
+        tpl = generator.compile_template(stype, LIB, None, params)
+        t_new = best(lambda: tpl.render(offsets), args.repeat)
+        t_iter = best(lambda: sum(1 for _ in generator.iter_lines(stype, LIB, offsets, None, params)), args.repeat)
+        n = len(offsets)
+        print(f"{stype:14s} {n / t_old:12,.0f}/s {n / t_new:12,.0f}/s {n / t_iter:12,.0f}/s {t_old / t_new:7.1f}x")
+
+    # repeated inline-sized requests: memo hit vs. rebuilding
+    generator.memo.clear()
+    calls = 20000
+    start = time.perf_counter()
+    for _ in range(calls):
+        old_patch_lib(small)
+    t_old = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(calls):
+        generator.render(generator.PATCH_LIB, LIB, small)
+    t_memo = time.perf_counter() - start
+    print(f"\nrepeat {len(small)}-offset PATCH_LIB x{calls}: old {t_old / calls * 1e6:.1f} us, "
+          f"memoized {t_memo / calls * 1e6:.1f} us ({t_old / t_memo:.1f}x), {generator.memo.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# bench_maintenance.py - the maintenance.py jobs on a database that has been
+# left alone for a while (expired drafts, free pages from deleted saves):
+# how long each run takes, what it does, and how long a live write through
+# the write-behind queue (a new draft, what a user's generation waits for)
+# takes while it runs. The old ways - all expired drafts in one queued
+# transaction, a full VACUUM (storage.py compact) - run on the same data for
+# comparison.
+#
+#   python benchmarks/bench_maintenance.py [--drafts 50000] [--saved 20000] [--deleted 0.5]
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fake_botapi import percentile  # noqa: E402
+
+
+def seed(storage, drafts, saved, deleted, rng):
+    old = int(time.time()) - 2 * storage.DRAFT_TTL
+    with storage.transaction():
+        for i in range(drafts):
+            storage.insert_draft(1000 + i % 500, f"draft {i} " + "x" * rng.randint(100, 900), now=old)
+        for i in range(saved):
+            storage.save_structure(1000 + i % 500, f"saved {i} " + "y" * rng.randint(100, 900))
+    ids = [r[0] for r in storage.fetchall("SELECT id, user_tg_id FROM saved_structures")]
+    with storage.transaction():
+        for struct_id in rng.sample(ids, int(len(ids) * deleted)):
+            uid = storage.fetchone("SELECT user_tg_id FROM saved_structures WHERE id = ?", (struct_id,))[0]
+            storage.delete_structure(struct_id, uid)
+
+
+class LiveWrites:
+    """A draft insert through the writer every interval seconds; latencies per phase."""
+
+    def __init__(self, storage, writer, interval=0.005):
+        self.storage, self.writer, self.interval = storage, writer, interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        i = 0
+        while not self._stop.is_set():
+            t = time.perf_counter()
+            self.writer.call(self.storage.insert_draft, 1, f"live {i}")
+            self.samples.append(time.perf_counter() - t)
+            i += 1
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def measure(self, fn):
+        """(fn's result, seconds, [write latencies while it ran])"""
+        first = len(self.samples)
+        t = time.perf_counter()
+        result = fn()
+        took = time.perf_counter() - t
+        time.sleep(self.interval * 4)   # the write that waited for fn
+        return result, took, self.samples[first:]
+
+
+def show(label, took, writes, result=""):
+    print(f"{label:34s} {took * 1000:7.0f} ms   live writes p50={percentile(writes, 50) * 1000:5.1f}ms "
+          f"p99={percentile(writes, 99) * 1000:6.1f}ms max={max(writes or [0]) * 1000:6.1f}ms  {result}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--drafts", type=int, default=50000, help="expired drafts")
+    ap.add_argument("--saved", type=int, default=20000)
+    ap.add_argument("--deleted", type=float, default=0.5, help="fraction of saved structures deleted")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ.setdefault("BACKUP_DIR", os.path.join(tmp, "backups"))
+    import storage
+    import writebehind
+    import maintenance
+
+    results = {}
+    for way in ("maintenance", "old"):
+        path = os.path.join(tmp, f"{way}.db")
+        storage.configure(path)
+        storage.init_schema()
+        seed(storage, args.drafts, args.saved, args.deleted, random.Random(args.seed))
+        storage.wal_checkpoint("TRUNCATE")
+        space = storage.space_used()
+        print(f"\n{way}: {space['bytes'] / 1048576:.1f} MB, {space['free_bytes'] / 1048576:.1f} MB free, "
+              f"{storage.fetchone('SELECT COUNT(*) FROM drafts')[0]} expired drafts")
+        writer = writebehind.WriteBehindQueue()
+        live = LiveWrites(storage, writer).start()
+        _, took, writes = live.measure(lambda: time.sleep(1))
+        show("idle", took, writes)
+        if way == "old":
+            # what bot99 used to queue at startup and every DRAFT_GC_EVERY drafts
+            (d, b), took, writes = live.measure(lambda: writer.call(storage.gc_drafts))
+            show("gc_drafts() in one transaction", took, writes, f"{d} drafts, {b} texts")
+            _, took, writes = live.measure(lambda: storage.execute("VACUUM"))
+            show("VACUUM", took, writes)
+        else:
+            s = maintenance.Scheduler(writer)
+            for name in s.jobs:
+                runs, total, all_writes = 0, 0.0, []
+                while True:
+                    (finished, summary), took, writes = live.measure(lambda: s.run(name))
+                    runs += 1
+                    total += took
+                    all_writes += writes
+                    if finished:
+                        break
+                show(f"{name} ({runs} run{'s' * (runs > 1)})", total, all_writes,
+                     summary if runs == 1 else f"last run: {summary}")
+        live.stop()
+        writer.close()
+        results[way] = storage.space_used()["bytes"]
+        storage.close_all()
+    print(f"\nsize after: maintenance {results['maintenance'] / 1048576:.1f} MB, "
+          f"old way {results['old'] / 1048576:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# bench_offsets.py - time offset validation/normalization on a large upload
+#
+#   python benchmarks/bench_offsets.py [--offsets 100000] [--invalid 0.01]
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import offsets  # noqa: E402
+
+
+def make_lines(n, invalid_ratio, seed=1):
+    rng = random.Random(seed)
+    lines = []
+    for i in range(n):
+        r = rng.random()
+        value = rng.randrange(1 << 32)
+        if r < invalid_ratio:
+            lines.append(f"0xY{value:X}S")
+        elif r < 0.5:
+            lines.append(f"0x{value:x}")
+        elif r < 0.8:
+            lines.append(f"0x{value:X}  # comment")
+        else:
+            lines.append(str(value))
+    return lines
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--offsets", type=int, default=100000)
+    ap.add_argument("--invalid", type=float, default=0.01)
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+    lines = make_lines(args.offsets, args.invalid)
+    print(f"numpy: {'yes' if offsets.numpy_module() is not None else 'no (stdlib fallback)'}")
+    best = None
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        report = offsets.parse_offsets(lines)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{args.offsets} lines -> {len(report.values)} valid unique, {report.invalid_count} invalid, "
+          f"{report.duplicates} duplicates")
+    print(f"best of {args.repeat}: {best * 1000:.1f} ms ({args.offsets / best:,.0f} lines/sec)")
+
+
+if __name__ == "__main__":
+    main()
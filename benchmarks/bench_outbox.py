@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# bench_outbox.py - replies/s and 429s for a burst of handler replies, sent
+# directly vs. through outbox.py, against a fake bot that enforces the Bot
+# API limits (30 msg/s overall, 1 msg/s per chat with a small burst) and
+# answers 429 + retry_after when they are exceeded.
+#
+#   python benchmarks/bench_outbox.py [--chats 50] [--replies 4] [--latency-ms 30]
+
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from telebot.apihelper import ApiTelegramException  # noqa: E402
+import outbox as outbox_mod  # noqa: E402
+
+
+class FakeBot:
+    """Counts requests; 429s when the global or per-chat budget is exceeded."""
+
+    def __init__(self, latency, global_rate=30, chat_rate=1.0, chat_burst=3):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.global_bucket = outbox_mod.TokenBucket(global_rate, global_rate)
+        self.chats = {}
+        self.chat_rate, self.chat_burst = chat_rate, chat_burst
+        self.requests = self.ok = self.limited = self.delivered = 0
+
+    def _limit(self, chat_id):
+        now = time.monotonic()
+        with self.lock:
+            self.requests += 1
+            bucket = self.chats.setdefault(chat_id, outbox_mod.TokenBucket(self.chat_rate, self.chat_burst))
+            for b in (self.global_bucket, bucket):
+                wait = b.delay(now)
+                if wait:
+                    self.limited += 1
+                    raise ApiTelegramException("sendMessage", None, {
+                        "ok": False, "error_code": 429, "description": "Too Many Requests",
+                        "parameters": {"retry_after": max(1, round(wait))}})
+            self.global_bucket.take(now)
+            bucket.take(now)
+            self.ok += 1
+
+    def send_message(self, chat_id, text, **kwargs):
+        time.sleep(self.latency)
+        self._limit(chat_id)
+        with self.lock:
+            self.delivered += text.count("reply ")
+
+    def answer_callback_query(self, callback_query_id, text=None, **kwargs):
+        time.sleep(self.latency)
+
+
+def direct(bot, chats, replies):
+    # what the handlers did before: send synchronously, a 429 loses the reply
+    def handler(chat_id):
+        for r in range(replies):
+            try:
+                bot.send_message(chat_id, f"reply {r}")
+            except ApiTelegramException:
+                pass
+    with ThreadPoolExecutor(16) as pool:
+        list(pool.map(handler, range(1, chats + 1)))
+
+
+def queued(bot, chats, replies):
+    box = outbox_mod.Outbox(bot).start()
+    for chat_id in range(1, chats + 1):
+        box.answer_callback_query(str(chat_id))
+        for r in range(replies):
+            box.send_message(chat_id, f"reply {r}")
+    box.close(timeout=600)
+    return box.stats()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--chats", type=int, default=50)
+    ap.add_argument("--replies", type=int, default=4, help="messages each handler sends in a row")
+    ap.add_argument("--latency-ms", type=float, default=30)
+    args = ap.parse_args()
+    total = args.chats * args.replies
+
+    for name, run in (("direct", direct), ("outbox", queued)):
+        bot = FakeBot(args.latency_ms / 1000)
+        start = time.perf_counter()
+        extra = run(bot, args.chats, args.replies)
+        took = time.perf_counter() - start
+        print(f"-- {name}")
+        print(f"   delivered {bot.delivered}/{total} replies in {took:.2f}s "
+              f"({bot.delivered / took:.1f}/s), {bot.requests} requests, {bot.limited} x 429")
+        if extra:
+            print(f"   {extra}")
+
+
+if __name__ == "__main__":
+    main()
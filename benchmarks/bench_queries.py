@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# bench_queries.py - time the structures/users lookups on a large DB, before
+# and after the schema migrations (indexes, counters, deduplicated storage).
+#
+#   python benchmarks/bench_queries.py [--structures 1000000] [--users 50000] [--distinct 5000]
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import storage  # noqa: E402
+
+def text(i):
+    return "\n".join(f'PATCH_LIB("libUE4.so", 0x{0xC23FA50 + i * 64 + k * 4:X}, "00 20 70 47");' for k in range(8))
+
+
+def seed(n_structs, n_users, n_distinct):
+    now = int(time.time())
+    rng = random.Random(1)
+    with storage.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO users (tg_id, username, full_name, first_seen, structures_count) VALUES (?, ?, ?, ?, 0)",
+            ((100000 + u, f"user{u}", "Seed User", now - rng.randrange(90 * 86400)) for u in range(n_users)))
+    # popular structures are requested over and over, by many users
+    texts = [text(i) for i in range(n_distinct)]
+    batch = 100000
+    for start in range(0, n_structs, batch):
+        with storage.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO structures (user_tg_id, text, created_at, saved) VALUES (?, ?, ?, ?)",
+                ((100000 + rng.randrange(n_users), texts[min(int(rng.paretovariate(1.2)) - 1, n_distinct - 1)],
+                  now - rng.randrange(90 * 86400), rng.random() < 0.2)
+                 for _ in range(min(batch, n_structs - start))))
+
+
+def timed(fn, iterations):
+    start = time.perf_counter()
+    for i in range(iterations):
+        fn(i)
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def run_queries(n_users, label):
+    day_ts = int(time.time()) - 24 * 3600
+    uid = lambda i: 100000 + (i * 7919) % n_users  # noqa: E731
+    if storage.schema_version() >= 3:
+        saved = [
+            ("saved structures (user)", 200, lambda i: storage.list_structures(uid(i))),
+            ("saved page (user)", 200, lambda i: storage.structures_page(uid(i), limit=8)),
+            ("count_structures", 5, lambda i: storage.count_structures()),
+        ]
+    else:
+        saved = [
+            ("saved structures (user)", 200, lambda i: storage.fetchall(
+                "SELECT id, text, created_at FROM structures WHERE user_tg_id = ? "
+                "ORDER BY created_at DESC, id DESC", (uid(i),))),
+            ("saved page (user)", 200, lambda i: storage.fetchall(
+                "SELECT id, text, created_at FROM structures WHERE user_tg_id = ? "
+                "ORDER BY created_at DESC, id DESC LIMIT 8", (uid(i),))),
+            ("count_structures", 5, lambda i: storage.fetchone("SELECT COUNT(*) FROM structures")),
+        ]
+    cases = saved + [
+        ("count_users_since (24h)", 50, lambda i: storage.count_users_since(day_ts)),
+        ("recent_users (7)", 50, lambda i: storage.recent_users(7)),
+        ("count_users", 20, lambda i: storage.count_users()),
+    ]
+    if storage.schema_version() >= 2:
+        cases += [
+            ("stats_totals (counters)", 200, lambda i: storage.stats_totals()),
+            ("stats_day (counters)", 200, lambda i: storage.stats_day()),
+            ("user_structures_total", 200, lambda i: storage.user_structures_total(uid(i))),
+        ]
+    print(f"-- {label} (schema v{storage.schema_version()})")
+    results = {}
+    for name, iterations, fn in cases:
+        ms = timed(fn, iterations)
+        results[name] = ms
+        print(f"   {name:30s} {ms:10.3f} ms/query")
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--structures", type=int, default=1000000)
+    ap.add_argument("--users", type=int, default=50000)
+    ap.add_argument("--distinct", type=int, default=5000, help="distinct structure texts")
+    args = ap.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        storage.configure(os.path.join(tmp, "bench.db"))
+        storage._create_base_tables()
+        t = time.perf_counter()
+        seed(args.structures, args.users, args.distinct)
+        print(f"seeded {args.structures} structures / {args.users} users in {time.perf_counter() - t:.1f}s")
+        before = run_queries(args.users, "before migrations")
+        t = time.perf_counter()
+        storage.migrate(2)
+        print(f"migrated to v2 in {time.perf_counter() - t:.1f}s")
+        run_queries(args.users, "indexes + counters")
+        t = time.perf_counter()
+        report = storage.compact()
+        print(f"migrated to v{storage.schema_version()} + compacted in {time.perf_counter() - t:.1f}s")
+        print("   " + storage.format_space_report(report).replace("\n", "\n   "))
+        after = run_queries(args.users, "after migrations")
+        print("-- speedup")
+        for name in before:  # counter reads only exist after the migrations
+            print(f"   {name:30s} {before[name] / max(after[name], 1e-9):10.1f}x")
+        storage.close_all()
+
+
+if __name__ == "__main__":
+    main()
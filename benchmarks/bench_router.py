@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# bench_router.py - cost of routing one callback: the old if/startswith chain
+# in callback_handler vs. router.CallbackRouter (dict lookup + payload
+# parsing), bare and with bot99's middleware stack (timing + a gate).
+# Handlers are no-ops, so only dispatch is measured.
+#
+#   python benchmarks/bench_router.py [--calls 200000]
+
+import argparse
+import os
+import sys
+import time
+import types
+from typing import NamedTuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import router  # noqa: E402
+
+# callback data in rough proportion to real traffic: flow steps and paging
+# dominate, the late entries of the old chain are the common ones
+SAMPLE = (["lib_ue4", "hex_0", "stype_patch", "simple_multi", "simple_single", "save_struct:123456",
+           "saved:n:1760000000:4242", "delstruct:77", "settings", "back_to_profile", "hex_custom",
+           "joined_check", "noop", "owner_check_users"] * 3
+          + ["lib_anogs", "hex_1", "save_struct:pending", "simple_structure", "hook_structure"])
+
+
+def noop(*args):
+    return None
+
+
+def old_chain(call):
+    # same order and tests as the if-chain bot99 used to have
+    data = call.data or ""
+    if data == "joined_check":
+        return noop()
+    if data == "simple_structure":
+        return noop()
+    if data == "simple_single":
+        return noop()
+    if data == "simple_multi":
+        return noop()
+    if data == "hook_structure":
+        return noop()
+    if data == "settings":
+        return noop()
+    if data == "view_saved":
+        return noop()
+    if data.startswith("saved:"):
+        _, direction, created_at, sid = data.split(":")
+        return noop(direction, int(created_at), int(sid))
+    if data.startswith("delstruct:"):
+        return noop(int(data.split(":", 1)[1]))
+    if data == "bot_info":
+        return noop()
+    if data.startswith("stype_"):
+        return noop(data.split("_", 1)[1])
+    if data.startswith("hex_"):
+        if data == "hex_custom":
+            return noop()
+        return noop(int(data.split("_", 1)[1]))
+    if data.startswith("lib_"):
+        return noop(data.split("_", 1)[1])
+    if data.startswith("save_struct:"):
+        sid = data.split(":", 1)[1]
+        return noop(sid if sid == "pending" else int(sid))
+    if data == "back_to_profile":
+        return noop()
+    if data == "noop":
+        return noop()
+    # owner_check_users fell through to here (its own handler never ran)
+    return None
+
+
+class SavedCursor(NamedTuple):
+    direction: str
+    created_at: int
+    id: int
+
+
+class StructRef(NamedTuple):
+    id: int
+
+
+class Choice(NamedTuple):
+    key: str
+
+
+class PresetRef(NamedTuple):
+    index: int
+
+
+def build(middleware=(), route_mw=()):
+    r = router.CallbackRouter(middleware=middleware)
+    for key in ("joined_check", "simple_structure", "simple_single", "simple_multi", "hook_structure",
+                "settings", "view_saved", "bot_info", "hex_custom", "save_struct:pending",
+                "back_to_profile", "noop", "owner_check_users"):
+        r.route(key, middleware=route_mw)(noop)
+    r.route("saved:", SavedCursor, middleware=route_mw)(noop)
+    r.route("delstruct:", StructRef, middleware=route_mw)(noop)
+    r.route("stype_", Choice, middleware=route_mw)(noop)
+    r.route("hex_", PresetRef, middleware=route_mw)(noop)
+    r.route("lib_", Choice, middleware=route_mw)(noop)
+    r.route("save_struct:", StructRef, middleware=route_mw)(noop)
+    return r.dispatch
+
+
+def measure(dispatch, calls, n):
+    start = time.perf_counter()
+    for i in range(n):
+        dispatch(calls[i % len(calls)])
+    return (time.perf_counter() - start) / n * 1e9
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--calls", type=int, default=200000)
+    args = ap.parse_args()
+    calls = [types.SimpleNamespace(data=d, from_user=types.SimpleNamespace(id=1)) for d in SAMPLE]
+    allow = router.gate(lambda call: True, noop)
+    variants = (
+        ("if-chain (old)", old_chain),
+        ("router", build()),
+        ("router + timing + gate", build(middleware=[router.timed], route_mw=[allow])),
+    )
+    print(f"{len(SAMPLE)} distinct-ish callbacks, {args.calls} dispatches each")
+    for name, dispatch in variants:
+        best = min(measure(dispatch, calls, args.calls) for _ in range(3))
+        print(f"  {name:24s} {best:7.0f} ns/callback")
+    print("per data value (old chain -> router):")
+    for data in ("joined_check", "settings", "lib_ue4", "save_struct:123456", "noop"):
+        one = [c for c in calls if c.data == data]
+        old = min(measure(old_chain, one, 50000) for _ in range(3))
+        new = min(measure(variants[1][1], one, 50000) for _ in range(3))
+        print(f"  {data:22s} {old:6.0f} -> {new:6.0f} ns")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# bench_startup.py - cold-start cost of bot99: what its import spends time
+# on (python -X importtime), the schema check on a new vs. an up-to-date
+# database, and how long a fresh process takes until it receives updates -
+# webhook mode until GET / answers, polling mode until the first getUpdates
+# reaches the fake Bot API - plus what the background warm-up then fetches.
+#
+#   python benchmarks/bench_startup.py [--runs 5] [--users 20] [--top 12]
+
+import argparse
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from fake_botapi import FakeBotAPI  # noqa: E402
+
+
+def bot_env(tmp, **extra):
+    env = {k: v for k, v in os.environ.items()
+           if k not in ("BOT_MODE", "WEBHOOK_URL", "RENDER_EXTERNAL_URL", "METRICS_PORT")}
+    env.update(DB_PATH=os.path.join(tmp, "bot.db"), STATE_DB_PATH=os.path.join(tmp, "state.db"),
+               BULK_DIR=tmp, **extra)
+    return env
+
+
+def import_profile(env):
+    """(wall seconds of `import bot99`, [(cumulative us, module)] of bot99's direct imports)."""
+    code = "import time; t = time.perf_counter(); import bot99; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT, env=env,
+                         capture_output=True, text=True, check=True)
+    # a module's imports are listed (one level deeper) right before it
+    direct, pending = [], []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|", 2)
+        if not cumulative.strip().isdigit():
+            continue
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            pending.append((int(cumulative), name.strip()))
+        elif depth == 0:
+            if name.strip() == "bot99":
+                direct = pending
+            pending = []
+    return float(out.stdout.strip().splitlines()[-1]), direct
+
+
+def schema_check(path, runs):
+    """Median seconds of storage.init_schema() on a new and on an up-to-date database."""
+    import storage
+    fresh, current = [], []
+    for i in range(runs):
+        storage.configure(os.path.join(path, f"schema{i}.db"))
+        storage.connection()
+        t = time.perf_counter()
+        storage.init_schema()
+        fresh.append(time.perf_counter() - t)
+        storage.close_all()
+        storage.connection()   # the connection is opened by the first query either way
+        t = time.perf_counter()
+        storage.init_schema()
+        current.append(time.perf_counter() - t)
+    storage.close_all()
+    return statistics.median(fresh), statistics.median(current)
+
+
+def seed(env, users):
+    # an up-to-date database where `users` people generated something recently
+    subprocess.run([sys.executable, "-c", "import bot99"], cwd=ROOT, env=env, check=True,
+                   capture_output=True)
+    import storage
+    storage.configure(env["DB_PATH"])
+    for uid in range(1000, 1000 + users):
+        storage.insert_draft(uid, f"structure of {uid}")
+    storage.close_all()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def time_to_ready(mode, env, fake):
+    """(seconds until the process receives updates, warm-up API calls, seconds until the last one)."""
+    calls = []
+
+    def on_call(method, chat_id, params):
+        if method in ("getChatMember", "getChat", "getUserProfilePhotos"):
+            calls.append(time.perf_counter())
+
+    fake.on_call = on_call
+    fake.first_seen = {}
+    port = free_port()
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "bot99.py", "--" + mode], cwd=ROOT,
+                            env=dict(env, PORT=str(port), BOT_API_URL=fake.url),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        ready = None
+        while ready is None and proc.poll() is None and time.perf_counter() - start < 30:
+            if mode == "polling":
+                # getUpdates is a long poll; count from when it was asked for
+                ready = fake.first_seen.get("getUpdates")
+                time.sleep(0.005)
+                continue
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1).read()
+                ready = time.perf_counter()
+            except OSError:
+                time.sleep(0.005)
+        if ready is None:
+            raise RuntimeError(f"bot99 --{mode} did not come up (exit code {proc.poll()})")
+        # warm-up is done once its API calls stop
+        seen = -1
+        while seen != len(calls):
+            seen = len(calls)
+            time.sleep(0.5)
+        warm = (calls[-1] - start) if calls else 0.0
+        return ready - start, len(calls), warm
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        fake.on_call = None
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--users", type=int, default=20, help="recently active users in the database")
+    ap.add_argument("--top", type=int, default=12, help="how many of bot99's imports to list")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = bot_env(tmp, WARM_UP_USERS=str(args.users))
+        seed(env, args.users)
+        # warm the OS file cache and __pycache__ first; a cold start on the
+        # deploy has compiled .pyc files too
+        import_profile(env)
+        profiles = [import_profile(env) for _ in range(args.runs)]
+        wall = statistics.median(p[0] for p in profiles)
+        print(f"import bot99: {wall * 1000:.0f} ms (median of {args.runs})")
+        costs = {}
+        for _, direct in profiles:
+            for us, name in direct:
+                costs.setdefault(name, []).append(us)
+        ranked = sorted(((statistics.median(v), k) for k, v in costs.items()), reverse=True)
+        for us, name in ranked[:args.top]:
+            print(f"  {name:28s} {us / 1000:7.1f} ms")
+
+        fresh, current = schema_check(tmp, args.runs)
+        print(f"schema check: new database {fresh * 1000:.1f} ms, up to date {current * 1000:.2f} ms")
+
+        fake = FakeBotAPI().start()
+        try:
+            for mode in ("polling", "webhook"):
+                runs = [time_to_ready(mode, env, fake) for _ in range(args.runs)]
+                ready = statistics.median(r[0] for r in runs)
+                warm = statistics.median(r[2] for r in runs)
+                print(f"{mode:8s} receiving updates after {ready * 1000:.0f} ms; "
+                      f"warm-up {runs[-1][1]} API calls, done after {warm * 1000:.0f} ms")
+        finally:
+            fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# bench_storage.py - updates/sec of the DB work done per update, before/after
+# the pooled storage layer.
+#
+# "legacy" replays what bot99 did before storage.py: a fresh sqlite3.connect()
+# + commit + close for every statement in the default rollback-journal mode.
+# "pooled" runs the same update mix through storage.py. "batched" goes through
+# the write-behind queue the way bot99 does: upserts and counters are queued,
+# only the structure insert waits for its row id.
+#
+#   python benchmarks/bench_storage.py [--updates 2000] [--threads 4]
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import storage  # noqa: E402
+import writebehind  # noqa: E402
+
+TEXT = 'PATCH_LIB("libUE4.so", 0xc23fa50, "00 20 70 47");'
+
+
+# ----------------- LEGACY (connect per call) -----------------
+def legacy_init(path):
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, tg_id INTEGER UNIQUE,
+                    username TEXT, full_name TEXT, first_seen INTEGER, structures_count INTEGER DEFAULT 0)""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS structures (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_tg_id INTEGER, text TEXT, created_at INTEGER, saved INTEGER DEFAULT 0)""")
+    conn.commit()
+    conn.close()
+
+
+def legacy_update(path, uid):
+    # ensure_user_record
+    conn = sqlite3.connect(path)
+    cur = conn.cursor()
+    cur.execute("SELECT tg_id FROM users WHERE tg_id = ?", (uid,))
+    if not cur.fetchone():
+        cur.execute("INSERT INTO users (tg_id, username, full_name, first_seen, structures_count) VALUES (?, ?, ?, ?, ?)",
+                    (uid, "u", "User", int(time.time()), 0))
+    else:
+        cur.execute("UPDATE users SET username=?, full_name=? WHERE tg_id=?", ("u", "User", uid))
+    conn.commit()
+    conn.close()
+    # save_structure_to_db
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO structures (user_tg_id, text, created_at, saved) VALUES (?, ?, ?, ?)",
+                 (uid, TEXT, int(time.time()), 0))
+    conn.commit()
+    conn.close()
+    # increment_user_struct_count
+    conn = sqlite3.connect(path)
+    conn.execute("UPDATE users SET structures_count = structures_count + ? WHERE tg_id = ?", (1, uid))
+    conn.commit()
+    conn.close()
+    # last inserted id lookup (pooled path uses the insert's lastrowid)
+    conn = sqlite3.connect(path)
+    conn.execute("SELECT id FROM structures WHERE user_tg_id = ? ORDER BY created_at DESC LIMIT 1", (uid,)).fetchone()
+    conn.close()
+
+
+# ----------------- POOLED (storage.py) -----------------
+def pooled_init(path):
+    storage.configure(path)
+    storage.init_schema()
+
+
+def pooled_update(path, uid):
+    storage.upsert_user(uid, "u", "User")
+    storage.insert_draft(uid, TEXT)
+    storage.increment_structures_count(uid, 1)
+
+
+# ----------------- BATCHED (write-behind queue) -----------------
+_writer = None
+
+
+def batched_init(path):
+    global _writer
+    pooled_init(path)
+    _writer = writebehind.WriteBehindQueue().start()
+
+
+def batched_update(path, uid):
+    _writer.submit(storage.upsert_user, uid, "u", "User")
+    _writer.call(storage.insert_draft, uid, TEXT)
+    _writer.submit(storage.increment_structures_count, uid, 1)
+
+
+def pooled_start(path, uid):
+    storage.upsert_user(uid, "u", "User")
+
+
+def batched_start(path, uid):
+    _writer.submit(storage.upsert_user, uid, "u", "User")
+
+
+def batched_done():
+    _writer.close()
+
+
+def run(name, init, update, updates, threads, users, done=None):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        init(path)
+        per_thread = updates // threads
+        users_per_thread = max(1, users // threads)
+        errors = []
+
+        def worker(tid):
+            # disjoint user ranges per thread, like distinct chats hitting the bot
+            for i in range(per_thread):
+                try:
+                    update(path, tid * users_per_thread + i % users_per_thread)
+                except sqlite3.Error as e:
+                    errors.append(e)
+
+        ts = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+        start = time.perf_counter()
+        for t in ts:
+            t.start()
+        for t in ts:
+            t.join()
+        if done:
+            done()
+        elapsed = time.perf_counter() - start
+        storage.close_all()
+    rate = per_thread * threads / elapsed
+    print(f"{name:8s} {per_thread * threads:7d} updates in {elapsed:7.3f}s  -> {rate:9.1f} updates/sec"
+          f"  ({len(errors)} failed)")
+    return rate
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--updates", type=int, default=2000)
+    ap.add_argument("--threads", type=int, default=4)
+    ap.add_argument("--users", type=int, default=500)
+    args = ap.parse_args()
+    before = run("legacy", legacy_init, legacy_update, args.updates, args.threads, args.users)
+    after = run("pooled", pooled_init, pooled_update, args.updates, args.threads, args.users)
+    batched = run("batched", batched_init, batched_update, args.updates, args.threads, args.users, batched_done)
+    print(f"speedup: pooled {after / before:.1f}x, batched {batched / before:.1f}x")
+    print("/start burst (user upserts only):")
+    pooled = run("pooled", pooled_init, pooled_start, args.updates, args.threads, args.users)
+    batched = run("batched", batched_init, batched_start, args.updates, args.threads, args.users, batched_done)
+    print(f"speedup: batched {batched / pooled:.1f}x over pooled")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+# fake_botapi.py - local stand-in for the Telegram Bot API, for load tests
+#
+# Answers the methods bot99 uses with well-formed results, records every
+# call, and can inject latency, 429s (random, or by enforcing Telegram's
+# send limits the way the real API does) and 5xx failures. Point telebot at
+# it with:
+#
+#   telebot.apihelper.API_URL  = fake.url + "/bot{0}/{1}"
+#   telebot.apihelper.FILE_URL = fake.url + "/file/bot{0}/{1}"
+#
+# (FakeBotAPI.install() does exactly that; bot99 does it for BOT_API_URL).
+# Standalone, for a bot started separately:
+#
+#   python benchmarks/fake_botapi.py [--port 8081] [--latency-ms 40] [--fail-rate 0.01]
+#   BOT_API_URL=http://127.0.0.1:8081 python bot99.py --polling
+#
+# GET /_stats returns the call counts as JSON.
+
+import argparse
+import email.parser
+import email.policy
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# methods that put something in front of the user (what a reply latency is measured to)
+REPLY_METHODS = frozenset(("sendMessage", "sendPhoto", "sendDocument", "editMessageText",
+                           "editMessageReplyMarkup", "answerCallbackQuery"))
+SEND_METHODS = frozenset(("sendMessage", "sendPhoto", "sendDocument"))
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+class FakeBotAPI:
+    """Threaded HTTP server speaking enough of the Bot API for bot99.
+
+    latency/jitter are seconds added to every request; rate_limit_rate and
+    fail_rate are the fractions of requests answered 429 / 500 at random;
+    enforce_limits answers 429 + retry_after when a chat or the bot exceeds
+    Telegram's send limits (chat_rate per second with chat_burst, global_rate
+    per second overall). on_call(method, chat_id, params), if set, is called
+    after each successful request. fail_next[method] = [429, 500, ...] answers
+    that method's next requests with those errors; uploads records the size
+    of every file sent, failed attempts included.
+    """
+
+    def __init__(self, port=0, latency=0.0, jitter=0.0, rate_limit_rate=0.0, fail_rate=0.0,
+                 enforce_limits=False, global_rate=30, chat_rate=1.0, chat_burst=3,
+                 member_status="member", seed=None):
+        # imported here, not at the top: outbox reads its limits from the
+        # environment on import, and replay.py sets them after importing us
+        from outbox import TokenBucket
+        self._bucket = TokenBucket
+        self.latency, self.jitter = latency, jitter
+        self.rate_limit_rate, self.fail_rate = rate_limit_rate, fail_rate
+        self.enforce_limits = enforce_limits
+        self.member_status = member_status
+        self.on_call = None
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chat_rate, self._chat_burst = chat_rate, chat_burst
+        self._chats = {}
+        self._files = {}
+        self._message_id = 0
+        self.calls = {}            # method -> count
+        self.limited = {}          # method -> 429s answered
+        self.failed = {}           # method -> 500s answered
+        self.sent_bytes = 0
+        self.last_markup = {}      # chat id -> last reply_markup sent to it
+        self.first_seen = {}       # method -> perf_counter() when it was first requested
+        self.blocked = set()       # chat ids whose user "blocked the bot" (sends answer 403)
+        self.uploads = []          # (method, chat id, bytes of the file) per multipart request
+        self.fail_next = {}        # method -> error codes (429 / 500) to answer its next requests with
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # headers and body go out as two writes; with Nagle on, the body
+            # waits for the client's delayed ACK (~40ms per request)
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                fake._handle(self)
+
+            def do_POST(self):
+                fake._handle(self)
+
+        class Server(ThreadingHTTPServer):
+            # the default listen backlog of 5 drops connects under load (1s+ SYN retries)
+            request_queue_size = 256
+            daemon_threads = True
+
+        self.server = Server(("127.0.0.1", port), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self._thread = None
+
+    # ----------------- LIFECYCLE -----------------
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="fake-botapi", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def install(self):
+        """Point this process's telebot at the fake."""
+        from telebot import apihelper
+        apihelper.API_URL = self.url + "/bot{0}/{1}"
+        apihelper.FILE_URL = self.url + "/file/bot{0}/{1}"
+        return self
+
+    def add_file(self, file_id: str, data: bytes):
+        """Make data downloadable as file_id (getFile + FILE_URL)."""
+        with self._lock:
+            self._files[file_id] = data
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"calls": dict(self.calls), "rate_limited": dict(self.limited),
+                    "failed": dict(self.failed), "sent_bytes": self.sent_bytes}
+
+    # ----------------- REQUESTS -----------------
+    def _handle(self, req):
+        parts = urlsplit(req.path)
+        length = int(req.headers.get("Content-Length") or 0)
+        body = req.rfile.read(length) if length else b""
+        path = parts.path.strip("/").split("/")
+        if path == ["_stats"]:
+            return self._reply(req, 200, self.stats())
+        if len(path) >= 3 and path[0] == "file":
+            data = self._files.get(path[-1].rsplit(".", 1)[0])
+            if data is None:
+                return self._reply(req, 404, {"ok": False, "error_code": 404, "description": "Not Found"})
+            return self._reply(req, 200, data)
+        if len(path) != 2 or not path[0].startswith("bot"):
+            return self._reply(req, 404, {"ok": False, "error_code": 404, "description": "Not Found"})
+        method = path[1]
+        params = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        ctype = req.headers.get("Content-Type", "")
+        if ctype.startswith("application/x-www-form-urlencoded"):
+            params.update({k: v[-1] for k, v in parse_qs(body.decode()).items()})
+        elif ctype.startswith("application/json") and body:
+            params.update(json.loads(body))
+        elif ctype.startswith("multipart/form-data"):
+            files = _multipart(ctype, body, params)
+            with self._lock:
+                self.uploads.extend((method, _int(params.get("chat_id")), len(data)) for data in files)
+
+        if method not in self.first_seen:
+            with self._lock:
+                self.first_seen.setdefault(method, time.perf_counter())
+        if self.latency or self.jitter:
+            time.sleep(self.latency + self._rng.random() * self.jitter)
+        chat_id = _int(params.get("chat_id"))
+        error = self._inject(method, chat_id)
+        if error is not None:
+            return self._reply(req, error["error_code"], error)
+        result = self._result(method, params, chat_id)
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            self.sent_bytes += len(body) + len(parts.query)
+            if "reply_markup" in params:
+                self.last_markup[chat_id] = params["reply_markup"]
+        self._reply(req, 200, {"ok": True, "result": result})
+        if self.on_call is not None:
+            self.on_call(method, chat_id, params)
+
+    def _inject(self, method, chat_id):
+        if method in SEND_METHODS and chat_id in self.blocked:
+            return {"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"}
+        with self._lock:
+            if self.fail_next.get(method):
+                code = self.fail_next[method].pop(0)
+                counts = self.limited if code == 429 else self.failed
+                counts[method] = counts.get(method, 0) + 1
+                if code == 429:
+                    return {"ok": False, "error_code": 429, "description": "Too Many Requests: retry later",
+                            "parameters": {"retry_after": 1}}
+                return {"ok": False, "error_code": code, "description": "Internal Server Error"}
+            if self._rng.random() < self.fail_rate:
+                self.failed[method] = self.failed.get(method, 0) + 1
+                return {"ok": False, "error_code": 500, "description": "Internal Server Error"}
+            wait = 0.0
+            if self._rng.random() < self.rate_limit_rate:
+                wait = 1 + self._rng.random() * 2
+            elif self.enforce_limits and method in SEND_METHODS and chat_id is not None:
+                now = time.monotonic()
+                bucket = self._chats.setdefault(chat_id, self._bucket(self._chat_rate, self._chat_burst))
+                wait = max(self._global.delay(now), bucket.delay(now))
+                if not wait:
+                    self._global.take(now)
+                    bucket.take(now)
+            if wait:
+                self.limited[method] = self.limited.get(method, 0) + 1
+                return {"ok": False, "error_code": 429, "description": "Too Many Requests: retry later",
+                        "parameters": {"retry_after": max(1, round(wait))}}
+        return None
+
+    def _result(self, method, params, chat_id):
+        now = int(time.time())
+        user_id = _int(params.get("user_id")) or chat_id or 1
+        user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+        if method in SEND_METHODS or method == "editMessageText":
+            with self._lock:
+                self._message_id += 1
+                message_id = _int(params.get("message_id")) or self._message_id
+            msg = {"message_id": message_id, "date": now, "chat": {"id": chat_id, "type": "private"},
+                   "from": {"id": 1, "is_bot": True, "first_name": "bot99"}}
+            if "text" in params:
+                msg["text"] = params["text"]
+            return msg
+        if method == "getChatMember":
+            return {"status": self.member_status, "user": user}
+        if method == "getChat":
+            return {"id": user_id, "type": "private", "first_name": user["first_name"], "username": user["username"]}
+        if method == "getUserProfilePhotos":
+            return {"total_count": 0, "photos": []}
+        if method == "getFile":
+            file_id = params.get("file_id", "")
+            size = len(self._files.get(file_id, b""))
+            return {"file_id": file_id, "file_unique_id": file_id, "file_size": size,
+                    "file_path": f"documents/{file_id}.txt"}
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "bot99", "username": "bot99_fake_bot"}
+        if method == "getUpdates":
+            # nothing to deliver: behave like an idle long poll
+            time.sleep(min(float(params.get("timeout") or 0), 1.0))
+            return []
+        return True
+
+    @staticmethod
+    def _reply(req, status, payload):
+        data = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        req.send_response(status)
+        req.send_header("Content-Type", "application/octet-stream" if isinstance(payload, bytes)
+                        else "application/json")
+        req.send_header("Content-Length", str(len(data)))
+        req.end_headers()
+        req.wfile.write(data)
+
+
+def _multipart(ctype, body, params):
+    """Add a multipart/form-data body's fields to params; returns the files' contents."""
+    msg = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        b"Content-Type: " + ctype.encode() + b"\r\n\r\n" + body)
+    files = []
+    for part in msg.iter_parts():
+        data = part.get_payload(decode=True) or b""
+        if part.get_filename() is not None:
+            files.append(data)
+        else:
+            params[part.get_param("name", header="content-disposition")] = data.decode()
+    return files
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=8081)
+    ap.add_argument("--latency-ms", type=float, default=0)
+    ap.add_argument("--jitter-ms", type=float, default=0)
+    ap.add_argument("--rate-limit-rate", type=float, default=0, help="fraction of requests answered 429")
+    ap.add_argument("--fail-rate", type=float, default=0, help="fraction of requests answered 500")
+    ap.add_argument("--enforce-limits", action="store_true", help="429 sends over Telegram's limits")
+    args = ap.parse_args()
+    fake = FakeBotAPI(args.port, args.latency_ms / 1000, args.jitter_ms / 1000, args.rate_limit_rate,
+                      args.fail_rate, args.enforce_limits).start()
+    print(f"fake Bot API on {fake.url} - start the bot with BOT_API_URL={fake.url}")
+    try:
+        while True:
+            time.sleep(10)
+            print(fake.stats())
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# loadgen_webhook.py - POST synthetic Telegram updates at the webhook receiver
+#
+# Against a running bot (python bot99.py --webhook):
+#   python benchmarks/loadgen_webhook.py --url http://127.0.0.1:8080/telegram/webhook --secret <WEBHOOK_SECRET>
+#
+# Without any bot or network: --serve-stub starts the webhook app in-process
+# with a stub bot whose handler just sleeps --handler-ms, which measures the
+# receiver + dispatcher alone.
+
+import argparse
+import http.client
+import json
+import os
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def synthetic_update(update_id, user_id):
+    now = int(time.time())
+    user = {"id": user_id, "is_bot": False, "first_name": f"Load{user_id}", "username": f"load{user_id}"}
+    if update_id % 3 == 0:
+        return {"update_id": update_id, "callback_query": {
+            "id": str(update_id), "from": user, "chat_instance": str(user_id), "data": "bot_info",
+            "message": {"message_id": update_id, "date": now, "chat": {"id": user_id, "type": "private"},
+                        "from": user, "text": "menu"}}}
+    text = "/start" if update_id % 3 == 1 else "0xc23fa50"
+    entities = [{"type": "bot_command", "offset": 0, "length": 6}] if text == "/start" else None
+    msg = {"message_id": update_id, "date": now, "chat": {"id": user_id, "type": "private"},
+           "from": user, "text": text}
+    if entities:
+        msg["entities"] = entities
+    return {"update_id": update_id, "message": msg}
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def run_load(url, secret, total, concurrency, users):
+    parts = urlsplit(url)
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+    counter = iter(range(total))
+    headers = {"Content-Type": "application/json"}
+    if secret:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = secret
+
+    def worker():
+        conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+        local_lat, local_status = [], {}
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                break
+            body = json.dumps(synthetic_update(i + 1, 100000 + i % users))
+            start = time.perf_counter()
+            conn.request("POST", parts.path, body=body, headers=headers)
+            resp = conn.getresponse()
+            resp.read()
+            local_lat.append(time.perf_counter() - start)
+            local_status[resp.status] = local_status.get(resp.status, 0) + 1
+        conn.close()
+        with lock:
+            latencies.extend(local_lat)
+            for k, v in local_status.items():
+                statuses[k] = statuses.get(k, 0) + v
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    print(f"{total} updates in {elapsed:.2f}s -> {total / elapsed:.0f} updates/sec")
+    print(f"ack latency p50={percentile(latencies, 50) * 1000:.2f}ms p99={percentile(latencies, 99) * 1000:.2f}ms")
+    print(f"status codes: {statuses}")
+
+
+class StubBot:
+    threaded = False
+
+    def __init__(self, handler_ms):
+        self.handler_s = handler_ms / 1000.0
+        self.handled = 0
+
+    def process_new_updates(self, updates):
+        time.sleep(self.handler_s)
+        self.handled += len(updates)
+
+
+def serve_stub(port, handler_ms, workers):
+    import asyncio
+    import uvicorn
+    import webhook
+    from dispatcher import UpdateDispatcher
+
+    stub = StubBot(handler_ms)
+    dispatcher = UpdateDispatcher(stub, workers=workers)
+    app = webhook.create_app(stub, dispatcher)
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning",
+                                           access_log=False))
+    thread = threading.Thread(target=lambda: asyncio.run(server.serve()), daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread, stub, dispatcher
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url", default="http://127.0.0.1:8080/telegram/webhook")
+    ap.add_argument("--secret", default=os.environ.get("WEBHOOK_SECRET", ""))
+    ap.add_argument("--requests", type=int, default=5000)
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--users", type=int, default=1000)
+    ap.add_argument("--serve-stub", action="store_true")
+    ap.add_argument("--port", type=int, default=18080)
+    ap.add_argument("--handler-ms", type=float, default=20.0)
+    ap.add_argument("--workers", type=int, default=16)
+    args = ap.parse_args()
+
+    url, secret = args.url, args.secret
+    if args.serve_stub:
+        import webhook
+        server, thread, stub, dispatcher = serve_stub(args.port, args.handler_ms, args.workers)
+        url, secret = f"http://127.0.0.1:{args.port}{webhook.WEBHOOK_PATH}", ""
+    run_load(url, secret, args.requests, args.concurrency, args.users)
+    if args.serve_stub:
+        start = time.perf_counter()
+        server.should_exit = True
+        thread.join()
+        print(f"handled {stub.handled} updates; drained backlog in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
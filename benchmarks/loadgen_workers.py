@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# loadgen_workers.py - updates/sec of the real bot99 handlers run by 1..N
+# worker processes (workers.py), on a temp DB, with the Bot API stubbed out.
+#
+# Every synthetic user walks the multi-offset flow (menu -> offsets ->
+# struct type -> hex bytes -> lib), so each run parses and generates
+# structures, writes drafts through the single writer and keeps flow state
+# in the shared sqlite state store. Throughput should scale with the number
+# of workers up to the number of cores.
+#
+#   python benchmarks/loadgen_workers.py [--workers 1,2,4] [--users 2000] [--offsets 60]
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import telebot  # noqa: E402
+
+
+def stub_api(bot99):
+    # runs in each worker: no network, every Bot API call succeeds
+    api_s = float(os.environ.get("LOADGEN_API_MS", "0")) / 1000
+
+    def ok(*args, **kwargs):
+        if api_s:
+            time.sleep(api_s)
+        return True
+
+    for name in ("send_message", "send_photo", "send_document", "edit_message_text",
+                 "edit_message_reply_markup", "answer_callback_query"):
+        setattr(bot99.bot, name, ok)
+    member = telebot.types.ChatMember.de_json(json.dumps(
+        {"status": "member", "user": {"id": 1, "is_bot": False, "first_name": "x"}}))
+    bot99.bot.get_chat_member = lambda chat, user: member
+
+
+def flow_updates(first_id, user_id, offsets):
+    user = {"id": user_id, "is_bot": False, "first_name": f"Load{user_id}"}
+    chat = {"id": user_id, "type": "private"}
+    text = "\n".join(f"0x{0xC23FA50 + (user_id * 97 + k) * 4:X}" for k in range(offsets))
+    steps = [("cb", "simple_multi"), ("msg", text), ("cb", "stype_patch"), ("cb", "hex_0"), ("cb", "lib_ue4")]
+    for n, (kind, data) in enumerate(steps):
+        uid = first_id + n
+        if kind == "msg":
+            raw = {"update_id": uid, "message": {"message_id": uid, "date": 0, "chat": chat, "from": user,
+                                                 "text": data}}
+        else:
+            raw = {"update_id": uid, "callback_query": {
+                "id": str(uid), "from": user, "chat_instance": "1", "data": data,
+                "message": {"message_id": uid, "date": 0, "chat": chat, "text": "menu"}}}
+        yield telebot.types.Update.de_json(json.dumps(raw))
+
+
+def run(workers, users, offsets, tmp):
+    import storage
+    import writebehind
+    from workers import WorkerPool, worker_main  # noqa: F401  (spawned workers import it)
+
+    db = os.path.join(tmp, f"bench{workers}.db")
+    os.environ["DB_PATH"] = db
+    os.environ["STATE_DB_PATH"] = os.path.join(tmp, f"state{workers}.db")
+    storage.configure(db)
+    storage.init_schema()
+    writer = writebehind.WriteBehindQueue()
+    updates = []
+    for u in range(users):
+        updates.extend(flow_updates(len(updates) + 1, 100000 + u, offsets))
+    # interleave users the way real traffic arrives (step 1 of every user, then step 2, ...)
+    updates.sort(key=lambda up: ((up.update_id - 1) % 5, up.update_id))
+
+    pool = WorkerPool(types.SimpleNamespace(), writer, workers=workers, init=stub_api).start()
+    start = time.perf_counter()
+    for update in updates:
+        while pool.feed_nowait(update) is None:
+            time.sleep(0.001)
+    pool.close(timeout=600)
+    elapsed = time.perf_counter() - start
+    writer.close()
+    drafts = storage.fetchone("SELECT COUNT(*) FROM drafts")[0]
+    storage.close_all()
+    return len(updates), elapsed, drafts
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", default="1,2,4")
+    ap.add_argument("--users", type=int, default=2000)
+    ap.add_argument("--offsets", type=int, default=60)
+    ap.add_argument("--api-ms", type=float, default=0, help="simulated Bot API latency per call")
+    args = ap.parse_args()
+    os.environ["LOADGEN_API_MS"] = str(args.api_ms)
+    os.environ["STATE_BACKEND"] = "sqlite"
+    # the Bot API is stubbed, so don't pace replies to its limits
+    for name in ("OUTBOX_GLOBAL_RATE", "OUTBOX_CHAT_RATE", "OUTBOX_CHAT_BURST"):
+        os.environ[name] = "1000000"
+    print(f"cpu cores: {os.cpu_count()}")
+    base = None
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["BULK_DIR"] = tmp
+        for n in (int(w) for w in args.workers.split(",")):
+            total, elapsed, drafts = run(n, args.users, args.offsets, tmp)
+            rate = total / elapsed
+            base = base or rate
+            ok = "ok" if drafts == args.users else f"MISMATCH: {drafts} drafts for {args.users} users"
+            print(f"{n:2d} workers: {total} updates in {elapsed:.2f}s -> {rate:7.0f} updates/s "
+                  f"({rate / base:.2f}x)  [{ok}]")
+
+
+if __name__ == "__main__":
+    main()
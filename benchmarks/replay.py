@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+# replay.py - replay synthetic user sessions through bot99's real handlers
+# against the fake Bot API (fake_botapi.py) and report latency, throughput
+# and DB size.
+#
+# Sessions arrive at --rate per second. Each one is a new user doing /start,
+# one generation flow (single / multi / .txt upload / hook), then maybe Save
+# and maybe Settings -> View Saved -> next page. Like a real user it sends
+# the next step only once the bot has answered the previous one and gone
+# quiet (no reply for --quiet-ms, so a step's later replies aren't taken for
+# the next step's), plus up to --think-ms. "Reply latency" is the time from
+# handing an update to the bot until the first Bot API call answering it
+# reaches the fake server; it includes the outbox's per-chat pacing (about
+# one message per second per chat) unless --no-pacing.
+#
+#   python benchmarks/replay.py [--sessions 300] [--rate 20] [--workers 0]
+#       [--latency-ms 30] [--fail-rate 0.01] [--rate-limit-rate 0.01] [--enforce-limits]
+#       [--json report.json] [--baseline old.json --tolerance 0.25]
+#
+# With --baseline the run exits 1 when p99 reply latency, throughput or DB
+# bytes per session got worse than the baseline by more than --tolerance.
+#
+# Without --workers it then sends an /export whose upload the fake answers
+# with a 429 once, and exits 1 unless the retry uploaded the whole file again.
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import telebot  # noqa: E402
+from fake_botapi import FakeBotAPI, REPLY_METHODS, percentile  # noqa: E402
+
+FLOWS = ("single", "multi", "upload", "hook")
+
+
+# ----------------- SESSIONS -----------------
+def session_steps(rng, args):
+    """The steps of one session: (kind, data), kind in msg/cb/doc/save/page."""
+    steps = [("msg", "/start")]
+    flow = rng.choices(FLOWS, weights=args.mix)[0]
+    stype = [("cb", rng.choice(("stype_patch", "stype_memory"))), ("cb", f"hex_{rng.randrange(3)}")]
+    lib = ("cb", rng.choice(("lib_ue4", "lib_anogs", "lib_anort")))
+    if flow == "single":
+        steps += [("cb", "simple_structure"), ("cb", "simple_single"), ("msg", random_offset(rng))]
+        steps += stype + [lib]
+    elif flow == "multi":
+        text = "\n".join(random_offset(rng) for _ in range(rng.randint(2, args.offsets)))
+        steps += [("cb", "simple_structure"), ("cb", "simple_multi"), ("msg", text)] + stype + [lib]
+    elif flow == "upload":
+        steps += [("cb", "simple_structure"), ("cb", "simple_multi"), ("doc", args.upload_offsets)]
+        steps += stype + [lib]
+    else:
+        steps += [("cb", "hook_structure"), ("msg", random_offset(rng)), ("msg", "connect1,connect2"), lib]
+    if rng.random() < args.save_rate:
+        steps.append(("save", None))
+    if rng.random() < args.view_rate:
+        steps += [("cb", "settings"), ("cb", "view_saved"), ("page", None)]
+    return steps
+
+
+def random_offset(rng):
+    return f"0x{rng.randrange(0x100000, 0xFFFFFFF) & ~3:X}"
+
+
+def make_update(update_id, user_id, kind, data):
+    user = {"id": user_id, "is_bot": False, "first_name": f"Replay{user_id}", "username": f"replay{user_id}"}
+    chat = {"id": user_id, "type": "private"}
+    now = int(time.time())
+    if kind == "cb":
+        return {"update_id": update_id, "callback_query": {
+            "id": str(update_id), "from": user, "chat_instance": str(user_id), "data": data,
+            "message": {"message_id": update_id, "date": now, "chat": chat, "text": "menu"}}}
+    msg = {"message_id": update_id, "date": now, "chat": chat, "from": user}
+    if kind == "doc":
+        msg["document"] = {"file_id": data, "file_unique_id": data, "file_name": "offsets.txt",
+                           "mime_type": "text/plain"}
+    else:
+        msg["text"] = data
+        if data.startswith("/"):
+            msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(data)}]
+    return {"update_id": update_id, "message": msg}
+
+
+def markup_button(fake, chat_id, prefix):
+    # callback data of a button the bot last sent this chat, e.g. its Save button
+    raw = fake.last_markup.get(chat_id)
+    if not raw:
+        return None
+    for row in json.loads(raw).get("inline_keyboard", []):
+        for button in row:
+            if button.get("callback_data", "").startswith(prefix):
+                return button["callback_data"]
+    return None
+
+
+class Replay:
+    def __init__(self, args, fake, feed):
+        self.args, self.fake, self.feed = args, fake, feed
+        self.rng = random.Random(args.seed)
+        self.loop = None
+        self.waiting = {}          # chat id -> future resolved by its next reply
+        self.last_reply = {}       # chat id -> perf_counter() of its latest reply
+        self.callbacks = {}        # callback query id -> chat id (answerCallbackQuery has no chat)
+        self.update_id = 0
+        self.latency = {}          # route -> [seconds]
+        self.timeouts = {}         # route -> steps that got no reply within --step-timeout
+        self.updates = 0
+        fake.on_call = self._on_call
+
+    def _on_call(self, method, chat_id, params):
+        # fake server thread
+        if chat_id is None and method == "answerCallbackQuery":
+            chat_id = self.callbacks.pop(str(params.get("callback_query_id")), None)
+        # after the run (late replies, the retried upload check) nobody is waiting
+        if method in REPLY_METHODS and self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._resolve, chat_id)
+
+    def _resolve(self, chat_id):
+        self.last_reply[chat_id] = time.perf_counter()
+        fut = self.waiting.pop(chat_id, None)
+        if fut is not None and not fut.done():
+            fut.set_result(time.perf_counter())
+
+    async def session(self, user_id, steps):
+        from dispatcher import update_route
+        for kind, data in steps:
+            if kind == "save":
+                kind, data = "cb", markup_button(self.fake, user_id, "save_struct:") or "save_struct:pending"
+            elif kind == "page":
+                data = markup_button(self.fake, user_id, "saved:")
+                if data is None:
+                    continue
+                kind = "cb"
+            elif kind == "doc":
+                file_id = f"offsets{user_id}"
+                rng = random.Random(user_id)
+                self.fake.add_file(file_id, "\n".join(random_offset(rng) for _ in range(data)).encode())
+                data = file_id
+            self.update_id += 1
+            if kind == "cb":
+                self.callbacks[str(self.update_id)] = user_id
+            update = telebot.types.Update.de_json(json.dumps(make_update(self.update_id, user_id, kind, data)))
+            fut = self.loop.create_future()
+            self.waiting[user_id] = fut
+            start = time.perf_counter()
+            await self.feed(update)
+            self.updates += 1
+            try:
+                done = await asyncio.wait_for(fut, self.args.step_timeout)
+                self.latency.setdefault(update_route(update), []).append(done - start)
+            except asyncio.TimeoutError:
+                self.waiting.pop(user_id, None)
+                route = update_route(update)
+                self.timeouts[route] = self.timeouts.get(route, 0) + 1
+            quiet = self.args.quiet_ms / 1000
+            while True:
+                idle = time.perf_counter() - self.last_reply.get(user_id, 0)
+                if idle >= quiet:
+                    break
+                await asyncio.sleep(quiet - idle)
+            if self.args.think_ms:
+                await asyncio.sleep(self.rng.random() * self.args.think_ms / 1000)
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        tasks = []
+        start = time.perf_counter()
+        for i in range(self.args.sessions):
+            steps = session_steps(self.rng, self.args)
+            tasks.append(asyncio.create_task(self.session(self.args.first_user + i, steps)))
+            await asyncio.sleep(self.rng.expovariate(self.args.rate))
+        await asyncio.gather(*tasks)
+        return time.perf_counter() - start
+
+
+# ----------------- RUN -----------------
+def retried_upload(bot99, fake, chat_id):
+    """Sizes of each attempt to upload an export whose first attempt gets a 429."""
+    bot99.db_writer.flush()
+    fake.fail_next["sendDocument"] = [429]
+    first = len(fake.uploads)
+    bot99.send_export(chat_id, "users", "csv")
+    return [size for method, chat, size in fake.uploads[first:] if method == "sendDocument" and chat == chat_id]
+
+
+def upload_ok(sizes):
+    return len(sizes) == 2 and sizes[0] == sizes[1] > 0
+
+
+def run(args, tmp):
+    import storage
+    import metrics
+    import writebehind
+
+    os.environ["DB_PATH"] = db_path = os.path.join(tmp, "replay.db")
+    os.environ["STATE_DB_PATH"] = os.path.join(tmp, "state.db")
+    os.environ["BULK_DIR"] = tmp
+    fake = FakeBotAPI(latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000,
+                      rate_limit_rate=args.rate_limit_rate, fail_rate=args.fail_rate,
+                      enforce_limits=args.enforce_limits, seed=args.seed).start()
+    # read by bot99 here and in worker processes
+    os.environ["BOT_API_URL"] = fake.url
+    outbox = None
+    if args.workers:
+        from workers import WorkerPool
+        os.environ.setdefault("STATE_BACKEND", "sqlite")
+        storage.configure(db_path)
+        storage.init_schema()
+        writer = writebehind.WriteBehindQueue()
+        dispatcher = WorkerPool(types.SimpleNamespace(), writer, workers=args.workers).start()
+    else:
+        import bot99
+        from dispatcher import UpdateDispatcher
+        writer, outbox = bot99.db_writer, bot99.outbox
+        dispatcher = UpdateDispatcher(bot99.bot)
+
+    replay = Replay(args, fake, dispatcher.feed)
+
+    async def main():
+        elapsed = await replay.run()
+        await dispatcher.shutdown()
+        return elapsed
+
+    elapsed = asyncio.run(main())
+    upload = retried_upload(bot99, fake, args.first_user - 1) if outbox is not None else None
+    if outbox is not None:
+        outbox.close()
+        report_outbox = outbox.stats()
+    else:
+        report_outbox = None
+    writer.close()
+    storage.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    space = storage.space_used()
+    rows = {t: storage.fetchone(f"SELECT COUNT(*) FROM {t}")[0]
+            for t in ("users", "drafts", "saved_structures", "structure_blobs")}
+    storage.close_all()
+    fake.stop()
+
+    data = metrics.collect()
+    _, _, _, buckets, series = data["bot_handler_seconds"]
+    handler = [sum(col) for col in zip(*series.values())] if series else []
+    every = [s for values in replay.latency.values() for s in values]
+    return {
+        "sessions": args.sessions, "updates": replay.updates, "seconds": round(elapsed, 3),
+        "sessions_per_s": round(args.sessions / elapsed, 2), "updates_per_s": round(replay.updates / elapsed, 2),
+        "timeouts": replay.timeouts,
+        "reply_p50_ms": round(percentile(every, 50) * 1000, 2),
+        "reply_p90_ms": round(percentile(every, 90) * 1000, 2),
+        "reply_p99_ms": round(percentile(every, 99) * 1000, 2),
+        "reply_by_route": {route: {"n": len(v), "p50_ms": round(percentile(v, 50) * 1000, 2),
+                                   "p99_ms": round(percentile(v, 99) * 1000, 2)}
+                           for route, v in sorted(replay.latency.items())},
+        "handler_p50_ms": round(metrics.quantile(buckets, handler, 0.5) * 1000, 2) if handler else 0,
+        "handler_p99_ms": round(metrics.quantile(buckets, handler, 0.99) * 1000, 2) if handler else 0,
+        "bot_api": fake.stats(),
+        "outbox": report_outbox,
+        "db_bytes": space["bytes"], "db_free_bytes": space["free_bytes"],
+        "db_bytes_per_session": round(space["bytes"] / args.sessions),
+        "rows": rows,
+        "retried_upload_bytes": upload,
+    }
+
+
+def print_report(r):
+    print(f"{r['sessions']} sessions / {r['updates']} updates in {r['seconds']:.1f}s -> "
+          f"{r['sessions_per_s']:.1f} sessions/s, {r['updates_per_s']:.1f} updates/s, {sum(r['timeouts'].values())} step timeouts"
+          + (f" {r['timeouts']}" if r["timeouts"] else ""))
+    print(f"reply latency p50={r['reply_p50_ms']:.1f}ms p90={r['reply_p90_ms']:.1f}ms p99={r['reply_p99_ms']:.1f}ms"
+          f"   handler time p50<={r['handler_p50_ms']:.1f}ms p99<={r['handler_p99_ms']:.1f}ms (bucket bounds)")
+    for route, v in r["reply_by_route"].items():
+        print(f"  {route:22s} n={v['n']:5d}  p50={v['p50_ms']:8.1f}ms  p99={v['p99_ms']:8.1f}ms")
+    api = r["bot_api"]
+    print(f"Bot API calls: {api['calls']}")
+    if api["rate_limited"] or api["failed"]:
+        print(f"  answered 429: {api['rate_limited']}  500: {api['failed']}")
+    if r["outbox"]:
+        ob = r["outbox"]
+        print(f"outbox: sent {ob['sent']}, merged {ob['coalesced']}, rate-limited {ob['rate_limited']}, "
+              f"retries {ob['retries']}, failed {ob['failed']}")
+    print(f"DB: {r['db_bytes'] / 1024:.0f} KiB ({r['db_free_bytes'] / 1024:.0f} KiB free), "
+          f"{r['db_bytes_per_session']} bytes/session, rows {r['rows']}")
+    if r["retried_upload_bytes"] is not None:
+        sizes = r["retried_upload_bytes"]
+        print(f"upload retried after a 429: attempts sent {sizes} bytes - "
+              + ("OK" if upload_ok(sizes) else "FAILED, the retry did not send the whole file"))
+
+
+def regressions(r, base, tolerance):
+    out = []
+    checks = (("reply_p99_ms", "p99 reply latency", 1), ("updates_per_s", "throughput", -1),
+              ("db_bytes_per_session", "DB bytes per session", 1))
+    for key, name, worse in checks:
+        old, new = base.get(key), r.get(key)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        if change * worse > tolerance:
+            out.append(f"{name}: {old} -> {new} ({change:+.0%})")
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sessions", type=int, default=300)
+    ap.add_argument("--rate", type=float, default=20, help="new sessions per second")
+    ap.add_argument("--think-ms", type=float, default=200, help="max pause between a user's steps")
+    ap.add_argument("--quiet-ms", type=float, help="wait for this long without replies before the next step "
+                                                   "(default 1500, 150 with --no-pacing)")
+    ap.add_argument("--mix", default="3,4,1,2", help="weights of the single,multi,upload,hook flows")
+    ap.add_argument("--offsets", type=int, default=40, help="max offsets typed in a multi flow")
+    ap.add_argument("--upload-offsets", type=int, default=2000, help="offsets in an uploaded .txt")
+    ap.add_argument("--save-rate", type=float, default=0.5)
+    ap.add_argument("--view-rate", type=float, default=0.3)
+    ap.add_argument("--workers", type=int, default=0, help="run through workers.py with N processes")
+    ap.add_argument("--latency-ms", type=float, default=30, help="fake Bot API latency")
+    ap.add_argument("--jitter-ms", type=float, default=20)
+    ap.add_argument("--fail-rate", type=float, default=0)
+    ap.add_argument("--rate-limit-rate", type=float, default=0)
+    ap.add_argument("--enforce-limits", action="store_true")
+    ap.add_argument("--no-pacing", action="store_true", help="lift the outbox's send limits")
+    ap.add_argument("--step-timeout", type=float, default=30)
+    ap.add_argument("--first-user", type=int, default=500000)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--json", help="write the report here")
+    ap.add_argument("--baseline", help="report JSON of an earlier run to compare with")
+    ap.add_argument("--tolerance", type=float, default=0.25)
+    args = ap.parse_args()
+    args.mix = [float(w) for w in args.mix.split(",")]
+    if args.quiet_ms is None:
+        args.quiet_ms = 150 if args.no_pacing else 1500
+    if args.no_pacing:
+        # must be set before outbox.py is imported (here and in workers)
+        for name in ("OUTBOX_GLOBAL_RATE", "OUTBOX_CHAT_RATE", "OUTBOX_CHAT_BURST"):
+            os.environ[name] = "1000000"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        report = run(args, tmp)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            worse = regressions(report, json.load(f), args.tolerance)
+        for line in worse:
+            print("REGRESSION " + line)
+        if worse:
+            sys.exit(1)
+        print(f"no regression beyond {args.tolerance:.0%} of {args.baseline}")
+    if report["retried_upload_bytes"] is not None and not upload_ok(report["retried_upload_bytes"]):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
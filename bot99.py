@@ -3,154 +3,172 @@
 # Requires: pip install pyTelegramBotAPI
 
 import os
-import sqlite3
+import sys
+import html
 import time
+import atexit
+import signal
+import asyncio
 import logging
-from typing import List
+import itertools
+import threading
+from typing import Iterable, NamedTuple
+# cold-start timing: "listening ... after start" is logged from here
+STARTED = time.perf_counter()
 import telebot
 from telebot.types import (
     InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardRemove, InputMediaPhoto
 )
+from telebot.apihelper import ApiTelegramException
+import storage
+import writebehind
+from dispatcher import UpdateDispatcher
+from outbox import Outbox
+import webhook
+from cache import TTLCache, RefreshingCache
+from state import FlowState, make_store
+import bulk
+import offsets as offset_parser
+import generator
+import metrics
+import router
+import broadcast
+import export
+import maintenance
 
 
 # ----------------- CONFIG -----------------
 BOT_TOKEN = os.environ.get("BOT_TOKEN", "8104847586:AAH22P0YIDtm02mNVzw10GcKc7TabfGka20")
 OWNER_ID = int(os.environ.get("OWNER_ID", "5730398152"))  # change to your telegram id
 CHANNEL_USERNAME = os.environ.get("CHANNEL_USERNAME", "@SRC_HUB")  # channel username to check
+# membership cache: members are re-checked every 10 min, non-members after 30s;
+# when the lookup fails, the last answer (kept for a day) is used for 30s
+MEMBER_CACHE_SIZE = int(os.environ.get("MEMBER_CACHE_SIZE", "50000"))
+MEMBER_TTL_JOINED = int(os.environ.get("MEMBER_TTL_JOINED", "600"))
+MEMBER_TTL_NOT_JOINED = int(os.environ.get("MEMBER_TTL_NOT_JOINED", "30"))
+MEMBER_TTL_ERROR = int(os.environ.get("MEMBER_TTL_ERROR", "30"))
+MEMBER_TTL_KNOWN = int(os.environ.get("MEMBER_TTL_KNOWN", str(24 * 3600)))
+# profile cache: fresh for 5 min, then served stale (up to 1h) while refreshed
+PROFILE_CACHE_SIZE = int(os.environ.get("PROFILE_CACHE_SIZE", "20000"))
+PROFILE_TTL = int(os.environ.get("PROFILE_TTL", "300"))
+PROFILE_MAX_STALE = int(os.environ.get("PROFILE_MAX_STALE", "3600"))
+# "View Saved Structures" pages: at most this many rows, packed into one message
+SAVED_PAGE_ROWS = int(os.environ.get("SAVED_PAGE_ROWS", "8"))
+MAX_MESSAGE_LEN = 4096
+# more offsets than this never fit in one message, so they skip the inline attempt
+INLINE_MAX_OFFSETS = 128
+# after a (cold) start, membership and profile of this many recently active
+# users are fetched in the background; 0 turns the warm-up off
+WARM_UP_USERS = int(os.environ.get("WARM_UP_USERS", "20"))
+# another Bot API server (a local telegram-bot-api, or benchmarks/fake_botapi.py)
+BOT_API_URL = os.environ.get("BOT_API_URL", "").rstrip("/")
 
 if BOT_TOKEN == "REPLACE_WITH_YOUR_TOKEN":
     raise SystemExit("Set BOT_TOKEN in env or edit script before running.")
 
-bot = telebot.TeleBot(BOT_TOKEN, parse_mode="HTML")
+# handlers run on UpdateDispatcher's worker threads, not TeleBot's pool
+bot = telebot.TeleBot(BOT_TOKEN, parse_mode="HTML", threaded=False)
 logging.basicConfig(level=logging.INFO)
-
-DB_PATH = "bot_data.db"
+# latency / error counts of every Bot API request, for /metrics
+metrics.instrument_bot_api()
+if BOT_API_URL:
+    telebot.apihelper.API_URL = BOT_API_URL + "/bot{0}/{1}"
+    telebot.apihelper.FILE_URL = BOT_API_URL + "/file/bot{0}/{1}"
+# handlers queue their replies here; sender threads pace them to the Bot API
+# limits and retry 429s (see outbox.py)
+outbox = Outbox(bot)
+
+DB_PATH = os.environ.get("DB_PATH", "bot_data.db")
+storage.configure(DB_PATH)
 
 # ----------------- DB SETUP -----------------
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY,
-        tg_id INTEGER UNIQUE,
-        username TEXT,
-        full_name TEXT,
-        first_seen INTEGER,
-        structures_count INTEGER DEFAULT 0
-    )""")
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS structures (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_tg_id INTEGER,
-        text TEXT,
-        created_at INTEGER,
-        saved INTEGER DEFAULT 0,
-        FOREIGN KEY(user_tg_id) REFERENCES users(tg_id)
-    )""")
-    conn.commit()
-    conn.close()
+    storage.init_schema()
 
 init_db()
 
-# ----------------- IN-MEM STATE (temporary flows) -----------------
+# single background writer; non-urgent writes are batched into one commit
+# (in a workers.py worker process this forwards to the writer process)
+db_writer = writebehind.open_writer()
+atexit.register(db_writer.close)
+
+# ----------------- CACHES -----------------
+membership_cache = TTLCache(MEMBER_CACHE_SIZE, MEMBER_TTL_JOINED)
+# last successful answer per user: what a failed lookup falls back on
+membership_known = TTLCache(MEMBER_CACHE_SIZE, MEMBER_TTL_KNOWN)
+# filled by load_profile(), defined below
+profile_cache = RefreshingCache(PROFILE_CACHE_SIZE, PROFILE_TTL, PROFILE_MAX_STALE,
+                                loader=lambda user_id: load_profile(user_id))
+# (user id, generator memo key) -> structures row id of that user's last identical result
+generated_rows = TTLCache(generator.MEMO_SIZE, generator.MEMO_TTL)
+
+metrics.watch_caches({"membership": membership_cache, "profile": profile_cache,
+                      "generator": generator.memo, "generated_rows": generated_rows})
+metrics.watch_stats("bot_outbox", outbox.stats,
+                    counters=("sent", "coalesced", "rate_limited", "retries", "failed"),
+                    gauges=("queued", "priority_queued", "in_flight"))
+
+# ----------------- FLOW STATE (temporary flows) -----------------
 # Keep minimal state to guide interactive flows. Persist outputs to DB.
-user_state = {}
-# state example:
-# user_state[user_id] = {
-#    "flow": "simple_single" | "simple_multi" | "hook",
-#    "step": 1,
-#    "offsets": [],
-#    "selected_struct_type": None, # "PATCH_LIB" or "MemoryPatch" or "HOOK_LIB"
-#    "selected_lib": None,
-#    "connect_params": None
-# }
+# user_state.get(user_id) -> FlowState or None; entries expire after STATE_TTL
+# and must be set() again after changing them (the sqlite backend stores a copy).
+user_state = make_store()
 
 # ----------------- HELPERS -----------------
-def db_conn():
-    return sqlite3.connect(DB_PATH)
-
 def ensure_user_record(tg_user):
-    conn = db_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT tg_id FROM users WHERE tg_id = ?", (tg_user.id,))
-    row = cur.fetchone()
-    if not row:
-        cur.execute(
-            "INSERT INTO users (tg_id, username, full_name, first_seen, structures_count) VALUES (?, ?, ?, ?, ?)",
-            (tg_user.id, tg_user.username or "", (tg_user.first_name or "") + (" " + (tg_user.last_name or "") if tg_user.last_name else ""), int(time.time()), 0)
-        )
-        conn.commit()
-    else:
-        # update username/fullname if changed
-        cur.execute("UPDATE users SET username=?, full_name=? WHERE tg_id=?",
-                    (tg_user.username or "", (tg_user.first_name or "") + (" " + (tg_user.last_name or "") if tg_user.last_name else ""), tg_user.id))
-        conn.commit()
-    conn.close()
+    full_name = (tg_user.first_name or "") + (" " + (tg_user.last_name or "") if tg_user.last_name else "")
+    db_writer.submit(storage.upsert_user, tg_user.id, tg_user.username or "", full_name)
 
 def increment_user_struct_count(tg_id, amount=1):
-    conn = db_conn()
-    cur = conn.cursor()
-    cur.execute("UPDATE users SET structures_count = structures_count + ? WHERE tg_id = ?", (amount, tg_id))
-    conn.commit()
-    conn.close()
-
-def save_structure_to_db(tg_id, text, saved=1):
-    conn = db_conn()
-    cur = conn.cursor()
-    cur.execute("INSERT INTO structures (user_tg_id, text, created_at, saved) VALUES (?, ?, ?, ?)",
-                (tg_id, text, int(time.time()), saved))
-    conn.commit()
-    conn.close()
-    increment_user_struct_count(tg_id, 1)
+    db_writer.submit(storage.increment_structures_count, tg_id, amount)
 
-def get_user_saved_structures(tg_id) -> List[dict]:
-    conn = db_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT id, text, created_at FROM structures WHERE user_tg_id = ? ORDER BY created_at DESC", (tg_id,))
-    rows = cur.fetchall()
-    conn.close()
-    return [{"id": r[0], "text": r[1], "created_at": r[2]} for r in rows]
+def save_draft_to_db(tg_id, text):
+    # the insert is committed before returning so callers can use the draft id
+    draft_id = db_writer.call(storage.insert_draft, tg_id, text)
+    increment_user_struct_count(tg_id, 1)
+    return draft_id
+
+def save_generated_to_db(tg_id, text, key):
+    # a repeat of the same structure (same generator memo key) reuses the
+    # user's existing draft instead of inserting an identical one
+    draft_id = generated_rows.get((tg_id, key))
+    if draft_id is not None and storage.draft_exists(draft_id, tg_id):
+        increment_user_struct_count(tg_id, 1)
+        return draft_id
+    draft_id = save_draft_to_db(tg_id, text)
+    generated_rows.set((tg_id, key), draft_id)
+    return draft_id
 
 def get_total_stats():
-    conn = db_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM users")
-    total_users = cur.fetchone()[0]
-    cur.execute("SELECT COUNT(*) FROM structures")
-    total_structs = cur.fetchone()[0]
-    conn.close()
-    return total_users, total_structs
+    # trigger-maintained counters, no table scans
+    totals = storage.stats_totals()
+    return totals["users"], totals["structures"]
 
+@metrics.timed("check_channel_membership")
 def check_channel_membership(user_id):
+    cached = membership_cache.get(user_id)
+    if cached is not None:
+        return cached
     try:
         member = bot.get_chat_member(CHANNEL_USERNAME, user_id)
-        # statuses: 'member', 'creator', 'administrator'
-        return member.status in ['member', 'creator', 'administrator']
     except Exception as e:
-        logging.info("Membership check failed: %s", e)
-        # If bot cannot check (e.g. wrong channel username), default True to avoid blocking
-        return False
+        # a 429, 5xx or timeout says nothing about the user: go by the last
+        # answer, or let them through, rather than lock members out of every
+        # button; remembered briefly so each press doesn't ask the API again
+        joined = membership_known.get(user_id, True)
+        logging.info("Membership check failed (%s); assuming %s", e, "member" if joined else "not a member")
+        membership_cache.set(user_id, joined, ttl=MEMBER_TTL_ERROR)
+        return joined
+    # only 'left' and 'kicked' (or 'restricted' outside the channel) are non-members
+    joined = not (member.status in ("left", "kicked")
+                  or (member.status == "restricted" and not getattr(member, "is_member", True)))
+    membership_cache.set(user_id, joined, ttl=MEMBER_TTL_JOINED if joined else MEMBER_TTL_NOT_JOINED)
+    membership_known.set(user_id, joined)
+    return joined
 
 def format_struct_output(text: str):
     return f"✅ Generated Structure\n\n<pre>{text}</pre>"
 
-def generate_patch_lib(libname, offsets: List[str], hex_bytes="00 20 70 47"):
-    lines = []
-    for off in offsets:
-        lines.append(f'PATCH_LIB("{libname}", {off}, "{hex_bytes}");')
-    return "\n".join(lines)
-
-def generate_memory_patch(libname, offsets: List[str], hex_bytes="73 6F 6E 52 65"):
-    lines = []
-    for off in offsets:
-        lines.append(f'MemoryPatch::createWithHex("{libname}",{off}, "{hex_bytes}").Modify();')
-    return "\n".join(lines)
-
-def generate_hook_lib(libname, offset, params: List[str]):
-    params_str = ", ".join(params) if params else ""
-    return f'HOOK_LIB("{libname}", {offset}, {params_str});'
-
 # ----------------- KEYBOARDS -----------------
 def start_inline_keyboard(joined=False):
     ik = InlineKeyboardMarkup()
@@ -180,6 +198,13 @@ def struct_type_kb():
            InlineKeyboardButton("Memory Patch", callback_data="stype_memory"))
     return ik
 
+def hex_bytes_kb(stype):
+    ik = InlineKeyboardMarkup()
+    for i, (label, _) in enumerate(generator.HEX_PRESETS.get(stype, [])):
+        ik.add(InlineKeyboardButton(label, callback_data=f"hex_{i}"))
+    ik.add(InlineKeyboardButton("✏️ Custom Bytes", callback_data="hex_custom"))
+    return ik
+
 def lib_choice_kb():
     ik = InlineKeyboardMarkup()
     ik.row(InlineKeyboardButton("UE4", callback_data="lib_ue4"),
@@ -195,6 +220,21 @@ def save_inline_kb(struct_db_id=None, already_saved=False):
         ik.add(InlineKeyboardButton("Saved ✅", callback_data="noop"))
     return ik
 
+def saved_page_kb(page, has_newer, has_older):
+    ik = InlineKeyboardMarkup()
+    # one delete button per structure on the page, numbered like the text
+    dels = [InlineKeyboardButton(f"🗑 {i}", callback_data=f"delstruct:{s['id']}") for i, s in enumerate(page, start=1)]
+    for i in range(0, len(dels), 4):
+        ik.row(*dels[i:i + 4])
+    nav = []
+    if has_newer:
+        nav.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"saved:p:{page[0]['created_at']}:{page[0]['id']}"))
+    if has_older:
+        nav.append(InlineKeyboardButton("Next ➡️", callback_data=f"saved:n:{page[-1]['created_at']}:{page[-1]['id']}"))
+    if nav:
+        ik.row(*nav)
+    return ik
+
 # ----------------- COMMANDS -----------------
 @bot.message_handler(commands=["start"])
 def cmd_start(msg):
@@ -205,16 +245,15 @@ def cmd_start(msg):
         text = ("👋 Welcome!\n\n"
                 "Before using the bot, please join our channel.\n"
                 "Tap the button below, join the channel and then press \"I've Joined — Continue\".")
-        bot.send_message(msg.chat.id, text, reply_markup=start_inline_keyboard(joined=False))
+        outbox.send_message(msg.chat.id, text, reply_markup=start_inline_keyboard(joined=False))
         return
     # show profile page with photo
     send_profile_page(msg.chat.id, msg.from_user.id)
 
-def send_profile_page(chat_id, user_id):
-    try:
-        user = bot.get_chat(user_id)
-    except Exception:
-        user = None
+@metrics.timed("load_profile")
+def load_profile(user_id):
+    # raises if get_chat fails so a broken lookup is never cached
+    user = bot.get_chat(user_id)
 
     # user profile photo (get first)
     photo_file_id = None
@@ -225,9 +264,17 @@ def send_profile_page(chat_id, user_id):
     except Exception as e:
         logging.info("Failed to get profile photo: %s", e)
 
-    nickname = (user.first_name or "") + (" " + (user.last_name or "") if user and user.last_name else "")
-    username = f"@{user.username}" if user and user.username else "—"
-    uid = user.id if user else user_id
+    nickname = (user.first_name or "") + (" " + (user.last_name or "") if user.last_name else "")
+    username = f"@{user.username}" if user.username else "—"
+    return (nickname, username, user.id, photo_file_id)
+
+@metrics.timed("send_profile_page")
+def send_profile_page(chat_id, user_id):
+    try:
+        nickname, username, uid, photo_file_id = profile_cache.get_or_load(user_id)
+    except Exception as e:
+        logging.info("Failed to get profile: %s", e)
+        nickname, username, uid, photo_file_id = "", "—", user_id, None
 
     text = (
         f"👤 Nick name : {nickname}\n"
@@ -239,207 +286,479 @@ def send_profile_page(chat_id, user_id):
 
     kb = start_inline_keyboard(joined=True)
     if photo_file_id:
-        bot.send_photo(chat_id, photo_file_id, caption=text, reply_markup=kb)
+        outbox.send_photo(chat_id, photo_file_id, caption=text, reply_markup=kb)
     else:
-        bot.send_message(chat_id, text, reply_markup=kb)
+        outbox.send_message(chat_id, text, reply_markup=kb)
+
+def saved_entry_text(num, s, limit=MAX_MESSAGE_LEN):
+    created = time.strftime("%Y-%m-%d %H:%M", time.localtime(s["created_at"]))
+    head = f"{num}. 🗂 Saved on {created}\n"
+    body = s["text"]
+    room = limit - len(head) - len("<pre></pre>") - 32
+    if len(body) > room:
+        body = body[:room].rsplit("\n", 1)[0] + "\n… (truncated)"
+    return f"{head}<pre>{body}</pre>"
+
+def send_saved_page(chat_id, user_id, cursor=None, newer=False, message_id=None):
+    # keyset paging: only this page's rows are loaded, as many as fit in one message
+    rows = storage.structures_page(user_id, cursor, newer, SAVED_PAGE_ROWS)
+    page, size = [], 0
+    for s in rows:
+        n = len(saved_entry_text(len(page) + 1, s)) + 2
+        if page and size + n > MAX_MESSAGE_LEN:
+            break
+        page.append(s)
+        size += n
+    if newer:
+        page.reverse()
+    if not page:
+        if cursor is None:
+            outbox.send_message(chat_id, "No saved structures yet.")
+            return
+        # the rows around the cursor were deleted; start over from the top
+        return send_saved_page(chat_id, user_id, message_id=message_id)
+
+    first, last = page[0], page[-1]
+    has_newer = storage.has_structures_beyond(user_id, (first["created_at"], first["id"]), newer=True)
+    has_older = storage.has_structures_beyond(user_id, (last["created_at"], last["id"]), newer=False)
+    text = "\n\n".join(saved_entry_text(i, s) for i, s in enumerate(page, start=1))
+    kb = saved_page_kb(page, has_newer, has_older)
+    if message_id is not None:
+        outbox.edit_message_text(text, chat_id, message_id, reply_markup=kb)
+    else:
+        outbox.send_message(chat_id, text, reply_markup=kb)
+
+@metrics.timed("send_generated")
+def send_generated(chat_id, user_id, st: FlowState, offsets: Iterable[str], params="", name="structure"):
+    # results that fit in one message go inline with a Save button; longer
+    # ones are streamed into .txt attachments (not stored in the DB)
+    stype, lib, hex_bytes = st.selected_struct_type, st.selected_lib, st.hex_bytes
+    offsets = iter(offsets)
+    buf = list(itertools.islice(offsets, INLINE_MAX_OFFSETS + 1))
+    if len(buf) <= INLINE_MAX_OFFSETS:
+        text, key = generator.render(stype, lib, buf, hex_bytes, params)
+        if len(format_struct_output(text)) <= MAX_MESSAGE_LEN:
+            struct_id = save_generated_to_db(user_id, text, key)
+            outbox.send_message(chat_id, format_struct_output(text), reply_markup=save_inline_kb(struct_db_id=struct_id, already_saved=False))
+            return
+
+    lines = generator.iter_lines(stype, lib, itertools.chain(buf, offsets), hex_bytes, params)
+    paths = bulk.write_chunks(lines, prefix=name)
+    increment_user_struct_count(user_id, 1)
+    try:
+        for i, path in enumerate(paths, start=1):
+            part = f"_part{i}" if len(paths) > 1 else ""
+            with open(path, "rb") as f:
+                # waits for the upload: the file is removed right after
+                outbox.call("send_document", chat_id, f, visible_file_name=f"{name}{part}.txt",
+                            caption=f"✅ Generated Structure ({i}/{len(paths)})")
+    finally:
+        bulk.remove(paths)
+
+# ----------------- CALLBACKS -----------------
+# one route per button (router.py); payloads after "prefix:" / "prefix_" are
+# parsed into these
+def page_direction(s):
+    if s not in ("n", "p"):
+        raise ValueError(s)
+    return s
+
+class SavedCursor(NamedTuple):
+    direction: page_direction   # "n" = older than the cursor, "p" = newer
+    created_at: int
+    id: int
+
+class StructRef(NamedTuple):
+    id: int
+
+class Choice(NamedTuple):
+    key: str
+
+class PresetRef(NamedTuple):
+    index: int
+
+def deny_not_member(call):
+    outbox.answer_callback_query(call.id, f"Please join {CHANNEL_USERNAME} first, then send /start.", show_alert=True)
+
+# user-facing routes need channel membership (cached, like /start)
+members_only = router.gate(lambda call: check_channel_membership(call.from_user.id), deny_not_member)
+owner_only = router.gate(lambda call: call.from_user.id == OWNER_ID,
+                         lambda call: outbox.answer_callback_query(call.id, "Not allowed."))
+
+callbacks = router.CallbackRouter(middleware=[router.timed])
 
 @bot.callback_query_handler(func=lambda c: True)
 def callback_handler(call):
+    if not callbacks.dispatch(call):
+        outbox.answer_callback_query(call.id, router.STALE_BUTTON)
+
+@callbacks.route("joined_check")
+def cb_joined_check(call, _):
+    # the user says they just joined: drop any cached "not joined"
+    membership_cache.invalidate(call.from_user.id)
+    if check_channel_membership(call.from_user.id):
+        outbox.edit_message_text("Thanks — you joined! Here's your profile.", call.message.chat.id, call.message.message_id)
+        send_profile_page(call.message.chat.id, call.from_user.id)
+    else:
+        outbox.answer_callback_query(call.id, "You haven't joined the channel yet — please join first.", show_alert=True)
+
+@callbacks.route("simple_structure", middleware=[members_only])
+def cb_simple_structure(call, _):
+    outbox.send_message(call.message.chat.id, "✨ Single Offset For Only 1 Offset\n✨ Multi Offset For Multiple Offsets\n\n🤖 Choice Option:", reply_markup=simple_choice_kb())
+
+@callbacks.route("simple_single", middleware=[members_only])
+def cb_simple_single(call, _):
+    user_state.set(call.from_user.id, FlowState(flow="simple_single"))
+    outbox.send_message(call.message.chat.id, "✨ Single Offset selected.\n\nSend the offset now (e.g. 0xc23fa50):", reply_markup=InlineKeyboardMarkup())
+
+@callbacks.route("simple_multi", middleware=[members_only])
+def cb_simple_multi(call, _):
+    user_state.set(call.from_user.id, FlowState(flow="simple_multi"))
+    outbox.send_message(call.message.chat.id, "✨ Multi Offset selected.\n\nSend all offsets separated by newline. Example:\n0xCA9C6F0\n0xc23fa50\n0xY825FS0\n\n📄 Or upload a .txt file with one offset per line.", reply_markup=InlineKeyboardMarkup())
+
+@callbacks.route("hook_structure", middleware=[members_only])
+def cb_hook_structure(call, _):
+    user_state.set(call.from_user.id, FlowState(flow="hook"))
+    outbox.send_message(call.message.chat.id, "⭐ Hook Structure selected.\n\nSend the offset now (e.g. 0xc23fa50):")
+
+@callbacks.route("settings", middleware=[members_only])
+def cb_settings(call, _):
+    # show settings + saved structures button
     user_id = call.from_user.id
-    data = call.data or ""
-    # Quick "I've Joined — Continue" check
-    if data == "joined_check":
-        if check_channel_membership(user_id):
-            bot.edit_message_text("Thanks — you joined! Here's your profile.", call.message.chat.id, call.message.message_id)
-            send_profile_page(call.message.chat.id, user_id)
-        else:
-            bot.answer_callback_query(call.id, "You haven't joined the channel yet — please join first.", show_alert=True)
+    saved_count = storage.user_structures_total(user_id)
+    row = storage.get_user_row(user_id)
+    structs_count = row[0] if row else 0
+    first_seen = time.strftime("%Y-%m-%d", time.localtime(row[1])) if row and row[1] else "—"
+    text = f"👤 Your Settings\n\nTotal generated structures: {structs_count}\nUsing since: {first_seen}\n\nSaved Structures: {saved_count}"
+    ik = InlineKeyboardMarkup()
+    ik.add(InlineKeyboardButton("View Saved Structures", callback_data="view_saved"))
+    ik.add(InlineKeyboardButton("Back", callback_data="back_to_profile"))
+    outbox.send_message(call.message.chat.id, text, reply_markup=ik)
+
+@callbacks.route("view_saved", middleware=[members_only])
+def cb_view_saved(call, _):
+    send_saved_page(call.message.chat.id, call.from_user.id)
+
+@callbacks.route("saved:", SavedCursor, middleware=[members_only])
+def cb_saved_page(call, cur: SavedCursor):
+    # page older (n) / newer (p) than the cursor
+    send_saved_page(call.message.chat.id, call.from_user.id, cursor=(cur.created_at, cur.id),
+                    newer=cur.direction == "p", message_id=call.message.message_id)
+    outbox.answer_callback_query(call.id)
+
+@callbacks.route("delstruct:", StructRef, middleware=[members_only])
+def cb_delete_struct(call, ref: StructRef):
+    db_writer.call(storage.delete_structure, ref.id, call.from_user.id)
+    outbox.answer_callback_query(call.id, "Deleted.")
+
+@callbacks.route("bot_info")
+def cb_bot_info(call, _):
+    text = ("🤖 Bot : Bypass Structure Maker Bot\n"
+            "👤 Founder : @XTHrlen\n"
+            "👤 Developer : @XTHrlen\n"
+            "🔎 Bot Created : Tue, 30 September\n"
+            f"🎀 Telegram Channel : {CHANNEL_USERNAME}\n"
+            "✨ Website : srchub.kesug.com")
+    outbox.send_message(call.message.chat.id, text)
+
+def flow_state(call, need_type=False):
+    # the caller's flow, or None after telling them it has expired
+    st = user_state.get(call.from_user.id)
+    if not st or (need_type and not st.selected_struct_type):
+        outbox.send_message(call.message.chat.id, "Session expired — start again.")
+        return None
+    return st
+
+@callbacks.route("stype_", Choice, middleware=[members_only])
+def cb_struct_type(call, choice: Choice):
+    # select structure type for simple flows, then ask for the hex bytes
+    st = flow_state(call)
+    if not st:
         return
-
-    if data == "simple_structure":
-        bot.send_message(call.message.chat.id, "✨ Single Offset For Only 1 Offset\n✨ Multi Offset For Multiple Offsets\n\n🤖 Choice Option:", reply_markup=simple_choice_kb())
+    st.selected_struct_type = generator.PATCH_LIB if choice.key == "patch" else generator.MEMORY_PATCH
+    user_state.set(call.from_user.id, st)
+    outbox.send_message(call.message.chat.id, "🧬 Choose the hex bytes to patch with:", reply_markup=hex_bytes_kb(st.selected_struct_type))
+
+@callbacks.route("hex_custom", middleware=[members_only])
+def cb_hex_custom(call, _):
+    # the bytes are typed next (all_text_handler, step 3)
+    st = flow_state(call, need_type=True)
+    if not st:
         return
-
-    if data == "simple_single":
-        user_state[user_id] = {"flow": "simple_single", "step": 1, "offsets": []}
-        bot.send_message(call.message.chat.id, "✨ Single Offset selected.\n\nSend the offset now (e.g. 0xc23fa50):", reply_markup=InlineKeyboardMarkup())
+    st.step = 3
+    user_state.set(call.from_user.id, st)
+    outbox.send_message(call.message.chat.id, "✏️ Send the hex bytes (example: 00 20 70 47):")
+
+@callbacks.route("hex_", PresetRef, middleware=[members_only])
+def cb_hex_preset(call, ref: PresetRef):
+    # payload for PATCH_LIB / MemoryPatch from the type's presets
+    st = flow_state(call, need_type=True)
+    if not st:
         return
-
-    if data == "simple_multi":
-        user_state[user_id] = {"flow": "simple_multi", "step": 1, "offsets": []}
-        bot.send_message(call.message.chat.id, "✨ Multi Offset selected.\n\nSend all offsets separated by newline. Example:\n0xCA9C6F0\n0xc23fa50\n0xY825FS0", reply_markup=InlineKeyboardMarkup())
+    presets = generator.HEX_PRESETS.get(st.selected_struct_type, [])
+    if not 0 <= ref.index < len(presets):
+        outbox.answer_callback_query(call.id)
         return
-
-    if data == "hook_structure":
-        user_state[user_id] = {"flow": "hook", "step": 1, "offsets": []}
-        bot.send_message(call.message.chat.id, "⭐ Hook Structure selected.\n\nSend the offset now (e.g. 0xc23fa50):")
+    st.hex_bytes = presets[ref.index][1]
+    user_state.set(call.from_user.id, st)
+    outbox.send_message(call.message.chat.id, "💫 UE4 - ( libUE4.so )\n💫 Anogs - ( libanogs.so )\n💫 Anort - ( libanort.so )\n\n🤖 Choice Option :", reply_markup=lib_choice_kb())
+
+LIBS = {"ue4": "libUE4.so", "anogs": "libanogs.so", "anort": "libanort.so"}
+
+@callbacks.route("lib_", Choice, middleware=[members_only])
+def cb_lib(call, choice: Choice):
+    # last step of every flow: pick the lib and generate
+    chat_id, user_id = call.message.chat.id, call.from_user.id
+    st = flow_state(call)
+    if not st:
         return
-
-    if data == "settings":
-        # show settings + saved structures button
-        structures = get_user_saved_structures(user_id)
-        conn = db_conn()
-        cur = conn.cursor()
-        cur.execute("SELECT structures_count, first_seen FROM users WHERE tg_id = ?", (user_id,))
-        row = cur.fetchone()
-        conn.close()
-        structs_count = row[0] if row else 0
-        first_seen = time.strftime("%Y-%m-%d", time.localtime(row[1])) if row and row[1] else "—"
-        text = f"👤 Your Settings\n\nTotal generated structures: {structs_count}\nUsing since: {first_seen}\n\nSaved Structures: {len(structures)}"
-        ik = InlineKeyboardMarkup()
-        ik.add(InlineKeyboardButton("View Saved Structures", callback_data="view_saved"))
-        ik.add(InlineKeyboardButton("Back", callback_data="back_to_profile"))
-        bot.send_message(call.message.chat.id, text, reply_markup=ik)
+    st.selected_lib = LIBS.get(choice.key, "libUE4.so")
+    params = ""
+    if st.flow == "hook":
+        st.selected_struct_type = generator.HOOK_LIB
+        params = ", ".join(st.connect_params)
+    elif not st.selected_struct_type:
+        outbox.send_message(chat_id, "Choose the structure type first.")
         return
 
-    if data == "view_saved":
-        structures = get_user_saved_structures(user_id)
-        if not structures:
-            bot.send_message(call.message.chat.id, "No saved structures yet.")
+    offsets = st.offsets
+    if st.offsets_file:
+        if not os.path.exists(st.offsets_file):
+            user_state.pop(user_id)
+            outbox.send_message(chat_id, "Session expired — start again.")
             return
-        for s in structures:
-            created = time.strftime("%Y-%m-%d %H:%M", time.localtime(s["created_at"]))
-            kb = InlineKeyboardMarkup()
-            kb.add(InlineKeyboardButton("Delete", callback_data=f"delstruct:{s['id']}"))
-            bot.send_message(call.message.chat.id, f"🗂 Saved on {created}\n\n<pre>{s['text']}</pre>", reply_markup=kb)
-        return
-
-    if data.startswith("delstruct:"):
-        sid = int(data.split(":",1)[1])
-        conn = db_conn()
-        cur = conn.cursor()
-        cur.execute("DELETE FROM structures WHERE id = ?", (sid,))
-        conn.commit()
-        conn.close()
-        bot.answer_callback_query(call.id, "Deleted.")
+        offsets = bulk.iter_spooled(st.offsets_file)
+    elif not offsets:
+        outbox.send_message(chat_id, "Offsets missing. Send the offsets first." if st.flow == "simple_multi"
+                            else "Offset missing. Send the offset first.")
         return
-
-    if data == "bot_info":
-        text = ("🤖 Bot : Bypass Structure Maker Bot\n"
-                "👤 Founder : @XTHrlen\n"
-                "👤 Developer : @XTHrlen\n"
-                "🔎 Bot Created : Tue, 30 September\n"
-                f"🎀 Telegram Channel : {CHANNEL_USERNAME}\n"
-                "✨ Website : srchub.kesug.com")
-        bot.send_message(call.message.chat.id, text)
-        return
-
-    if data.startswith("stype_"):
-        # select structure type for simple flows
-        stype = data.split("_",1)[1]
-        # store in state and ask lib
-        cur_state = user_state.get(user_id)
-        if not cur_state:
-            bot.send_message(call.message.chat.id, "Session expired — start again.")
-            return
-        cur_state['selected_struct_type'] = 'PATCH_LIB' if stype == 'patch' else 'MemoryPatch'
-        user_state[user_id] = cur_state
-        bot.send_message(call.message.chat.id, "💫 UE4 - ( libUE4.so )\n💫 Anogs - ( libanogs.so )\n💫 Anort - ( libanort.so )\n\n🤖 Choice Option :", reply_markup=lib_choice_kb())
+    elif st.flow != "simple_multi":
+        offsets = offsets[:1]
+    try:
+        # the result is kept as a draft; the Save button moves it to saved structures
+        send_generated(chat_id, user_id, st, offsets, params=params)
+    finally:
+        if st.offsets_file:
+            bulk.remove([st.offsets_file])
+        user_state.pop(user_id)
+
+def save_result(call, saved):
+    if not saved:
+        outbox.answer_callback_query(call.id, "This structure has expired — generate it again.", show_alert=True)
         return
+    outbox.answer_callback_query(call.id, "Saved to your account.")
+    outbox.edit_message_reply_markup(call.message.chat.id, call.message.message_id, reply_markup=save_inline_kb(already_saved=True))
 
-    if data.startswith("lib_"):
-        # user selected lib (UE4, Anogs, Anort)
-        libkey = data.split("_",1)[1]
-        libmap = {"ue4": "libUE4.so", "anogs": "libanogs.so", "anort": "libanort.so"}
-        libname = libmap.get(libkey, "libUE4.so")
-        cur_state = user_state.get(user_id)
-        if not cur_state:
-            bot.send_message(call.message.chat.id, "Session expired — start again.")
-            return
+@callbacks.route("save_struct:pending", middleware=[members_only])
+def cb_save_last(call, _):
+    # the button was made before the draft id was known: save the user's latest draft
+    try:
+        save_result(call, db_writer.call(storage.save_last_draft, call.from_user.id))
+    except Exception as e:
+        logging.exception(e)
+        outbox.answer_callback_query(call.id, "Failed to save.")
 
-        cur_state['selected_lib'] = libname
-        flow = cur_state.get("flow")
-        # generate based on flow
-        if flow == "simple_single":
-            # expecting exactly one offset in offsets list
-            offsets = cur_state.get("offsets", [])
-            if not offsets:
-                bot.send_message(call.message.chat.id, "Offset missing. Send the offset first.")
-                return
-            if cur_state.get('selected_struct_type') == 'PATCH_LIB':
-                text = generate_patch_lib(libname, offsets)
-            else:
-                text = generate_memory_patch(libname, offsets)
-            # save to DB as unsaved (saved=0) initially but we'll show Save button
-            save_structure_to_db(user_id, text, saved=0)
-            # get last inserted id
-            conn = db_conn()
-            cur = conn.cursor()
-            cur.execute("SELECT id FROM structures WHERE user_tg_id = ? ORDER BY created_at DESC LIMIT 1", (user_id,))
-            last = cur.fetchone()
-            conn.close()
-            last_id = last[0] if last else None
-            bot.send_message(call.message.chat.id, format_struct_output(text), reply_markup=save_inline_kb(struct_db_id=last_id, already_saved=False))
-            # clear state
-            user_state.pop(user_id, None)
-            return
+@callbacks.route("save_struct:", StructRef, middleware=[members_only])
+def cb_save_struct(call, ref: StructRef):
+    # copy the draft into the user's saved structures
+    try:
+        save_result(call, db_writer.call(storage.save_draft, ref.id, call.from_user.id))
+    except Exception as e:
+        logging.exception(e)
+        outbox.answer_callback_query(call.id, "Failed to save.")
 
-        if flow == "simple_multi":
-            offsets = cur_state.get("offsets", [])
-            if not offsets:
-                bot.send_message(call.message.chat.id, "Offsets missing. Send the offsets first.")
-                return
-            if cur_state.get('selected_struct_type') == 'PATCH_LIB':
-                text = generate_patch_lib(libname, offsets)
-            else:
-                text = generate_memory_patch(libname, offsets)
-            save_structure_to_db(user_id, text, saved=0)
-            conn = db_conn()
-            cur = conn.cursor()
-            cur.execute("SELECT id FROM structures WHERE user_tg_id = ? ORDER BY created_at DESC LIMIT 1", (user_id,))
-            last = cur.fetchone()
-            conn.close()
-            last_id = last[0] if last else None
-            bot.send_message(call.message.chat.id, format_struct_output(text), reply_markup=save_inline_kb(struct_db_id=last_id, already_saved=False))
-            user_state.pop(user_id, None)
-            return
+@callbacks.route("back_to_profile", middleware=[members_only])
+def cb_back_to_profile(call, _):
+    send_profile_page(call.message.chat.id, call.from_user.id)
 
-        if flow == "hook":
-            offsets = cur_state.get("offsets", [])
-            if not offsets:
-                bot.send_message(call.message.chat.id, "Offset missing. Send the offset first.")
-                return
-            offset = offsets[0]
-            params = cur_state.get("connect_params", [])
-            text = generate_hook_lib(libname, offset, params)
-            save_structure_to_db(user_id, text, saved=0)
-            conn = db_conn()
-            cur = conn.cursor()
-            cur.execute("SELECT id FROM structures WHERE user_tg_id = ? ORDER BY created_at DESC LIMIT 1", (user_id,))
-            last = cur.fetchone()
-            conn.close()
-            last_id = last[0] if last else None
-            bot.send_message(call.message.chat.id, format_struct_output(text), reply_markup=save_inline_kb(struct_db_id=last_id, already_saved=False))
-            user_state.pop(user_id, None)
-            return
+@callbacks.route("noop")
+def cb_noop(call, _):
+    outbox.answer_callback_query(call.id, "No action.")
 
-    if data.startswith("save_struct:"):
-        sid = data.split(":",1)[1]
-        # mark saved in DB
-        try:
-            conn = db_conn()
-            cur = conn.cursor()
-            # if pending -> mark last structure for user as saved
-            if sid == 'pending':
-                cur.execute("UPDATE structures SET saved = 1 WHERE user_tg_id = ? ORDER BY created_at DESC LIMIT 1", (user_id,))
-            else:
-                cur.execute("UPDATE structures SET saved = 1 WHERE id = ?", (int(sid),))
-            conn.commit()
-            conn.close()
-            bot.answer_callback_query(call.id, "Saved to your account.")
-            bot.edit_message_reply_markup(call.message.chat.id, call.message.message_id, reply_markup=save_inline_kb(already_saved=True))
-        except Exception as e:
-            logging.exception(e)
-            bot.answer_callback_query(call.id, "Failed to save.")
+# ----------------- MESSAGE HANDLER (offset file uploads) -----------------
+@bot.message_handler(content_types=["document"])
+def document_handler(m):
+    uid = m.from_user.id
+    st = user_state.get(uid)
+    if not st or st.flow != "simple_multi" or st.step != 1:
+        outbox.send_message(m.chat.id, "To upload an offsets file, choose Simple Structure → Multi Offset first.")
         return
-
-    if data == "back_to_profile":
-        send_profile_page(call.message.chat.id, call.from_user.id)
+    doc = m.document
+    if doc.file_size and doc.file_size > bulk.MAX_UPLOAD_BYTES:
+        outbox.send_message(m.chat.id, "File too large — the limit is 20 MB.")
         return
-
-    if data == "noop":
-        bot.answer_callback_query(call.id, "No action.")
+    try:
+        file_path = bot.get_file(doc.file_id).file_path
+        report = offset_parser.parse_offsets(bulk.iter_remote_lines(BOT_TOKEN, file_path))
+    except Exception as e:
+        logging.exception("Offsets upload failed: %s", e)
+        outbox.send_message(m.chat.id, "Could not read that file — send a plain .txt file with one offset per line.")
         return
+    notes = report.summary()
+    if not report.values:
+        outbox.send_message(m.chat.id, "No valid offsets found in that file." + ("\n\n" + notes if notes else ""))
+        return
+    path, count = bulk.spool(report.formatted())
+    st.offsets = []
+    st.offsets_file = path
+    st.step = 2
+    user_state.set(uid, st)
+    if notes:
+        outbox.send_message(m.chat.id, notes)
+    outbox.send_message(m.chat.id, f"📄 {count} offsets loaded.\n\n🎀 Patch Lib Like This (PATCH_LIB)\n🎀 Memory Patch like This (MemoryPatch)\n\n🤖 Choice Option :", reply_markup=struct_type_kb())
+
+# ----------------- OWNER: BROADCAST / EXPORT -----------------
+# /broadcast sends a message to every user (broadcast.py); its progress is
+# one message to the owner, edited as batches complete
+broadcast_messages = {}   # broadcast id -> (chat id, message id, text) of its progress message
+
+def broadcast_report(b):
+    done = b["sent"] + b["blocked"] + b["failed"]
+    state = {"running": "sending…", "stopped": "stopped, /broadcastresume continues it",
+             "done": "finished"}.get(b["status"], b["status"])
+    return (f"📣 Broadcast #{b['id']} : {state}\n\n"
+            f"📤 Progress : {done}/{b['total']}\n✅ Delivered : {b['sent']}\n"
+            f"🚫 Blocked the bot : {b['blocked']}\n❌ Failed : {b['failed']}")
+
+def show_broadcast_progress(b, finished):
+    text = broadcast_report(b)
+    entry = broadcast_messages.pop(b["id"], None) if finished else broadcast_messages.get(b["id"])
+    try:
+        if finished or entry is None:
+            # a new message when it ends, so the owner is notified; the running
+            # one is silent (which also keeps the outbox from merging it into
+            # another reply, so edits only touch the report)
+            msg = outbox.call("send_message", b["owner_chat_id"], text, disable_notification=not finished)
+            if not finished:
+                broadcast_messages[b["id"]] = (msg.chat.id, msg.message_id, text)
+        elif entry[2] != text:
+            outbox.edit_message_text(text, entry[0], entry[1])
+            broadcast_messages[b["id"]] = (entry[0], entry[1], text)
+    except Exception as e:
+        logging.info("Broadcast progress not shown: %s", e)
+
+broadcaster = broadcast.Broadcaster(outbox, db_writer, on_progress=show_broadcast_progress)
+
+def send_export(chat_id, table, fmt):
+    start = time.perf_counter()
+    paths = []
+    try:
+        paths = export.write_files(table, fmt)
+        for i, path in enumerate(paths, start=1):
+            part = f"_part{i}" if len(paths) > 1 else ""
+            with open(path, "rb") as f:
+                outbox.call("send_document", chat_id, f, visible_file_name=f"{table}{part}.{fmt}",
+                            caption=f"🗂 {table} ({i}/{len(paths)}), {time.perf_counter() - start:.1f}s")
+    except Exception as e:
+        logging.exception("Export of %s failed: %s", table, e)
+        outbox.send_message(chat_id, f"❌ Export failed: {html.escape(str(e))}")
+    finally:
+        bulk.remove(paths)
+        storage.close_thread()
+
+def owner_bulk_command(m, text):
+    # /broadcast <message>, /broadcaststop, /broadcastresume, /broadcaststatus,
+    # /export <table> <format>; False for anything else
+    parts = text.split(maxsplit=1)
+    cmd, rest = parts[0].lower(), parts[1] if len(parts) > 1 else ""
+    if cmd == "/broadcast":
+        if not rest.strip():
+            outbox.send_message(m.chat.id, "Send /broadcast followed by the message (HTML allowed).")
+        elif broadcaster.running():
+            outbox.send_message(m.chat.id, "A broadcast is already running: /broadcaststatus, /broadcaststop.")
+        else:
+            # the preview doubles as a check: if Telegram rejects it (bad HTML), nobody gets it
+            try:
+                outbox.call("send_message", m.chat.id, rest)
+            except ApiTelegramException as e:
+                outbox.send_message(m.chat.id, f"❌ Not sent, Telegram rejected the message:\n{html.escape(e.description)}")
+                return True
+            broadcast_id = broadcaster.start(rest, m.chat.id)
+            outbox.send_message(m.chat.id, f"📣 Broadcast #{broadcast_id} started with the message above. /broadcaststop pauses it.")
+    elif cmd == "/broadcaststop":
+        if broadcaster.stop(timeout=0):
+            outbox.send_message(m.chat.id, "⏸ Stopping after the messages already queued…")
+        else:
+            outbox.send_message(m.chat.id, "No broadcast is running.")
+    elif cmd == "/broadcastresume":
+        if broadcaster.running():
+            outbox.send_message(m.chat.id, "The broadcast is still running (or finishing its report): /broadcaststatus.")
+            return True
+        row = broadcaster.resume()
+        outbox.send_message(m.chat.id, f"▶️ Broadcast #{row['id']} continues." if row else "Nothing to resume.")
+    elif cmd == "/broadcaststatus":
+        b = broadcaster.current if broadcaster.running() else storage.get_broadcast()
+        outbox.send_message(m.chat.id, broadcast_report(b) if b else "No broadcasts yet.")
+    elif cmd == "/export":
+        args = rest.lower().split()
+        table = args[0] if args else "users"
+        fmt = args[1] if len(args) > 1 else "csv"
+        if table not in export.TABLES or fmt not in export.FORMATS:
+            outbox.send_message(m.chat.id, f"Usage: /export {'|'.join(export.TABLES)} {'|'.join(export.FORMATS)}")
+        else:
+            outbox.send_message(m.chat.id, f"🗂 Exporting {table} as {fmt}…")
+            threading.Thread(target=send_export, args=(m.chat.id, table, fmt), name="export", daemon=True).start()
+    else:
+        return False
+    return True
+
+# ----------------- OWNER: MAINTENANCE -----------------
+# maintenance.py expires drafts, vacuums, refreshes statistics and backs the
+# database up when the bot is quiet; run_bot starts its schedule (in workers
+# mode, in the main process; a worker can still run a job on request)
+maintainer = maintenance.Scheduler(db_writer)
+
+def duration(seconds):
+    return f"{seconds / 60:.0f} min" if seconds < 3600 else f"{seconds / 3600:.1f} h"
+
+def maintenance_report():
+    rate = maintainer.rate()
+    if not maintainer.running():
+        traffic = "schedule runs in the main process"
+    elif rate is None:
+        traffic = f"measuring traffic (first {maintainer.window:.0f}s)"
+    else:
+        traffic = f"{rate:.2f} updates/s, {'quiet' if rate < maintainer.quiet_rate else 'busy'}"
+    space = storage.space_used()
+    mb = 1024 * 1024
+    lines = [f"🧹 Maintenance : {traffic}",
+             f"💾 Database : {space['bytes'] / mb:.1f} MB, {space['free_bytes'] / mb:.1f} MB free", ""]
+    runs = storage.maintenance_runs()
+    now = time.time()
+    for name, (_, interval, _) in maintainer.jobs.items():
+        run = runs.get(name)
+        if interval <= 0:
+            state = f"not scheduled (/maintenance run {name})"
+            if run is not None:
+                state += f", last {duration(now - run['last_run'])} ago: {run['result']}"
+        elif run is None:
+            state = "not run yet"
+        else:
+            state = (f"{duration(now - run['last_run'])} ago (every {duration(interval)}), "
+                     f"{run['seconds'] * 1000:.0f} ms: {run['result']}")
+        if name in maintainer.unfinished:
+            state += f"; unfinished: {maintainer.unfinished[name]}"
+        lines.append(f"• {name} : {html.escape(state)}")
+    lines.append(f"\n/maintenance run {'|'.join(maintainer.jobs)} runs one now")
+    return "\n".join(lines)
+
+def run_maintenance_job(chat_id, name):
+    try:
+        finished, summary = maintainer.run(name)
+    finally:
+        storage.close_thread()
+    outbox.send_message(chat_id, f"🧹 {name} : {html.escape(summary)}" + ("" if finished else " (continues later)"))
+
+def owner_maintenance_command(m, text):
+    args = text.lower().split()[1:]
+    if args[:1] != ["run"]:
+        outbox.send_message(m.chat.id, maintenance_report())
+    elif len(args) < 2 or args[1] not in maintainer.jobs:
+        outbox.send_message(m.chat.id, f"Usage: /maintenance run {'|'.join(maintainer.jobs)}")
+    else:
+        outbox.send_message(m.chat.id, f"🧹 Running {args[1]}…")
+        threading.Thread(target=run_maintenance_job, args=(m.chat.id, args[1]), name="maintenance-run",
+                         daemon=True).start()
 
 # ----------------- MESSAGE HANDLER (text inputs) -----------------
 @bot.message_handler(func=lambda m: True)
@@ -449,106 +768,219 @@ def all_text_handler(m):
     # Owner command short access
     if text.strip().lower() == "/ownercmd" and m.from_user.id == OWNER_ID:
         total_users, total_structs = get_total_stats()
-        # daily users approx: users created in last 24h
-        conn = db_conn()
-        cur = conn.cursor()
-        day_ts = int(time.time()) - 24*3600
-        cur.execute("SELECT COUNT(*) FROM users WHERE first_seen >= ?", (day_ts,))
-        daily = cur.fetchone()[0]
-        conn.close()
+        # daily users: new users in today's (UTC) bucket
+        daily = storage.stats_day()["new_users"]
         ik = InlineKeyboardMarkup()
         ik.add(InlineKeyboardButton("Check Users", callback_data="owner_check_users"),
                InlineKeyboardButton("Back", callback_data="back_to_profile"))
-        bot.send_message(m.chat.id, f"🤖 Hi My Leader 👋\n\n📉 Total User : {total_users}\n📉 Daily User : {daily}\n📉 Total Struct : {total_structs}", reply_markup=ik)
+        mc = membership_cache.stats()
+        pc = profile_cache.stats()
+        gc = generator.memo.stats()
+        ob = outbox.stats()
+        outbox.send_message(m.chat.id, f"🤖 Hi My Leader 👋\n\n📉 Total User : {total_users}\n📉 Daily User : {daily}\n📉 Total Struct : {total_structs}"
+                            f"\n\n🗃 Member cache : {mc['size']} entries, {mc['hits']} hits / {mc['misses']} misses ({mc['hit_rate']:.0%})"
+                            f"\n🗃 Profile cache : {pc['size']} entries, {pc['hits']} hits / {pc['misses']} misses ({pc['hit_rate']:.0%}), {pc['stale_hits']} stale"
+                            f"\n🗃 Generator cache : {gc['size']} entries, {gc['hits']} hits / {gc['misses']} misses ({gc['hit_rate']:.0%})"
+                            f"\n📤 Outbox : {ob['queued']} queued (max {ob['max_depth']}), {ob['sent']} sent, {ob['coalesced']} merged, "
+                            f"{ob['rate_limited']} rate-limited, {ob['failed']} failed"
+                            "\n\n📊 Send /metrics for handler, DB and Bot API timings"
+                            "\n📣 /broadcast &lt;message&gt; to message every user, /broadcaststatus"
+                            "\n🗂 /export users|structures csv|jsonl"
+                            "\n🧹 /maintenance for database upkeep and backups", reply_markup=ik)
+        return
+
+    if text.strip().lower() == "/metrics" and m.from_user.id == OWNER_ID:
+        outbox.send_message(m.chat.id, f"📊 Metrics\n\n<pre>{html.escape(metrics.summary())}</pre>")
+        return
+
+    if text.lower().startswith(("/broadcast", "/export")) and m.from_user.id == OWNER_ID:
+        if owner_bulk_command(m, text):
+            return
+
+    if text.lower().split(maxsplit=1)[:1] == ["/maintenance"] and m.from_user.id == OWNER_ID:
+        owner_maintenance_command(m, text)
+        return
+
+    if text.strip().lower() == "/checkstats" and m.from_user.id == OWNER_ID:
+        db_writer.flush()
+        problems = storage.check_stats()
+        if problems:
+            outbox.send_message(m.chat.id, "⚠️ Stats drift:\n" + "\n".join(problems[:30]) + "\n\nSend /rebuildstats to fix.")
+        else:
+            outbox.send_message(m.chat.id, "✅ Stats counters are consistent.")
+        return
+
+    if text.strip().lower() == "/rebuildstats" and m.from_user.id == OWNER_ID:
+        db_writer.call(storage.rebuild_stats)
+        outbox.send_message(m.chat.id, "✅ Stats counters rebuilt.")
         return
 
     # owner_check_users via message input (we'll also accept inline)
     if text.isdigit() and m.from_user.id == OWNER_ID and text != "0":
         # show that many profiles
         n = int(text)
-        conn = db_conn()
-        cur = conn.cursor()
-        cur.execute("SELECT tg_id, username, full_name FROM users ORDER BY first_seen DESC LIMIT ?", (n,))
-        rows = cur.fetchall()
-        conn.close()
+        rows = storage.recent_users(n)
         lines = []
         for i, r in enumerate(rows, start=1):
             uname = f"@{r[1]}" if r[1] else f"{generate_random_code_for_user(r[0])} {r[2][:30]}"
             lines.append(f"👤 {i} : {uname}")
-        bot.send_message(m.chat.id, "👤 Total User Profile:\n\n" + "\n".join(lines))
+        outbox.send_message(m.chat.id, "👤 Total User Profile:\n\n" + "\n".join(lines))
         return
 
     # handle interactive flows
     st = user_state.get(uid)
     if st:
-        flow = st.get("flow")
-        if flow == "simple_single" and st.get("step") == 1:
+        flow = st.flow
+        if flow == "simple_single" and st.step == 1:
             # expect single offset
-            offset = text.strip().split()[0]
-            st['offsets'] = [offset]
-            st['step'] = 2
-            user_state[uid] = st
-            bot.send_message(m.chat.id, " 🎀 Patch Lib Like This (PATCH_LIB)\n🎀 Memory Patch like This (MemoryPatch)\n\n🤖 Choice Option :", reply_markup=struct_type_kb())
+            offset = offset_parser.parse_one(text)
+            if offset is None:
+                outbox.send_message(m.chat.id, "❌ Invalid offset. Send a hex (0xc23fa50) or decimal offset:")
+                return
+            st.offsets = [offset]
+            st.step = 2
+            user_state.set(uid, st)
+            outbox.send_message(m.chat.id, " 🎀 Patch Lib Like This (PATCH_LIB)\n🎀 Memory Patch like This (MemoryPatch)\n\n🤖 Choice Option :", reply_markup=struct_type_kb())
             return
 
-        if flow == "simple_multi" and st.get("step") == 1:
+        if flow == "simple_multi" and st.step == 1:
             # expect multiple offsets newline separated
-            lines = [line.strip() for line in text.splitlines() if line.strip()]
-            st['offsets'] = lines
-            st['step'] = 2
-            user_state[uid] = st
-            bot.send_message(m.chat.id, "🎀 Patch Lib Like This (PATCH_LIB)\n🎀 Memory Patch like This (MemoryPatch)\n\n🤖 Choice Option :", reply_markup=struct_type_kb())
+            report = offset_parser.parse_offsets(text.splitlines())
+            notes = report.summary()
+            if not report.values:
+                outbox.send_message(m.chat.id, "❌ No valid offsets. Send hex (0xc23fa50) or decimal offsets, one per line."
+                                    + ("\n\n" + notes if notes else ""))
+                return
+            st.offsets = list(report.formatted())
+            st.step = 2
+            user_state.set(uid, st)
+            if notes:
+                outbox.send_message(m.chat.id, notes)
+            outbox.send_message(m.chat.id, "🎀 Patch Lib Like This (PATCH_LIB)\n🎀 Memory Patch like This (MemoryPatch)\n\n🤖 Choice Option :", reply_markup=struct_type_kb())
+            return
+
+        if flow in ("simple_single", "simple_multi") and st.step == 3:
+            # custom hex payload typed after "✏️ Custom Bytes"
+            hex_bytes = generator.parse_hex_bytes(text)
+            if hex_bytes is None:
+                outbox.send_message(m.chat.id, f"❌ Invalid bytes. Send up to {generator.MAX_HEX_BYTES} hex bytes (example: 00 20 70 47):")
+                return
+            st.hex_bytes = hex_bytes
+            st.step = 2
+            user_state.set(uid, st)
+            outbox.send_message(m.chat.id, "💫 UE4 - ( libUE4.so )\n💫 Anogs - ( libanogs.so )\n💫 Anort - ( libanort.so )\n\n🤖 Choice Option :", reply_markup=lib_choice_kb())
             return
 
         if flow == "hook":
-            step = st.get("step")
+            step = st.step
             if step == 1:
                 # got offset
-                offset = text.strip().split()[0]
-                st['offsets'] = [offset]
-                st['step'] = 2
-                user_state[uid] = st
-                bot.send_message(m.chat.id, "⭐ Send connect params separated by comma (example: connect1,connect2):")
+                offset = offset_parser.parse_one(text)
+                if offset is None:
+                    outbox.send_message(m.chat.id, "❌ Invalid offset. Send a hex (0xc23fa50) or decimal offset:")
+                    return
+                st.offsets = [offset]
+                st.step = 2
+                user_state.set(uid, st)
+                outbox.send_message(m.chat.id, "⭐ Send connect params separated by comma (example: connect1,connect2):")
                 return
             elif step == 2:
                 params = [p.strip() for p in text.split(",") if p.strip()]
-                st['connect_params'] = params
-                st['step'] = 3
-                user_state[uid] = st
-                bot.send_message(m.chat.id, "💫 UE4 - ( libUE4.so )\n💫 Anogs - ( libanogs.so )\n💫 Anort - ( libanort.so )\n\n🤖 Choice Option :", reply_markup=lib_choice_kb())
+                st.connect_params = params
+                st.step = 3
+                user_state.set(uid, st)
+                outbox.send_message(m.chat.id, "💫 UE4 - ( libUE4.so )\n💫 Anogs - ( libanogs.so )\n💫 Anort - ( libanort.so )\n\n🤖 Choice Option :", reply_markup=lib_choice_kb())
                 return
 
     # if nothing matched, show help / start hint
-    bot.send_message(m.chat.id, "Use /start to begin or tap the menu. If owner, send /ownercmd.")
+    outbox.send_message(m.chat.id, "Use /start to begin or tap the menu. If owner, send /ownercmd.")
 
 # helper to make 4-word code if username missing
 def generate_random_code_for_user(tg_id):
     # deterministic simple code
     return f"U{str(tg_id)[-4:]}"
 
-# ----------------- EXTRA: handle owner_check_users callback
-@bot.callback_query_handler(func=lambda c: c.data == "owner_check_users")
-def owner_check_users_cb(call):
-    if call.from_user.id != OWNER_ID:
-        bot.answer_callback_query(call.id, "Not allowed.")
-        return
-    conn = db_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM users")
-    total = cur.fetchone()[0]
-    cur.execute("SELECT tg_id, username, full_name FROM users ORDER BY first_seen DESC LIMIT 7")
-    rows = cur.fetchall()
-    conn.close()
+# ----------------- EXTRA: owner_check_users callback (button in /ownercmd)
+@callbacks.route("owner_check_users", middleware=[owner_only])
+def owner_check_users_cb(call, _):
+    total = storage.stats_totals()["users"]
+    rows = storage.recent_users(7)
     lines = []
     for i, r in enumerate(rows, start=1):
         uname = f"@{r[1]}" if r[1] else f"{generate_random_code_for_user(r[0])} {r[2][:20]}"
         lines.append(f"👤 {i} : {uname}")
-    bot.send_message(call.message.chat.id, f"👤 Total User Profile : {total}\n\n" + "\n".join(lines))
+    outbox.send_message(call.message.chat.id, f"👤 Total User Profile : {total}\n\n" + "\n".join(lines))
+
+# ----------------- WARM-UP -----------------
+# Render's free plan sleeps the service, so restarts are frequent. The schema
+# check at import is a single PRAGMA read; everything else that can wait runs
+# here, in the background, once updates are being received.
+def warm_up():
+    start = time.perf_counter()
+    try:
+        storage.optimize()
+        users = storage.recently_active_users(WARM_UP_USERS) if WARM_UP_USERS > 0 else []
+        for user_id in users:
+            check_channel_membership(user_id)
+            try:
+                profile_cache.get_or_load(user_id)
+            except Exception as e:
+                logging.info("Warm-up: profile of %s failed: %s", user_id, e)
+    finally:
+        storage.close_thread()
+    logging.info("Warm-up done: %d users in %.0f ms", len(users), (time.perf_counter() - start) * 1000)
+
+def start_background_work():
+    logging.info("Receiving updates %.0f ms after start.", (time.perf_counter() - STARTED) * 1000)
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+    # a broadcast cut off by a restart (redeploy, free-plan sleep) carries on
+    row = broadcaster.resume(interrupted_only=True)
+    if row is not None:
+        outbox.send_message(row["owner_chat_id"], f"📣 Broadcast #{row['id']} continues after a restart.")
+
+# ----------------- START (webhook or polling) -----------------
+# webhook when a public URL is known (Render), long polling otherwise;
+# --polling / --webhook or BOT_MODE override
+def run_mode(argv):
+    if "--polling" in argv:
+        return "polling"
+    if "--webhook" in argv:
+        return "webhook"
+    return os.environ.get("BOT_MODE") or ("webhook" if webhook.WEBHOOK_URL else "polling")
+
+async def run_bot(mode, dispatcher=None):
+    # workers.py passes a WorkerPool that hands updates to worker processes;
+    # their caches live there, so this process has nothing to warm up
+    on_ready = start_background_work if dispatcher is None else None
+    dispatcher = dispatcher or UpdateDispatcher(bot)
+    # quiet moments are judged by the updates this process receives
+    maintainer.start(requests=lambda: dispatcher.received)
+    if mode == "webhook":
+        # uvicorn handles SIGTERM and drains the dispatcher on shutdown
+        secret = os.environ.get("WEBHOOK_SECRET") or webhook.default_secret(BOT_TOKEN)
+        await webhook.serve(bot, dispatcher, secret_token=secret, on_ready=on_ready)
+        return
+    loop = asyncio.get_running_loop()
+    # Render stops services with SIGTERM; finish in-flight updates then flush writes
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, dispatcher.stop)
+    if webhook.METRICS_PORT:
+        webhook.start_metrics_server()
+    # getUpdates is refused while a webhook is registered
+    await loop.run_in_executor(None, bot.remove_webhook)
+    if on_ready:
+        on_ready()
+    await dispatcher.run_polling(timeout=20, long_polling_timeout=5)
 
-# ----------------- START POLLING -----------------
 if __name__ == "__main__":
-    logging.info("Bot started.")
+    mode = run_mode(sys.argv[1:])
+    logging.info("Bot started (%s).", mode)
     try:
-        bot.infinity_polling(timeout=20, long_polling_timeout = 5)
+        asyncio.run(run_bot(mode))
     except Exception as e:
         logging.exception("Bot crashed: %s", e)
+    finally:
+        maintainer.stop()
+        outbox.close()
+        db_writer.close()
+        storage.close_all()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# broadcast.py - owner broadcasts: one message to every user, paced and resumable
+#
+# Recipients are read from users in tg_id order, BATCH ids at a time
+# (storage.user_id_batches). Messages go through the outbox, which retries
+# 429s and 5xx, but are fed to it at no more than RATE per second - below the
+# outbox's 30/s global budget, so interactive replies still go out promptly -
+# and not at all while BACKOFF_DEPTH replies are already queued there.
+#
+# After each batch has been sent, its last tg_id is written to the broadcast's
+# row as the checkpoint. A broadcast that is stopped, or interrupted by a
+# restart, continues after the checkpoint: users of the unfinished batch may
+# get the message twice, nobody is skipped.
+
+import os
+import time
+import logging
+import threading
+from typing import Callable, Optional
+
+from telebot.apihelper import ApiTelegramException
+
+import storage
+from outbox import TokenBucket
+
+RATE = float(os.environ.get("BROADCAST_RATE", "20"))     # messages/s
+BATCH = int(os.environ.get("BROADCAST_BATCH", "100"))    # users per checkpoint
+BACKOFF_DEPTH = int(os.environ.get("BROADCAST_BACKOFF_DEPTH", "20"))
+PROGRESS_SECONDS = float(os.environ.get("BROADCAST_PROGRESS_SECONDS", "15"))
+
+
+class Broadcaster:
+    """Runs at most one broadcast at a time, on a background thread.
+
+    on_progress(row, finished) gets the broadcast's row (as returned by
+    storage.get_broadcast) every PROGRESS_SECONDS while it runs, and once
+    more, with finished=True, when it is done or stopped.
+    """
+
+    def __init__(self, outbox, writer, on_progress: Optional[Callable] = None,
+                 rate: float = RATE, batch: int = BATCH, backoff_depth: int = BACKOFF_DEPTH):
+        self.outbox = outbox
+        self.writer = writer
+        self.on_progress = on_progress
+        self.rate = rate
+        self.batch = batch
+        self.backoff_depth = backoff_depth
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.current: Optional[dict] = None   # row of the running broadcast, updated per batch
+
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, text: str, owner_chat_id: int) -> Optional[int]:
+        """Start broadcasting text; its id, or None while another one is running."""
+        with self._lock:
+            if self.running():
+                return None
+            broadcast_id = self.writer.call(storage.create_broadcast, text, owner_chat_id)
+            self._launch(storage.get_broadcast(broadcast_id))
+            return broadcast_id
+
+    def resume(self, interrupted_only: bool = False) -> Optional[dict]:
+        """Continue the latest broadcast if it isn't done; its row, or None.
+
+        interrupted_only: only one that was still running when the process
+        stopped (not one the owner stopped).
+        """
+        with self._lock:
+            if self.running():
+                return None
+            row = storage.get_broadcast()
+            if row is None or row["status"] == "done" or (interrupted_only and row["status"] != "running"):
+                return None
+            self._launch(row)
+            return row
+
+    def stop(self, timeout: Optional[float] = None) -> bool:
+        """Stop after the messages already handed to the outbox; False if nothing was running."""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return False
+        self._stop.set()
+        thread.join(timeout)
+        return True
+
+    def _launch(self, row: dict):
+        self._stop.clear()
+        self.current = dict(row, status="running")
+        self._thread = threading.Thread(target=self._run, args=(self.current,), name="broadcast", daemon=True)
+        self._thread.start()
+
+    # ----------------- sending -----------------
+    def _run(self, b: dict):
+        bucket = TokenBucket(self.rate, max(1.0, self.rate))
+        reported = time.monotonic()
+        logging.info("Broadcast %s: sending to users after %s", b["id"], b["last_tg_id"])
+        try:
+            for ids in storage.user_id_batches(after=b["last_tg_id"], batch=self.batch):
+                sent = []
+                for tg_id in ids:
+                    self._pace(bucket)
+                    if self._stop.is_set():
+                        break
+                    sent.append((tg_id, self.outbox.send_message(tg_id, b["text"])))
+                for tg_id, fut in sent:
+                    self._count(b, fut)
+                if sent:
+                    b["last_tg_id"] = sent[-1][0]
+                if self._stop.is_set():
+                    b["status"] = "stopped"
+                    break
+                self._checkpoint(b)
+                if self.on_progress is not None and time.monotonic() - reported >= PROGRESS_SECONDS:
+                    reported = time.monotonic()
+                    self.on_progress(dict(b), False)
+            else:
+                b["status"] = "done"
+        except Exception as e:
+            logging.exception("Broadcast %s failed: %s", b["id"], e)
+            b["status"] = "stopped"
+        self._checkpoint(b)
+        logging.info("Broadcast %s %s: %s sent, %s blocked, %s failed",
+                     b["id"], b["status"], b["sent"], b["blocked"], b["failed"])
+        try:
+            if self.on_progress is not None:
+                self.on_progress(dict(b), True)
+        finally:
+            storage.close_thread()
+
+    def _pace(self, bucket: TokenBucket):
+        # interactive replies first: wait while they queue up in the outbox
+        while self.outbox.depth() > self.backoff_depth and not self._stop.is_set():
+            time.sleep(0.05)
+        now = time.monotonic()
+        wait = bucket.delay(now)
+        if wait:
+            self._stop.wait(wait)
+            now = time.monotonic()
+        bucket.take(now)
+
+    @staticmethod
+    def _count(b: dict, fut):
+        try:
+            fut.result()
+            b["sent"] += 1
+        except ApiTelegramException as e:
+            # 403: the user blocked the bot or deleted their account
+            b["blocked" if e.error_code == 403 else "failed"] += 1
+        except Exception:
+            b["failed"] += 1
+
+    def _checkpoint(self, b: dict):
+        self.writer.submit(storage.checkpoint_broadcast, b["id"], b["status"], b["last_tg_id"],
+                           b["sent"], b["blocked"], b["failed"])
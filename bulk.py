@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# bulk.py - streaming input/output for large multi-offset structures
+#
+# An uploaded offsets file is downloaded in chunks and spooled to disk one
+# offset per line; generation later reads it back lazily, and the generated
+# lines are written straight into size-capped output files. Nothing holds the
+# whole input or output in memory.
+
+import os
+import time
+import tempfile
+import logging
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import requests
+from telebot import apihelper
+
+BULK_DIR = os.environ.get("BULK_DIR", os.path.join(tempfile.gettempdir(), "bot99_bulk"))
+# Bot API limits: bots can download files up to 20 MB and upload up to 50 MB
+MAX_UPLOAD_BYTES = 20 * 1024 * 1024
+CHUNK_BYTES = int(os.environ.get("BULK_CHUNK_BYTES", str(8 * 1024 * 1024)))
+# spooled inputs older than this are leftovers from abandoned flows
+SPOOL_MAX_AGE = int(os.environ.get("STATE_TTL", "1800"))
+
+
+def _file_url(token: str, file_path: str) -> str:
+    template = apihelper.FILE_URL or "https://api.telegram.org/file/bot{0}/{1}"
+    return template.format(token, file_path)
+
+
+def iter_remote_lines(token: str, file_path: str) -> Iterator[str]:
+    """Stream a Telegram file line by line without loading it whole."""
+    with requests.get(_file_url(token, file_path), stream=True, timeout=60,
+                      proxies=apihelper.proxy) as resp:
+        resp.raise_for_status()
+        for raw in resp.iter_lines(chunk_size=64 * 1024):
+            yield raw.decode("utf-8", errors="replace")
+
+
+def spool(lines: Iterable[str], prefix: str = "offsets") -> Tuple[str, int]:
+    """Write lines to a new file under BULK_DIR; returns (path, line count)."""
+    os.makedirs(BULK_DIR, exist_ok=True)
+    sweep_spool()
+    fd, path = tempfile.mkstemp(prefix=prefix + "_", suffix=".txt", dir=BULK_DIR)
+    count = 0
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        for line in lines:
+            f.write(line)
+            f.write("\n")
+            count += 1
+    return path, count
+
+
+def iter_spooled(path: str) -> Iterator[str]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            yield line.rstrip("\n")
+
+
+def write_chunks(lines: Iterable[str], prefix: str, chunk_bytes: int = CHUNK_BYTES,
+                 header: Optional[str] = None) -> List[str]:
+    """Write lines into files of at most chunk_bytes each; returns their paths.
+
+    header, if given, starts every file, so each one can be read on its own.
+    """
+    os.makedirs(BULK_DIR, exist_ok=True)
+    head = b"" if header is None else (header + "\n").encode("utf-8")
+    paths, f, size = [], None, 0
+    try:
+        for line in lines:
+            data = (line + "\n").encode("utf-8")
+            if f is None or (size > len(head) and size + len(data) > chunk_bytes):
+                if f is not None:
+                    f.close()
+                fd, path = tempfile.mkstemp(prefix=prefix + "_", suffix=".txt", dir=BULK_DIR)
+                f, size = os.fdopen(fd, "wb"), len(head)
+                f.write(head)
+                paths.append(path)
+            f.write(data)
+            size += len(data)
+    finally:
+        if f is not None:
+            f.close()
+    return paths
+
+
+def remove(paths: Iterable[str]):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def sweep_spool(max_age: int = SPOOL_MAX_AGE):
+    cutoff = time.time() - max_age
+    try:
+        names = os.listdir(BULK_DIR)
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(BULK_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError as e:
+            logging.info("Could not sweep %s: %s", path, e)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# cache.py - small in-process caches for Bot API lookups
+#
+# TTLCache is a thread-safe LRU with a per-entry expiry: get() moves a hit to
+# the most-recently-used end, set() evicts from the other end once maxsize is
+# reached. Hit/miss/eviction counters are kept for tuning.
+#
+# RefreshingCache adds stale-while-revalidate on top: past its fresh TTL an
+# entry is still served (for up to max_stale more seconds) while a background
+# thread reloads it.
+
+import threading
+import time
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+_MISSING = object()
+
+
+class TTLCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()   # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING or entry[0] <= now:
+                if entry is not _MISSING:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def purge_expired(self) -> int:
+        now = time.monotonic()
+        with self._lock:
+            dead = [k for k, (expires, _) in self._data.items() if expires <= now]
+            for k in dead:
+                del self._data[k]
+        return len(dead)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+class RefreshingCache(TTLCache):
+    def __init__(self, maxsize: int, ttl: float, max_stale: float, loader, workers: int = 2):
+        # entries live ttl + max_stale; the fresh deadline is stored with the value
+        super().__init__(maxsize, ttl + max_stale)
+        self.fresh_ttl = ttl
+        self.loader = loader
+        self._refreshing = set()
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="cache-refresh")
+        self.stale_hits = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    def put(self, key, value):
+        self.set(key, (time.monotonic() + self.fresh_ttl, value))
+
+    def get_or_load(self, key):
+        entry = self.get(key)
+        if entry is None:
+            value = self.loader(key)
+            if value is not None:
+                self.put(key, value)
+            return value
+        fresh_until, value = entry
+        if time.monotonic() > fresh_until:
+            self.stale_hits += 1
+            self._schedule_refresh(key)
+        return value
+
+    def _schedule_refresh(self, key):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        self._executor.submit(self._refresh, key)
+
+    def _refresh(self, key):
+        try:
+            value = self.loader(key)
+            if value is not None:
+                self.put(key, value)
+                self.refreshes += 1
+        except Exception as e:
+            # keep serving the stale entry until it expires
+            self.refresh_errors += 1
+            logging.info("Cache refresh for %s failed: %s", key, e)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def stats(self) -> dict:
+        out = super().stats()
+        out.update(stale_hits=self.stale_hits, refreshes=self.refreshes, refresh_errors=self.refresh_errors)
+        return out
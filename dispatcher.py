@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# dispatcher.py - asyncio update dispatcher for bot99
+#
+# Updates are received on an asyncio loop and each one is handed to the
+# TeleBot handlers on a thread pool, so a slow Bot API call or DB query in one
+# handler no longer holds up anyone else. Updates from the same user are
+# chained and run strictly in arrival order, which the user_state flows rely
+# on; updates from different users run concurrently.
+
+import os
+import re
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+WORKERS = int(os.environ.get("HANDLER_WORKERS", "16"))
+MAX_PENDING = int(os.environ.get("MAX_PENDING_UPDATES", "1000"))
+
+
+def update_user_key(update):
+    # the user an update belongs to; updates without one get their own key
+    for attr in ("message", "edited_message", "callback_query", "inline_query",
+                 "chosen_inline_result", "my_chat_member", "chat_member", "chat_join_request"):
+        obj = getattr(update, attr, None)
+        if obj is not None and getattr(obj, "from_user", None) is not None:
+            return obj.from_user.id
+    return ("update", update.update_id)
+
+
+_INDEX = re.compile(r"_\d+$")
+
+
+def update_route(update) -> str:
+    # metrics label: "/command", "cb:<callback data prefix>" or the update/content type
+    msg = update.message
+    if msg is not None:
+        text = msg.text or ""
+        if text.startswith("/"):
+            return text.split(None, 1)[0].split("@", 1)[0].lower()[:32]
+        return msg.content_type
+    cb = update.callback_query
+    if cb is not None:
+        # ids, cursors and list indexes would make a series per button
+        return "cb:" + _INDEX.sub("_N", (cb.data or "").split(":", 1)[0])[:32]
+    for attr in ("edited_message", "inline_query", "chosen_inline_result", "my_chat_member",
+                 "chat_member", "chat_join_request"):
+        if getattr(update, attr, None) is not None:
+            return attr
+    return "other"
+
+
+class UpdateDispatcher:
+    def __init__(self, bot, workers: int = WORKERS, max_pending: int = MAX_PENDING):
+        # handlers must run inline on our worker threads, not on TeleBot's own pool
+        bot.threaded = False
+        self.bot = bot
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="handler")
+        self._poller = ThreadPoolExecutor(1, thread_name_prefix="poller")
+        self._room = None
+        self._max_pending = max_pending
+        self._tails = {}
+        self._stopping = None
+        self._in_flight = 0
+        self.processed = 0
+        self.failed = 0
+        self.received = 0     # updates accepted; maintenance.py watches its rate
+
+    def _ensure_loop_state(self):
+        # asyncio primitives are created lazily on the running loop
+        if self._room is None:
+            self._room = asyncio.Event()
+            self._stopping = asyncio.Event()
+
+    async def feed(self, update):
+        """Schedule one update; waits only when MAX_PENDING updates are already in flight."""
+        self._ensure_loop_state()
+        while self._in_flight >= self._max_pending:
+            self._room.clear()
+            await self._room.wait()
+        return self._schedule(update)
+
+    def feed_nowait(self, update):
+        """Schedule one update without waiting; returns None when the pool is full."""
+        self._ensure_loop_state()
+        if self._in_flight >= self._max_pending:
+            return None
+        return self._schedule(update)
+
+    def _schedule(self, update):
+        self._in_flight += 1
+        self.received += 1
+        key = update_user_key(update)
+        prev = self._tails.get(key)
+        task = asyncio.get_running_loop().create_task(self._process(prev, key, update))
+        self._tails[key] = task
+        return task
+
+    async def _process(self, prev, key, update):
+        try:
+            if prev is not None:
+                # per-user ordering; the previous update's outcome doesn't matter
+                await asyncio.wait([prev])
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self.executor, self._handle, update)
+            self.processed += 1
+        except Exception:
+            self.failed += 1
+            logging.exception("Update %s failed", update.update_id)
+        finally:
+            if self._tails.get(key) is asyncio.current_task():
+                del self._tails[key]
+            self._in_flight -= 1
+            self._room.set()
+
+    def _handle(self, update):
+        route = update_route(update)
+        start = time.perf_counter()
+        try:
+            self.bot.process_new_updates([update])
+        except Exception:
+            metrics.handler_errors.inc(route=route)
+            raise
+        finally:
+            metrics.handler_seconds.observe(time.perf_counter() - start, route=route)
+
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    async def drain(self):
+        while self._tails:
+            await asyncio.wait(list(self._tails.values()))
+
+    def stop(self):
+        if self._stopping is not None:
+            self._stopping.set()
+
+    async def run_polling(self, timeout: int = 20, long_polling_timeout: int = 5):
+        self._ensure_loop_state()
+        loop = asyncio.get_running_loop()
+        offset = None
+        while not self._stopping.is_set():
+            try:
+                updates = await loop.run_in_executor(
+                    self._poller,
+                    lambda: self.bot.get_updates(offset=offset, timeout=timeout,
+                                                 long_polling_timeout=long_polling_timeout))
+            except Exception as e:
+                logging.info("get_updates failed: %s", e)
+                await asyncio.sleep(3)
+                continue
+            for update in updates:
+                offset = update.update_id + 1
+                await self.feed(update)
+        if offset is not None:
+            # confirm the last batch so it isn't redelivered after a restart
+            try:
+                await loop.run_in_executor(
+                    self._poller, lambda: self.bot.get_updates(offset=offset, limit=1, timeout=timeout,
+                                                               long_polling_timeout=0))
+            except Exception as e:
+                logging.info("Final get_updates failed: %s", e)
+        await self.shutdown()
+
+    async def shutdown(self):
+        await self.drain()
+        self.executor.shutdown(wait=True)
+        self._poller.shutdown(wait=False)
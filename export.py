@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# export.py - streaming CSV / JSONL exports of users and saved structures
+#
+# Rows come from storage's paged table walks and go straight into size-capped
+# files (bulk.write_chunks), one row per line, so memory use doesn't depend
+# on how big the tables are. bot99 sends the files to the owner (/export).
+
+import io
+import csv
+import json
+import itertools
+from typing import Iterator, List
+
+import bulk
+import storage
+
+# table -> (column names, row iterator)
+TABLES = {
+    "users": (("tg_id", "username", "full_name", "first_seen", "structures_count"), storage.iter_users),
+    "structures": (("id", "user_tg_id", "created_at", "text"), storage.iter_saved_structures),
+}
+FORMATS = ("csv", "jsonl")
+
+
+def iter_lines(table: str, fmt: str) -> Iterator[str]:
+    """The export of table as lines: a CSV header and rows, or one JSON object per row."""
+    columns, rows = TABLES[table]
+    if fmt == "jsonl":
+        for row in rows():
+            yield json.dumps(dict(zip(columns, row)), ensure_ascii=False, separators=(",", ":"))
+        return
+    if fmt != "csv":
+        raise ValueError(f"unknown export format {fmt!r}")
+    # one reused buffer; a quoted field may span lines (structure texts do).
+    # The csv module only quotes newlines that are in lineterminator, so keep
+    # it and strip it off the row instead
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    for row in itertools.chain([columns], rows()):
+        buf.seek(0)
+        buf.truncate()
+        writer.writerow(row)
+        yield buf.getvalue()[:-1]
+
+
+def write_files(table: str, fmt: str) -> List[str]:
+    """Export table into files of at most bulk.CHUNK_BYTES each; returns their paths.
+
+    Every CSV part starts with the header row, so each one loads on its own.
+    """
+    lines = iter_lines(table, fmt)
+    header = next(lines) if fmt == "csv" else None
+    return bulk.write_chunks(lines, prefix=f"export_{table}", header=header)
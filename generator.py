@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# generator.py - structure code generation
+#
+# Each (struct type, lib, hex bytes) combination is compiled once into a
+# prefix/suffix pair around the offset, so rendering N offsets is a single
+# str.join instead of N f-string formats. Inline-sized results are memoized
+# in a content-addressed LRU keyed on (type, lib, hash of offsets, bytes):
+# the same structure requested again (common across users) is not rebuilt.
+
+import os
+import re
+import hashlib
+from functools import lru_cache
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from cache import TTLCache
+
+PATCH_LIB = "PATCH_LIB"
+MEMORY_PATCH = "MemoryPatch"
+HOOK_LIB = "HOOK_LIB"
+
+# (line before the offset, line after it); {lib}/{hex}/{params} filled at compile time
+TEMPLATES = {
+    PATCH_LIB: ('PATCH_LIB("{lib}", ', ', "{hex}");'),
+    MEMORY_PATCH: ('MemoryPatch::createWithHex("{lib}",', ', "{hex}").Modify();'),
+    HOOK_LIB: ('HOOK_LIB("{lib}", ', ', {params});'),
+}
+
+DEFAULT_HEX = {
+    PATCH_LIB: "00 20 70 47",
+    MEMORY_PATCH: "73 6F 6E 52 65",
+}
+
+# payloads offered on the hex-bytes keyboard: (button label, bytes)
+HEX_PRESETS = {
+    PATCH_LIB: [
+        ("Default (00 20 70 47)", "00 20 70 47"),
+        ("Return 1 (01 20 70 47)", "01 20 70 47"),
+        ("ARM64 NOP", "1F 20 03 D5"),
+        ("ARM64 RET", "C0 03 5F D6"),
+    ],
+    MEMORY_PATCH: [
+        ("Default (73 6F 6E 52 65)", "73 6F 6E 52 65"),
+        ("ARM return 0", "00 00 A0 E3 1E FF 2F E1"),
+        ("ARM64 NOP", "1F 20 03 D5"),
+        ("ARM64 RET", "C0 03 5F D6"),
+    ],
+}
+
+MAX_HEX_BYTES = 64
+MEMO_SIZE = int(os.environ.get("GEN_CACHE_SIZE", "2048"))
+MEMO_TTL = int(os.environ.get("GEN_CACHE_TTL", "3600"))
+
+_HEX_RE = re.compile(r"[0-9A-Fa-f]{2}")
+
+memo = TTLCache(MEMO_SIZE, MEMO_TTL)
+
+
+def parse_hex_bytes(text: str) -> Optional[str]:
+    """Normalize user-typed bytes ("00 20 70 47", "00207047", "0x00,0x20") to "00 20 70 47"."""
+    cleaned = re.sub(r"0[xX]|[\s,;:]", "", text)
+    if not cleaned or len(cleaned) % 2 or len(cleaned) > 2 * MAX_HEX_BYTES:
+        return None
+    pairs = _HEX_RE.findall(cleaned)
+    if len(pairs) * 2 != len(cleaned):
+        return None
+    return " ".join(p.upper() for p in pairs)
+
+
+class Template:
+    __slots__ = ("prefix", "suffix", "_sep")
+
+    def __init__(self, prefix: str, suffix: str):
+        self.prefix = prefix
+        self.suffix = suffix
+        self._sep = suffix + "\n" + prefix
+
+    def lines(self, offsets: Iterable[str]) -> Iterator[str]:
+        prefix, suffix = self.prefix, self.suffix
+        for off in offsets:
+            yield prefix + off + suffix
+
+    def render(self, offsets: List[str]) -> str:
+        if not offsets:
+            return ""
+        return self.prefix + self._sep.join(offsets) + self.suffix
+
+
+@lru_cache(maxsize=256)
+def compile_template(stype: str, lib: str, hex_bytes: Optional[str] = None, params: str = "") -> Template:
+    before, after = TEMPLATES[stype]
+    hex_bytes = hex_bytes or DEFAULT_HEX.get(stype, "")
+    fill = {"lib": lib, "hex": hex_bytes, "params": params}
+    return Template(before.format(**fill), after.format(**fill))
+
+
+def memo_key(stype: str, lib: str, offsets: List[str], hex_bytes: Optional[str], params: str = "") -> str:
+    h = hashlib.blake2b(digest_size=16)
+    for part in (stype, lib, hex_bytes or DEFAULT_HEX.get(stype, ""), params):
+        h.update(part.encode())
+        h.update(b"\0")
+    h.update("\n".join(offsets).encode())
+    return h.hexdigest()
+
+
+def render(stype: str, lib: str, offsets: List[str], hex_bytes: Optional[str] = None,
+           params: str = "") -> Tuple[str, str]:
+    """Full text for a small offsets list, memoized; returns (text, memo key)."""
+    key = memo_key(stype, lib, offsets, hex_bytes, params)
+    text = memo.get(key)
+    if text is None:
+        text = compile_template(stype, lib, hex_bytes, params).render(offsets)
+        memo.set(key, text)
+    return text, key
+
+
+def iter_lines(stype: str, lib: str, offsets: Iterable[str], hex_bytes: Optional[str] = None,
+               params: str = "") -> Iterator[str]:
+    """Lazy per-offset lines for streamed (file) inputs; not memoized."""
+    return compile_template(stype, lib, hex_bytes, params).lines(offsets)
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+# maintenance.py - background upkeep of the SQLite store (bot_data.db)
+#
+# Without it the file only grows: expired drafts pile up, deleted rows leave
+# free pages behind, the planner statistics go stale and nothing is backed
+# up. Scheduler runs the JOBS below on a daemon thread:
+#
+#   checkpoint  PASSIVE WAL checkpoint (never waits for readers or writers)
+#   drafts      expire drafts older than DRAFT_TTL, DRAFT_BATCH per transaction
+#   vacuum      give free pages back to the OS, VACUUM_PAGES per step
+#   analyze     refresh the planner statistics (ANALYZE, sampled)
+#   backup      online copy with the sqlite3 backup API into BACKUP_DIR
+#   convert     switch an older database to auto_vacuum=incremental (by hand only)
+#
+# A job runs when its interval has passed and the bot is quiet - fewer than
+# QUIET_RATE updates/s over the last QUIET_WINDOW seconds - or regardless
+# once it is a whole interval overdue. Each run gets BUDGET seconds and works
+# in short steps queued on the write-behind writer like any other write -
+# a second writing connection would make live writes wait in SQLite's busy
+# handler instead - so a user's write waits for one step at most; a job that
+# runs out of time carries on at the next check. When each job last finished is kept in the
+# maintenance table, so restarts don't reset the schedule.
+
+import os
+import glob
+import time
+import logging
+import threading
+import collections
+from typing import Callable, Optional, Tuple
+
+import metrics
+import storage
+
+CHECK_SECONDS = float(os.environ.get("MAINTENANCE_CHECK_SECONDS", "30"))
+QUIET_RATE = float(os.environ.get("MAINTENANCE_QUIET_RATE", "0.5"))       # updates/s
+QUIET_WINDOW = float(os.environ.get("MAINTENANCE_QUIET_WINDOW", "120"))   # seconds
+BUDGET = float(os.environ.get("MAINTENANCE_BUDGET_SECONDS", "2"))         # per job run
+STEP_PAUSE = 0.01   # seconds between steps
+
+DRAFT_BATCH = int(os.environ.get("MAINTENANCE_DRAFT_BATCH", "500"))
+VACUUM_PAGES = int(os.environ.get("MAINTENANCE_VACUUM_PAGES", "256"))
+ANALYSIS_LIMIT = int(os.environ.get("MAINTENANCE_ANALYSIS_LIMIT", "400"))
+# an older database (auto_vacuum=none) is switched over with one full VACUUM,
+# by the convert job when it is at most this big; a bigger one needs
+# `python storage.py compact` with the bot stopped
+CONVERT_MAX_BYTES = int(os.environ.get("MAINTENANCE_CONVERT_MAX_MB", "64")) * 1024 * 1024
+BACKUP_DIR = os.environ.get("BACKUP_DIR", "")      # default: backups/ next to the database
+BACKUP_PAGES = 1024   # per backup step; the copy restarts if another connection writes meanwhile
+BACKUP_KEEP = max(1, int(os.environ.get("BACKUP_KEEP", "3")))
+
+
+def _every(name: str, default: int) -> int:
+    # job interval in seconds; 0 turns the job off
+    return int(os.environ.get(f"MAINTENANCE_{name.upper()}_EVERY", str(default)))
+
+
+class _OutOfTime(Exception):
+    pass
+
+
+def _steps(step: Callable[[], bool], deadline: float) -> bool:
+    """Call step() until it returns False (nothing left) or deadline passes; True if finished."""
+    while step():
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(STEP_PAUSE)
+    return True
+
+
+def _mb(n: int) -> str:
+    return f"{n / (1024 * 1024):.1f} MB"
+
+
+# ----------------- JOBS -----------------
+# job(writer, deadline) -> (finished, summary); writer is the write-behind
+# queue (or a workers.py RemoteWriter), deadline a time.monotonic() value.
+# Steps sent to the writer are module-level functions so they can be shipped
+# to the writer process.
+def _expire_drafts_step() -> Tuple[int, int]:
+    return storage.gc_drafts(limit=DRAFT_BATCH)
+
+
+def _vacuum_step() -> int:
+    return storage.incremental_vacuum(VACUUM_PAGES)
+
+
+def _analyze_step():
+    storage.analyze(ANALYSIS_LIMIT)
+
+
+def checkpoint(writer, deadline: float) -> Tuple[bool, str]:
+    # on this thread's connection: a checkpoint can't run inside the writer's transaction
+    _, frames, done = storage.wal_checkpoint("PASSIVE")
+    return True, f"{done}/{frames} WAL frames checkpointed"
+
+
+def expire_drafts(writer, deadline: float) -> Tuple[bool, str]:
+    total = [0, 0]
+
+    def step():
+        drafts, blobs = writer.call(_expire_drafts_step)
+        total[0] += drafts
+        total[1] += blobs
+        return drafts == DRAFT_BATCH
+
+    finished = _steps(step, deadline)
+    return finished, f"{total[0]} drafts and {total[1]} texts expired"
+
+
+def vacuum(writer, deadline: float) -> Tuple[bool, str]:
+    mode = storage.auto_vacuum_mode()
+    if mode != "incremental":
+        # nothing to release page by page; the rebuild blocks writes, so it is left to the owner
+        return True, f"auto_vacuum is {mode}: /maintenance run convert switches it over"
+    page_size = storage.space_used()["page_size"]
+    freed = [0]
+
+    def step():
+        n = writer.call(_vacuum_step)
+        freed[0] += n
+        return n > 0 and storage.free_pages() > 0
+
+    finished = _steps(step, deadline)
+    return finished, f"{freed[0]} free pages ({_mb(freed[0] * page_size)}) released, {storage.free_pages()} left"
+
+
+def convert(writer, deadline: float) -> Tuple[bool, str]:
+    mode = storage.auto_vacuum_mode()
+    if mode == "incremental":
+        return True, "auto_vacuum is already incremental"
+    size = storage.space_used()["bytes"]
+    if size > CONVERT_MAX_BYTES:
+        return True, f"auto_vacuum is {mode} and the database is {_mb(size)}: stop the bot and run storage.py compact"
+    # expire drafts through the writer first, a batch at a time (past the
+    # budget if need be: nobody waits for them), so VACUUM copies less
+    _, drafts = expire_drafts(writer, float("inf"))
+    # VACUUM can't run inside the writer's transaction; writes queued
+    # meanwhile wait for it in the busy handler, hence small databases only
+    writer.flush()
+    storage.execute("VACUUM")
+    after = storage.space_used()["bytes"]
+    return True, f"auto_vacuum is now {storage.auto_vacuum_mode()}; {drafts}, reclaimed {_mb(max(0, size - after))}"
+
+
+def analyze(writer, deadline: float) -> Tuple[bool, str]:
+    writer.call(_analyze_step)
+    return True, "statistics refreshed"
+
+
+def backup_dir() -> str:
+    return BACKUP_DIR or os.path.join(os.path.dirname(os.path.abspath(storage.DB_PATH)), "backups")
+
+
+def backup(writer, deadline: float) -> Tuple[bool, str]:
+    directory = backup_dir()
+    os.makedirs(directory, exist_ok=True)
+    prefix = os.path.join(directory, os.path.splitext(os.path.basename(storage.DB_PATH))[0] + "-")
+    path = prefix + time.strftime("%Y%m%d-%H%M%S", time.gmtime()) + ".db"
+    part = path + ".part"
+
+    def progress(status, remaining, total):
+        if time.monotonic() >= deadline:
+            raise _OutOfTime()
+
+    try:
+        storage.backup(part, pages=BACKUP_PAGES, sleep=STEP_PAUSE, progress=progress)
+    except _OutOfTime:
+        os.remove(part)
+        return False, "out of time, will start over"
+    os.replace(part, path)
+    backups = sorted(glob.glob(glob.escape(prefix) + "*.db"))   # oldest first
+    for old in backups[:-BACKUP_KEEP]:
+        os.remove(old)
+    return True, f"{os.path.basename(path)}, {_mb(os.path.getsize(path))}"
+
+
+# name -> (job, interval seconds, budget seconds); run in this order when several are due
+JOBS = {
+    "checkpoint": (checkpoint, _every("checkpoint", 600), BUDGET),
+    "drafts": (expire_drafts, _every("drafts", 3600), BUDGET),
+    "vacuum": (vacuum, _every("vacuum", 6 * 3600), BUDGET),
+    "analyze": (analyze, _every("analyze", 24 * 3600), BUDGET),
+    # a copy that is cut short starts over from scratch, so it gets longer
+    "backup": (backup, _every("backup", 24 * 3600),
+               float(os.environ.get("MAINTENANCE_BACKUP_SECONDS", "60"))),
+    # not scheduled: /maintenance run convert
+    "convert": (convert, 0, BUDGET),
+}
+
+
+# ----------------- SCHEDULER -----------------
+class Scheduler:
+    """Runs due JOBS in quiet moments, checking every check_every seconds.
+
+    Until start() it only runs jobs on request (run()), e.g. in a worker
+    process while the main one keeps the schedule.
+    """
+
+    def __init__(self, writer, jobs: Optional[dict] = None, check_every: float = CHECK_SECONDS,
+                 quiet_rate: float = QUIET_RATE, window: float = QUIET_WINDOW):
+        self.writer = writer
+        self.requests = None
+        self.jobs = dict(JOBS if jobs is None else jobs)
+        self.check_every = check_every
+        self.quiet_rate = quiet_rate
+        self.window = window
+        self._samples = collections.deque()   # (time.monotonic(), requests()), one per check at least
+        self._started = None
+        self._lock = threading.Lock()         # one job at a time, scheduled or run by hand
+        self._stop = threading.Event()
+        self._thread = None
+        self.unfinished = {}                  # job name -> summary of a run that ran out of time
+
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, requests: Callable[[], int]):
+        """Start the schedule. requests() returns how many updates the bot has
+        received so far (an ever-growing count, e.g. UpdateDispatcher.received);
+        its rate over window seconds decides whether the bot is quiet."""
+        self.requests = requests
+        self._started = time.monotonic()
+        self._sample()
+        self._thread = threading.Thread(target=self._loop, name="maintenance", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None):
+        """Stop checking; a job already running finishes its current run (at most its budget)."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    # ----------------- traffic -----------------
+    def _sample(self):
+        now = time.monotonic()
+        self._samples.append((now, self.requests()))
+        # only the samples inside the window count
+        while self._samples[0][0] < now - self.window:
+            self._samples.popleft()
+
+    def rate(self) -> Optional[float]:
+        """Updates/s from the oldest sample inside the window to the newest one;
+        None until the schedule has been running for a whole window."""
+        if self._started is None or len(self._samples) < 2:
+            return None
+        (t0, n0), (t1, n1) = self._samples[0], self._samples[-1]
+        if t1 - self._started < self.window or t1 <= t0:
+            return None
+        return (n1 - n0) / (t1 - t0)
+
+    def quiet(self) -> bool:
+        self._sample()
+        rate = self.rate()
+        return rate is not None and rate < self.quiet_rate
+
+    # ----------------- running jobs -----------------
+    def due(self, now: Optional[float] = None) -> dict:
+        """Job name -> True if it is overdue (runs even when busy), False if merely due."""
+        now = time.time() if now is None else now
+        runs = storage.maintenance_runs()
+        due = {}
+        for name, (_, interval, _) in self.jobs.items():
+            if interval <= 0:
+                continue
+            run = runs.get(name)
+            if run is None:
+                # never ran: due, but waits for a quiet moment
+                due[name] = False
+            elif now - run["last_run"] >= interval:
+                due[name] = now - run["last_run"] >= 2 * interval
+        return due
+
+    def run(self, name: str) -> Tuple[bool, str]:
+        """Run one job now, within its budget; (finished, summary)."""
+        job, _, budget = self.jobs[name]
+        with self._lock:
+            start = time.monotonic()
+            try:
+                finished, summary = job(self.writer, start + budget)
+                failed = False
+            except Exception as e:
+                logging.exception("Maintenance %s failed: %s", name, e)
+                finished, summary, failed = False, f"failed: {e}", True
+            seconds = time.monotonic() - start
+        metrics.maintenance_seconds.observe(seconds, job=name)
+        logging.info("Maintenance %s: %s (%.0f ms)", name, summary, seconds * 1000)
+        if finished or failed:
+            # a failed job waits for its next interval rather than retrying every check
+            self.unfinished.pop(name, None)
+            self.writer.call(storage.record_maintenance_run, name, seconds, summary)
+        else:
+            self.unfinished[name] = summary
+        return finished, summary
+
+    def check(self):
+        """Run the jobs that are due, as long as the bot stays quiet (overdue ones regardless)."""
+        for name, overdue in self.due().items():
+            if self._stop.is_set():
+                return
+            if overdue or self.quiet():
+                self.run(name)
+
+    def _loop(self):
+        while not self._stop.wait(self.check_every):
+            try:
+                # every tick, due job or not: the window must hold recent samples
+                self._sample()
+                self.check()
+            except Exception as e:
+                logging.exception("Maintenance check failed: %s", e)
+        storage.close_thread()
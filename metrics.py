@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+# metrics.py - in-process counters and latency histograms for bot99
+#
+# Handlers, DB queries and Bot API calls record into the metrics below;
+# render() formats them in the Prometheus text format for GET /metrics
+# (webhook.py) and summary() gives the owner a short digest in the chat.
+#
+# Every metric keeps one series per label combination. Label values come
+# from user input in a few places (commands, callback data), so a metric
+# stops creating series after MAX_SERIES and counts the rest under "other".
+#
+# Worker processes (workers.py) send snapshot() to the main process every
+# PUSH_SECONDS; absorb() keeps the latest one per worker and render() adds
+# them to the main process's own values.
+
+import os
+import re
+import time
+import bisect
+import threading
+import functools
+from contextlib import contextmanager
+
+MAX_SERIES = int(os.environ.get("METRICS_MAX_SERIES", "200"))
+PUSH_SECONDS = float(os.environ.get("METRICS_PUSH_SECONDS", "5"))
+
+# seconds; handlers and Bot API calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# seconds; single SQLite statements and write batches
+DB_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+_registry = {}            # name -> metric, in registration order
+_registry_lock = threading.Lock()
+_remote = {}              # worker index -> last snapshot()
+_remote_lock = threading.Lock()
+
+
+def _register(metric):
+    with _registry_lock:
+        if metric.name in _registry:
+            raise ValueError(f"metric {metric.name} already registered")
+        _registry[metric.name] = metric
+    return metric
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+        self._other = ("other",) * len(self.labels)
+        _register(self)
+
+    def _key(self, labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        if key not in self._series and len(self._series) >= MAX_SERIES:
+            return self._other
+        return key
+
+    def values(self) -> dict:
+        with self._lock:
+            return {k: (list(v) if isinstance(v, list) else v) for k, v in self._series.items()}
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        with self._lock:
+            key = self._key(labels)
+            self._series[key] = self._series.get(key, 0) + amount
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram; each series is [bucket counts..., +Inf, sum]."""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            key = self._key(labels)
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[i] += 1
+            series[-1] += value
+
+    def bind(self, **labels):
+        """observe(value) for fixed labels, without per-call label handling (hot paths)."""
+        with self._lock:
+            key = self._key(labels)
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+        buckets, lock = self.buckets, self._lock
+
+        def observe(value):
+            i = bisect.bisect_left(buckets, value)
+            with lock:
+                series[i] += 1
+                series[-1] += value
+        return observe
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+
+class Gauge(_Metric):
+    """Read at collection time: fn() returns {label values tuple: value}."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels, fn, kind: str = "gauge"):
+        super().__init__(name, help, labels)
+        self.kind = kind      # "counter" for totals kept elsewhere (cache hits etc.)
+        self._fn = fn
+
+    def values(self) -> dict:
+        try:
+            return {tuple(str(v) for v in k): v for k, v in self._fn().items()}
+        except Exception:
+            return {}
+
+
+# ----------------- BOT METRICS -----------------
+handler_seconds = Histogram("bot_handler_seconds", "Time to run the handlers for one update",
+                            ("route",))
+handler_errors = Counter("bot_handler_errors_total", "Updates whose handlers raised", ("route",))
+callback_seconds = Histogram("bot_callback_seconds", "Time in each callback route's handler (router.py)",
+                             ("route",))
+step_seconds = Histogram("bot_step_seconds", "Time spent in selected handler helpers", ("step",))
+db_seconds = Histogram("bot_db_query_seconds", "SQLite statement time", ("op", "table"), DB_BUCKETS)
+db_batch_seconds = Histogram("bot_db_write_batch_seconds", "Write-behind batch commit time",
+                             buckets=DB_BUCKETS)
+db_batch_rows = Counter("bot_db_write_rows_total", "Writes committed by the write-behind queue")
+maintenance_seconds = Histogram("bot_maintenance_seconds", "Time of each background maintenance job run",
+                                ("job",))
+api_seconds = Histogram("bot_api_seconds", "Bot API request time", ("method",))
+api_errors = Counter("bot_api_errors_total", "Failed Bot API requests", ("method", "code"))
+
+
+def timed(step: str):
+    """Decorator: time every call of the function into bot_step_seconds{step}."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                step_seconds.observe(time.perf_counter() - start, step=step)
+        return inner
+    return wrap
+
+
+def watch_caches(caches: dict):
+    """Export hits/misses/evictions/size of {name: TTLCache} as cache metrics."""
+    def stat(field):
+        return lambda: {(name, ): c.stats()[field] for name, c in caches.items()}
+    Gauge("bot_cache_hits_total", "Cache hits", ("cache",), stat("hits"), kind="counter")
+    Gauge("bot_cache_misses_total", "Cache misses", ("cache",), stat("misses"), kind="counter")
+    Gauge("bot_cache_evictions_total", "Cache LRU evictions", ("cache",), stat("evictions"), kind="counter")
+    Gauge("bot_cache_entries", "Cache entries", ("cache",), stat("size"))
+
+
+def watch_stats(prefix: str, stats, counters=(), gauges=()):
+    """Export fields of a stats() dict (e.g. Outbox.stats) as <prefix>_<field> metrics."""
+    for field in counters:
+        Gauge(f"{prefix}_{field}_total", f"{prefix} {field}", (),
+              lambda f=field: {(): stats()[f]}, kind="counter")
+    for field in gauges:
+        Gauge(f"{prefix}_{field}", f"{prefix} {field}", (), lambda f=field: {(): stats()[f]})
+
+
+# ----------------- SQL LABELS -----------------
+_SQL_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE)\s+([A-Za-z_][A-Za-z0-9_]*)", re.I)
+_sql_labels = {}
+
+
+def sql_labels(sql: str):
+    # every query in storage.py is a constant string, so this is parsed once each
+    labels = _sql_labels.get(sql)
+    if labels is None:
+        words = sql.split(None, 1)
+        op = words[0].lower() if words else ""
+        m = _SQL_TABLE.search(sql)
+        labels = (op, m.group(1) if m else "")
+        if len(_sql_labels) < 1000:
+            _sql_labels[sql] = labels
+    return labels
+
+
+# ----------------- BOT API -----------------
+def instrument_bot_api():
+    """Time every Bot API request telebot makes (apihelper.CUSTOM_REQUEST_SENDER)."""
+    from telebot import apihelper
+    if apihelper.CUSTOM_REQUEST_SENDER is not None:
+        return
+
+    def send(method, url, **kwargs):
+        name = url.rsplit("/", 1)[-1]
+        start = time.perf_counter()
+        try:
+            result = apihelper._get_req_session().request(method, url, **kwargs)
+        except Exception:
+            api_errors.inc(method=name, code="network")
+            raise
+        finally:
+            api_seconds.observe(time.perf_counter() - start, method=name)
+        if result.status_code >= 400:
+            api_errors.inc(method=name, code=result.status_code)
+        return result
+
+    apihelper.CUSTOM_REQUEST_SENDER = send
+
+
+# ----------------- COLLECTION -----------------
+def snapshot() -> dict:
+    """{name: (kind, help, labels, buckets, {label values: value})} for this process."""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return {m.name: (m.kind, m.help, m.labels, getattr(m, "buckets", None), m.values()) for m in metrics}
+
+
+def absorb(worker, snap: dict):
+    with _remote_lock:
+        _remote[worker] = snap
+
+
+def forget(worker):
+    with _remote_lock:
+        _remote.pop(worker, None)
+
+
+def collect() -> dict:
+    """This process's snapshot with the workers' latest ones added in."""
+    merged = snapshot()
+    with _remote_lock:
+        others = list(_remote.values())
+    for snap in others:
+        for name, (kind, help, labels, buckets, values) in snap.items():
+            if name not in merged:
+                merged[name] = (kind, help, labels, buckets, {})
+            into = merged[name][4]
+            for key, v in values.items():
+                old = into.get(key)
+                if old is None:
+                    into[key] = list(v) if isinstance(v, list) else v
+                elif isinstance(v, list):
+                    into[key] = [a + b for a, b in zip(old, v)]
+                else:
+                    into[key] = old + v
+    return merged
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names, values, extra=()) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs += [f'{n}="{v}"' for n, v in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _num(v) -> str:
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+def render() -> str:
+    """Prometheus text exposition format (version 0.0.4)."""
+    out = []
+    for name, (kind, help, labels, buckets, values) in collect().items():
+        out.append(f"# HELP {name} {help}")
+        out.append(f"# TYPE {name} {kind}")
+        for key in sorted(values):
+            v = values[key]
+            if kind != "histogram":
+                out.append(f"{name}{_labels(labels, key)} {_num(v)}")
+                continue
+            running = 0
+            for le, n in zip(list(buckets) + ["+Inf"], v[:-1]):
+                running += n
+                out.append(f"{name}_bucket{_labels(labels, key, [('le', le)])} {running}")
+            out.append(f"{name}_sum{_labels(labels, key)} {_num(v[-1])}")
+            out.append(f"{name}_count{_labels(labels, key)} {running}")
+    return "\n".join(out) + "\n"
+
+
+def quantile(buckets, series, q: float) -> float:
+    # upper bound of the bucket holding the q-th observation (inf past the last one)
+    total = sum(series[:-1])
+    rank, running = q * total, 0
+    for le, n in zip(list(buckets) + [float("inf")], series[:-1]):
+        running += n
+        if running >= rank:
+            return le
+    return float("inf")
+
+
+def _fmt_s(seconds: float) -> str:
+    if seconds == float("inf"):
+        return "slow"
+    if seconds >= 10:
+        return f"{seconds:.0f}s"
+    return f"{seconds * 1000:.0f}ms" if seconds >= 0.001 else f"{seconds * 1e6:.0f}µs"
+
+
+def summary(limit: int = 6) -> str:
+    """Short plain-text digest: slowest routes, queries and API methods, error and cache counts."""
+    data = collect()
+    lines = []
+
+    def top(name, title, fmt_key):
+        _, _, _, buckets, values = data[name]
+        rows = []
+        for key, series in values.items():
+            n = sum(series[:-1])
+            if n:
+                rows.append((series[-1], n, fmt_key(key), series))
+        if not rows:
+            return
+        lines.append(title)
+        for total, n, label, series in sorted(rows, reverse=True)[:limit]:
+            lines.append(f"  {label}: {n}x avg {_fmt_s(total / n)} p95 {_fmt_s(quantile(buckets, series, 0.95))}"
+                         f" total {_fmt_s(total)}")
+
+    top("bot_handler_seconds", "Handlers (by total time)", lambda k: k[0])
+    top("bot_callback_seconds", "Callback routes", lambda k: k[0])
+    top("bot_step_seconds", "Steps", lambda k: k[0])
+    top("bot_db_query_seconds", "DB queries", lambda k: f"{k[0]} {k[1]}".strip())
+    top("bot_api_seconds", "Bot API", lambda k: k[0])
+    errors = sorted(data["bot_api_errors_total"][4].items(), key=lambda kv: -kv[1])
+    if errors:
+        lines.append("Bot API errors: " + ", ".join(f"{m} {c} x{int(n)}" for (m, c), n in errors[:limit]))
+    failed = sorted(data["bot_handler_errors_total"][4].items(), key=lambda kv: -kv[1])
+    if failed:
+        lines.append("Handler errors: " + ", ".join(f"{r[0]} x{int(n)}" for r, n in failed[:limit]))
+    if "bot_cache_hits_total" in data:
+        hits, misses = data["bot_cache_hits_total"][4], data["bot_cache_misses_total"][4]
+        rates = []
+        for key in sorted(hits):
+            total = hits[key] + misses.get(key, 0)
+            rates.append(f"{key[0]} {hits[key] / total:.0%}" if total else f"{key[0]} -")
+        lines.append("Cache hit rate: " + ", ".join(rates))
+    with _remote_lock:
+        workers = len(_remote)
+    if workers:
+        lines.append(f"(includes {workers} worker processes)")
+    return "\n".join(lines) or "No samples yet."
+
+
+# ----------------- WORKER PUSH -----------------
+def start_push(q, worker, interval: float = PUSH_SECONDS):
+    """Worker side: put (worker, snapshot()) on q every interval seconds."""
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            push_now(q, worker)
+
+    threading.Thread(target=run, name="metrics-push", daemon=True).start()
+    return stop
+
+
+def push_now(q, worker):
+    try:
+        q.put_nowait((worker, snapshot()))
+    except Exception:
+        pass
+
+
+def serve_pushes(q):
+    """Main process side: absorb worker snapshots until None arrives."""
+    while True:
+        item = q.get()
+        if item is None:
+            return
+        absorb(*item)
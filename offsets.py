@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# offsets.py - offset validation and normalization for the structure flows
+#
+# Accepted forms, one per line (first token of the line is used):
+#   0xC23FA50 / 0Xc23fa50   hex with prefix
+#   c23fa50                 bare hex (must contain a letter a-f and a digit;
+#                           a word like "cafe" or "add" is reported as invalid)
+#   203684432               decimal
+# Offsets must fit in 64 bits. Valid ones are deduplicated, sorted and
+# printed in one canonical form (0x + uppercase hex).
+#
+# Lines are checked in batches: one compiled-regex pass per token, values
+# collected into a packed uint64 array, then deduped/sorted in one go
+# (NumPy when installed, the stdlib otherwise). NumPy is imported on the
+# first batch big enough to use it; most lists are a few lines and importing
+# it costs more at startup than it ever saves on them.
+
+import re
+import html
+from array import array
+from itertools import islice, repeat
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+_numpy = None   # module, False when not installed, None until first needed
+
+MAX_OFFSET = (1 << 64) - 1
+BATCH_SIZE = 65536
+# how many bad lines to echo back to the user
+MAX_REPORTED = 10
+
+# bare hex needs a letter and a digit, so words made of a-f pasted along
+# with the offsets ("add", "dead") aren't taken for addresses. It is written
+# digits-then-letter | letters-then-digit so the regex never backtracks more
+# than linearly, even on junk lines
+_TOKEN_RE = re.compile(r"0[xX]([0-9A-Fa-f]{1,16})|([0-9]{1,20})|((?:[0-9]+[A-Fa-f]|[A-Fa-f]+[0-9])[0-9A-Fa-f]*)")
+# whole-line form of _TOKEN_RE: groups are hex, decimal, bare hex, # comment,
+# blank line, anything else (invalid). The token may be followed by , or ;
+# and then whitespace and free text.
+_LINE_RE = re.compile(
+    r"^[ \t]*(?:0[xX]([0-9A-Fa-f]{1,16})|([0-9]{1,20})|((?:[0-9]+[A-Fa-f]|[A-Fa-f]+[0-9])[0-9A-Fa-f]*)|(#.*)|()|(\S+?))"
+    r"[,;]*(?=\s|$).*$", re.M)
+
+_LETTERS_RE = re.compile(r"[A-Fa-f]+")
+
+
+class OffsetReport:
+    __slots__ = ("values", "total", "invalid_count", "invalid_samples", "duplicates")
+
+    def __init__(self):
+        self.values = array("Q")          # sorted, unique
+        self.total = 0                    # offset lines seen
+        self.invalid_count = 0
+        self.invalid_samples: List[Tuple[int, str]] = []   # (line number, token)
+        self.duplicates = 0
+
+    def formatted(self) -> Iterator[str]:
+        return (fmt(v) for v in self.values)
+
+    def summary(self) -> str:
+        """User-facing note about skipped lines; empty when everything was valid."""
+        parts = []
+        if self.invalid_count:
+            # messages are sent with parse_mode=HTML
+            lines = "\n".join(f"line {n}: {html.escape(tok[:40])}" for n, tok in self.invalid_samples)
+            more = f"\n… and {self.invalid_count - len(self.invalid_samples)} more" \
+                if self.invalid_count > len(self.invalid_samples) else ""
+            if any(_LETTERS_RE.fullmatch(tok.rstrip(",;")) for _, tok in self.invalid_samples):
+                more += "\nHex made only of letters a-f needs the 0x prefix (0xCAFE)."
+            parts.append(f"⚠️ Skipped {self.invalid_count} invalid offset(s):\n{lines}{more}")
+        if self.duplicates:
+            parts.append(f"♻️ Removed {self.duplicates} duplicate offset(s).")
+        return "\n\n".join(parts)
+
+
+def fmt(value: int) -> str:
+    return f"0x{value:X}"
+
+
+def _value(m) -> Optional[int]:
+    if m is None:
+        return None
+    hex_prefixed, dec, bare_hex = m.groups()
+    value = int(hex_prefixed or bare_hex, 16) if dec is None else int(dec)
+    return value if value <= MAX_OFFSET else None
+
+
+def parse_token(token: str) -> Optional[int]:
+    return _value(_TOKEN_RE.fullmatch(token))
+
+
+def parse_one(text: str) -> Optional[str]:
+    """Canonical form of the first token in text, or None if it isn't a valid offset."""
+    tokens = text.split()
+    if not tokens:
+        return None
+    value = parse_token(tokens[0].rstrip(",;"))
+    return fmt(value) if value is not None else None
+
+
+def _check_batch(lines: List[str], first_line: int, values: array, report: OffsetReport):
+    # one regex pass over the whole batch (every line yields exactly one
+    # match), then column-wise comprehensions instead of per-line branching
+    rows = _LINE_RE.findall("\n".join(lines))
+    hexes = [r[0] or r[2] for r in rows if r[0] or r[2]]
+    decs = [r[1] for r in rows if r[1]]
+    ints = list(map(int, hexes, repeat(16, len(hexes))))
+    ints += map(int, decs)
+    if ints and max(ints) > MAX_OFFSET:
+        # rare: a bare-hex/decimal value too big for 64 bits
+        return _check_rows(rows, first_line, values, report)
+    bad = [(n, r[5]) for n, r in enumerate(rows, start=first_line) if r[5]]
+    values.extend(ints)
+    report.total += len(ints) + len(bad)
+    _add_invalid(report, bad)
+
+
+def _check_rows(rows, first_line: int, values: array, report: OffsetReport):
+    bad = []
+    for n, (hx, dec, bare, _, _, other) in enumerate(rows, start=first_line):
+        if not (hx or dec or bare or other):
+            continue   # blank line or comment
+        report.total += 1
+        value = None if other else int(dec) if dec else int(hx or bare, 16)
+        if value is not None and value <= MAX_OFFSET:
+            values.append(value)
+        else:
+            bad.append((n, other or hx or dec or bare))
+    _add_invalid(report, bad)
+
+
+def _add_invalid(report: OffsetReport, bad: List[Tuple[int, str]]):
+    report.invalid_count += len(bad)
+    room = MAX_REPORTED - len(report.invalid_samples)
+    if room > 0:
+        report.invalid_samples.extend(bad[:room])
+
+
+def numpy_module():
+    """NumPy, imported on first use, or None when it isn't installed."""
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+        except ImportError:  # optional; only speeds up dedupe/sort
+            numpy = False
+        _numpy = numpy
+    return _numpy or None
+
+
+def _unique_sorted(values: array) -> array:
+    if len(values) > 1024:
+        numpy = numpy_module()
+        if numpy is not None:
+            return array("Q", numpy.unique(numpy.frombuffer(values, dtype=numpy.uint64)).tobytes())
+    return array("Q", sorted(set(values)))
+
+
+def parse_offsets(lines: Iterable[str], batch_size: int = BATCH_SIZE) -> OffsetReport:
+    report = OffsetReport()
+    values = array("Q")
+    lines = iter(lines)
+    first_line = 1
+    while True:
+        batch = list(islice(lines, batch_size))
+        if not batch:
+            break
+        _check_batch(batch, first_line, values, report)
+        first_line += len(batch)
+    report.values = _unique_sorted(values)
+    report.duplicates = len(values) - len(report.values)
+    return report
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+# outbox.py - rate-limited outbound queue for Bot API calls
+#
+# Handlers queue sends here instead of calling the bot directly. Sender
+# threads pace them with token buckets matching the Bot API limits (about 30
+# messages/s overall, 1/s per private chat with short bursts, 20/min per
+# group), honour retry_after on 429 instead of dropping the message, and keep
+# each chat's messages in order. Callback answers skip the per-chat buckets
+# and go first (the client shows a spinner until they arrive).
+#
+# While a chat is waiting for its bucket, plain text messages queued for it
+# are merged into one message (up to the 4096-character limit), so a handler
+# that sends several messages in a row costs one request.
+
+import os
+import heapq
+import time
+import itertools
+import threading
+import logging
+from collections import deque
+from concurrent.futures import Future
+from typing import Dict, Optional
+
+from telebot.apihelper import ApiTelegramException
+
+GLOBAL_RATE = float(os.environ.get("OUTBOX_GLOBAL_RATE", "30"))      # messages/s, all chats
+CHAT_RATE = float(os.environ.get("OUTBOX_CHAT_RATE", "1"))           # messages/s, one private chat
+CHAT_BURST = int(os.environ.get("OUTBOX_CHAT_BURST", "3"))
+GROUP_RATE = float(os.environ.get("OUTBOX_GROUP_RATE", str(20 / 60)))  # messages/s, one group
+SENDER_THREADS = int(os.environ.get("OUTBOX_THREADS", "4"))
+MAX_RETRIES = int(os.environ.get("OUTBOX_MAX_RETRIES", "5"))
+MAX_MESSAGE_LEN = 4096
+COALESCE_SEP = "\n\n"
+
+# idle chats with a refilled bucket are forgotten every this many finished jobs
+_PRUNE_EVERY = 1024
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available (0 if one is available now)."""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class _Job:
+    __slots__ = ("fn", "args", "kwargs", "chat_id", "futures", "attempts", "mergeable", "streams")
+
+    def __init__(self, fn, args, kwargs, chat_id, future: Optional[Future], mergeable: bool):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.chat_id = chat_id
+        self.futures = [future] if future is not None else []
+        self.attempts = 0
+        self.mergeable = mergeable
+        self.streams = _streams(args, kwargs)
+
+    def rewind(self):
+        """Put file arguments back where they were when queued (before a retry)."""
+        for stream, pos in self.streams or ():
+            stream.seek(pos)
+
+
+def _streams(args, kwargs):
+    # open files among the arguments (uploads) and their positions: an attempt
+    # reads them to the end, so a retry has to start over from there. None if
+    # one of them can't seek (a pipe): such a job is sent once.
+    streams = []
+    for value in itertools.chain(args, kwargs.values()):
+        if hasattr(value, "read") and hasattr(value, "seek"):
+            try:
+                streams.append((value, value.tell()))
+            except (OSError, ValueError):
+                return None
+    return tuple(streams)
+
+
+class _Chat:
+    __slots__ = ("jobs", "bucket", "ready_at", "busy", "scheduled")
+
+    def __init__(self, bucket: TokenBucket):
+        self.jobs = deque()
+        self.bucket = bucket
+        self.ready_at = 0.0      # set by 429 retry_after
+        self.busy = False        # a job of this chat is being sent
+        self.scheduled = False   # present in the ready heap
+
+
+def retry_after(exc: Exception) -> Optional[float]:
+    """retry_after seconds of a 429 (Too Many Requests) error, else None."""
+    if isinstance(exc, ApiTelegramException) and exc.error_code == 429:
+        params = (exc.result_json or {}).get("parameters") or {}
+        return float(params.get("retry_after", 1))
+    return None
+
+
+class Outbox:
+    def __init__(self, bot, threads: int = SENDER_THREADS, global_rate: float = GLOBAL_RATE,
+                 chat_rate: float = CHAT_RATE, chat_burst: int = CHAT_BURST, group_rate: float = GROUP_RATE):
+        self.bot = bot
+        self.threads = threads
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self._global = TokenBucket(global_rate, global_rate)
+        self._priority = deque()              # callback answers
+        self._chats: Dict[int, _Chat] = {}
+        self._ready = []                      # heap of (ready time, seq, chat_id)
+        self._seq = 0
+        self._queued = 0
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._workers = []
+        self._stopping = False
+        self._finished = 0                    # jobs done, sent or failed; paces _prune()
+        self.sent = 0
+        self.coalesced = 0
+        self.rate_limited = 0
+        self.retries = 0
+        self.failed = 0
+        self.max_depth = 0
+
+    # ----------------- producer side -----------------
+    def start(self):
+        with self._cond:
+            self._workers = [w for w in self._workers if w.is_alive()]
+            for i in range(len(self._workers), self.threads):
+                w = threading.Thread(target=self._run, name=f"outbox-{i}", daemon=True)
+                w.start()
+                self._workers.append(w)
+        return self
+
+    def submit(self, method: str, *args, **kwargs) -> Future:
+        """Queue bot.<method>(*args, **kwargs); returns a Future for its result."""
+        if not self._workers:
+            self.start()
+        fut = Future()
+        fn = getattr(self.bot, method)
+        if method == "answer_callback_query":
+            job = _Job(fn, args, kwargs, None, fut, False)
+        else:
+            chat_id = kwargs.get("chat_id", args[0] if args else None)
+            mergeable = method == "send_message" and len(args) == 2 and not kwargs.get("reply_markup") \
+                and set(kwargs) <= {"reply_markup", "parse_mode", "disable_web_page_preview"}
+            job = _Job(fn, args, kwargs, chat_id, fut, mergeable)
+        self._enqueue(job)
+        return fut
+
+    def call(self, method: str, *args, timeout: Optional[float] = None, **kwargs):
+        """Queue the call and wait for its result (re-raises its exception)."""
+        return self.submit(method, *args, **kwargs).result(timeout)
+
+    # thin wrappers for what the handlers send; all of them return immediately
+    def send_message(self, chat_id, text, **kwargs):
+        return self.submit("send_message", chat_id, text, **kwargs)
+
+    def send_photo(self, chat_id, photo, **kwargs):
+        return self.submit("send_photo", chat_id, photo, **kwargs)
+
+    def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        return self.submit("edit_message_text", text, chat_id=chat_id, message_id=message_id, **kwargs)
+
+    def edit_message_reply_markup(self, chat_id, message_id, **kwargs):
+        return self.submit("edit_message_reply_markup", chat_id, message_id, **kwargs)
+
+    def answer_callback_query(self, callback_query_id, text=None, **kwargs):
+        return self.submit("answer_callback_query", callback_query_id, text, **kwargs)
+
+    def _enqueue(self, job: _Job, front: bool = False):
+        with self._cond:
+            if job.chat_id is None:
+                (self._priority.appendleft if front else self._priority.append)(job)
+            else:
+                chat = self._chats.get(job.chat_id)
+                if chat is None:
+                    group = isinstance(job.chat_id, int) and job.chat_id < 0
+                    rate = self.group_rate if group else self.chat_rate
+                    burst = 1 if group else self.chat_burst
+                    chat = self._chats[job.chat_id] = _Chat(TokenBucket(rate, burst))
+                (chat.jobs.appendleft if front else chat.jobs.append)(job)
+                self._schedule(job.chat_id, chat)
+            self._queued += 1
+            self.max_depth = max(self.max_depth, self._queued)
+            self._cond.notify()
+
+    def _schedule(self, chat_id, chat: _Chat):
+        if chat.busy or chat.scheduled or not chat.jobs:
+            return
+        chat.scheduled = True
+        self._seq += 1
+        heapq.heappush(self._ready, (chat.ready_at, self._seq, chat_id))
+
+    # ----------------- sender side -----------------
+    def _next_job(self) -> Optional[_Job]:
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                wait = self._global.delay(now)
+                if wait == 0 and self._priority:
+                    self._global.take(now)
+                    return self._take(self._priority.popleft())
+                if wait == 0 and self._ready and self._ready[0][0] <= now:
+                    _, _, chat_id = heapq.heappop(self._ready)
+                    chat = self._chats[chat_id]
+                    chat.scheduled = False
+                    chat_wait = max(chat.bucket.delay(now), chat.ready_at - now)
+                    if chat_wait > 0:
+                        chat.scheduled = True
+                        self._seq += 1
+                        heapq.heappush(self._ready, (now + chat_wait, self._seq, chat_id))
+                        continue
+                    self._global.take(now)
+                    chat.bucket.take(now)
+                    chat.busy = True
+                    return self._take(self._coalesce(chat))
+                if self._stopping and not self._queued:
+                    return None
+                timeouts = [wait] if wait > 0 else []
+                if self._ready:
+                    timeouts.append(max(self._ready[0][0] - now, 0.001))
+                self._cond.wait(min(timeouts) if timeouts else None)
+
+    def _take(self, job: _Job) -> _Job:
+        self._queued -= 1
+        self._in_flight += 1
+        return job
+
+    def _coalesce(self, chat: _Chat) -> _Job:
+        # merge following plain text messages into the first one; the merged
+        # message may carry the last one's keyboard
+        job = chat.jobs.popleft()
+        if not job.mergeable:
+            return job
+        text = job.args[1]
+        while chat.jobs:
+            nxt = chat.jobs[0]
+            if nxt.fn != job.fn or not (nxt.mergeable or _markup_only(nxt)) \
+                    or nxt.kwargs.get("parse_mode") != job.kwargs.get("parse_mode") \
+                    or len(text) + len(COALESCE_SEP) + len(nxt.args[1]) > MAX_MESSAGE_LEN:
+                break
+            chat.jobs.popleft()
+            self._queued -= 1
+            self.coalesced += 1
+            text = text + COALESCE_SEP + nxt.args[1]
+            job.args = (job.args[0], text)
+            job.kwargs = nxt.kwargs
+            job.futures.extend(nxt.futures)
+            job.mergeable = nxt.mergeable
+            if not job.mergeable:
+                break
+        return job
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            try:
+                if job.attempts:
+                    job.rewind()
+                result = job.fn(*job.args, **job.kwargs)
+            except Exception as e:
+                self._failed(job, e)
+            else:
+                self.sent += 1
+                for fut in job.futures:
+                    fut.set_result(result)
+            finally:
+                self._done(job)
+
+    def _failed(self, job: _Job, exc: Exception):
+        delay = retry_after(exc)
+        if delay is not None:
+            self.rate_limited += 1
+        elif not (isinstance(exc, ApiTelegramException) and exc.error_code < 500):
+            # network error or Telegram 5xx; other 4xx (bad request, bot
+            # blocked by the user) won't succeed on a retry
+            delay = min(2 ** job.attempts, 30)
+        job.attempts += 1
+        if job.streams is None:
+            # an upload from a stream that can't be rewound would resend what is left of it
+            delay = None
+        if delay is None or job.attempts > MAX_RETRIES:
+            self.failed += 1
+            # 403 (the user blocked the bot) is routine, and a broadcast meets many
+            level = logging.INFO if isinstance(exc, ApiTelegramException) and exc.error_code == 403 else logging.WARNING
+            logging.log(level, "Outbox: %s failed: %s", getattr(job.fn, "__name__", job.fn), exc)
+            for fut in job.futures:
+                fut.set_exception(exc)
+            return
+        self.retries += 1
+        with self._cond:
+            if job.chat_id is not None:
+                chat = self._chats[job.chat_id]
+                chat.ready_at = time.monotonic() + delay
+        if job.chat_id is None:
+            # callback answers have no chat to hold back; wait here instead
+            time.sleep(min(delay, 5))
+        self._enqueue(job, front=True)
+
+    def _done(self, job: _Job):
+        with self._cond:
+            self._in_flight -= 1
+            if job.chat_id is not None:
+                chat = self._chats.get(job.chat_id)
+                if chat is not None:
+                    chat.busy = False
+                    self._schedule(job.chat_id, chat)
+            # counted apart from sent: a run of failures leaves sent unchanged,
+            # which would prune after every one of them
+            self._finished += 1
+            if self._finished % _PRUNE_EVERY == 0:
+                self._prune()
+            self._cond.notify_all()
+
+    def _prune(self):
+        now = time.monotonic()
+        for chat_id in [c for c, chat in self._chats.items()
+                        if not chat.jobs and not chat.busy and chat.ready_at <= now and chat.bucket.full(now)]:
+            del self._chats[chat_id]
+
+    # ----------------- lifecycle / metrics -----------------
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until everything queued so far has been sent (or failed)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._queued or self._in_flight:
+                left = None if deadline is None else deadline - time.monotonic()
+                if left is not None and left <= 0:
+                    return False
+                self._cond.wait(left)
+        return True
+
+    def close(self, timeout: float = 10.0):
+        """Send what is queued (up to timeout), then stop the sender threads."""
+        self.flush(timeout)
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for w in self._workers:
+            w.join(timeout=1)
+
+    def depth(self) -> int:
+        return self._queued
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "queued": self._queued,
+                "priority_queued": len(self._priority),
+                "chats_waiting": len(self._ready),
+                "in_flight": self._in_flight,
+                "max_depth": self.max_depth,
+                "sent": self.sent,
+                "coalesced": self.coalesced,
+                "rate_limited": self.rate_limited,
+                "retries": self.retries,
+                "failed": self.failed,
+            }
+
+
+def _markup_only(job: _Job) -> bool:
+    # a plain text message whose only extra is a keyboard can end a merge
+    return len(job.args) == 2 and set(job.kwargs) <= {"reply_markup", "parse_mode", "disable_web_page_preview"}
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# router.py - table-driven dispatch of inline-button callbacks
+#
+# Handlers are registered by callback data: an exact value ("settings") or a
+# prefix ending in ":" or "_" ("saved:", "stype_") whose remainder is the
+# payload. dispatch() finds the handler with at most three dict lookups,
+# however many routes there are, and parses the payload into the route's
+# NamedTuple (fields split on ":", each converted by its annotation).
+#
+# Middleware wrap a handler once, when it is registered:
+#     def mw(handler, route) -> handler
+# where a handler is called as handler(call, payload). Router-wide middleware
+# run outside the route's own.
+
+import time
+import logging
+from typing import Callable, Dict
+
+import metrics
+
+# answered for buttons whose data no route (or payload) accepts, e.g. from an old deploy
+STALE_BUTTON = "This button is no longer valid."
+
+
+class BadPayload(ValueError):
+    pass
+
+
+def payload_parser(payload_type):
+    """Function raw -> payload_type: raw split on ":" into the fields, each converted by its annotation."""
+    fields = payload_type._fields
+    convert = tuple(payload_type.__annotations__.get(f, str) for f in fields)
+    name = payload_type.__name__
+
+    if len(fields) == 1:
+        (one,) = convert
+
+        def parse(raw):
+            try:
+                return payload_type(one(raw))
+            except (TypeError, ValueError) as e:
+                raise BadPayload(f"bad {name} {raw!r}: {e}") from None
+        return parse
+
+    def parse(raw):
+        parts = raw.split(":", len(fields) - 1)
+        if len(parts) != len(fields):
+            raise BadPayload(f"{name} needs {len(fields)} fields, got {raw!r}")
+        try:
+            return payload_type(*[c(v) for c, v in zip(convert, parts)])
+        except (TypeError, ValueError) as e:
+            raise BadPayload(f"bad {name} {raw!r}: {e}") from None
+    return parse
+
+
+class CallbackRouter:
+    def __init__(self, middleware=()):
+        self.middleware = list(middleware)
+        # key -> (route name, handler with middleware applied, payload parser)
+        self._exact: Dict[str, tuple] = {}
+        self._prefix: Dict[str, tuple] = {}
+
+    def route(self, key: str, payload=None, middleware=()):
+        """Decorator: register handler(call, payload) for callback data key.
+
+        A key ending in ":" or "_" is a prefix and needs a payload type;
+        anything else must match exactly and gets payload None.
+        """
+        is_prefix = key[-1] in ":_"
+        if is_prefix and payload is None:
+            raise ValueError(f"prefix route {key!r} needs a payload type")
+        if not is_prefix and payload is not None:
+            raise ValueError(f"exact route {key!r} takes no payload")
+        table = self._prefix if is_prefix else self._exact
+
+        def register(handler):
+            if key in table:
+                raise ValueError(f"callback route {key!r} already registered")
+            wrapped = handler
+            for mw in reversed(list(self.middleware) + list(middleware)):
+                wrapped = mw(wrapped, key)
+            table[key] = (key, wrapped, payload_parser(payload) if is_prefix else None)
+            return handler
+        return register
+
+    def resolve(self, data: str):
+        """((route name, handler, parser), raw payload) for callback data, or (None, None)."""
+        entry = self._exact.get(data)
+        if entry is not None:
+            return entry, ""
+        i = data.find(":")
+        if i > 0:
+            entry = self._prefix.get(data[:i + 1])
+            if entry is not None:
+                return entry, data[i + 1:]
+        i = data.find("_")
+        if i > 0:
+            entry = self._prefix.get(data[:i + 1])
+            if entry is not None:
+                return entry, data[i + 1:]
+        return None, None
+
+    def dispatch(self, call) -> bool:
+        """Run the handler for call.data; False when no route or payload matches."""
+        data = call.data or ""
+        entry = self._exact.get(data)
+        if entry is not None:
+            entry[1](call, None)
+            return True
+        entry, raw = self.resolve(data)
+        if entry is None:
+            logging.info("No callback route for %r", data)
+            return False
+        name, handler, parse = entry
+        try:
+            payload = parse(raw)
+        except BadPayload as e:
+            logging.info("Callback %s: %s", name, e)
+            return False
+        handler(call, payload)
+        return True
+
+    def routes(self):
+        return sorted(list(self._exact) + list(self._prefix))
+
+
+# ----------------- MIDDLEWARE -----------------
+def timed(handler, route):
+    """Time each call into bot_callback_seconds{route}."""
+    observe = metrics.callback_seconds.bind(route=route)
+
+    def run(call, payload):
+        start = time.perf_counter()
+        try:
+            return handler(call, payload)
+        finally:
+            observe(time.perf_counter() - start)
+    return run
+
+
+def gate(allowed: Callable, on_denied: Callable):
+    """Middleware that runs the handler only when allowed(call) is true, else on_denied(call)."""
+    def middleware(handler, route):
+        def run(call, payload):
+            if not allowed(call):
+                return on_denied(call)
+            return handler(call, payload)
+        return run
+    return middleware
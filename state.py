@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# state.py - conversation state for the interactive flows
+#
+# FlowState is the per-user record the simple_single / simple_multi / hook
+# flows build up step by step. Stores expire a flow STATE_TTL seconds after
+# its last update and hold at most STATE_MAX_ENTRIES flows.
+#
+# STATE_BACKEND=memory (default) keeps flows in-process. STATE_BACKEND=sqlite
+# keeps them in STATE_DB_PATH (default: bot_state.db next to DB_PATH) so they
+# survive a redeploy and can be shared by several worker processes.
+
+import os
+import json
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field, asdict
+from typing import List, Optional
+
+from cache import TTLCache
+
+STATE_BACKEND = os.environ.get("STATE_BACKEND", "memory")
+STATE_DB_PATH = os.environ.get("STATE_DB_PATH") or os.path.join(
+    os.path.dirname(os.environ.get("DB_PATH", "bot_data.db")), "bot_state.db")
+STATE_TTL = int(os.environ.get("STATE_TTL", "1800"))
+STATE_MAX_ENTRIES = int(os.environ.get("STATE_MAX_ENTRIES", "10000"))
+
+# sweep expired entries once every this many writes
+_SWEEP_EVERY = 256
+
+
+@dataclass(slots=True)
+class FlowState:
+    flow: str                                   # "simple_single" | "simple_multi" | "hook"
+    step: int = 1
+    offsets: List[str] = field(default_factory=list)
+    selected_struct_type: Optional[str] = None  # "PATCH_LIB" | "MemoryPatch"
+    hex_bytes: Optional[str] = None             # None = the type's default payload
+    selected_lib: Optional[str] = None
+    connect_params: List[str] = field(default_factory=list)
+    offsets_file: Optional[str] = None          # spooled upload (bulk.py) instead of offsets
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self), separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, raw: str) -> "FlowState":
+        return cls(**json.loads(raw))
+
+
+class MemoryStateStore:
+    def __init__(self, ttl: int = STATE_TTL, max_entries: int = STATE_MAX_ENTRIES):
+        self._cache = TTLCache(max_entries, ttl)
+        self._writes = 0
+
+    def get(self, user_id) -> Optional[FlowState]:
+        return self._cache.get(user_id)
+
+    def set(self, user_id, st: FlowState):
+        self._cache.set(user_id, st)
+        self._writes += 1
+        if self._writes % _SWEEP_EVERY == 0:
+            self._cache.purge_expired()
+
+    def pop(self, user_id):
+        self._cache.invalidate(user_id)
+
+    def __len__(self):
+        return len(self._cache)
+
+
+class SQLiteStateStore:
+    def __init__(self, path: str = STATE_DB_PATH, ttl: int = STATE_TTL, max_entries: int = STATE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS flow_state (user_id INTEGER PRIMARY KEY, data TEXT NOT NULL, "
+            "expires_at REAL NOT NULL)")
+        self._conn().execute("CREATE INDEX IF NOT EXISTS idx_flow_state_expires ON flow_state(expires_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, user_id) -> Optional[FlowState]:
+        row = self._conn().execute("SELECT data FROM flow_state WHERE user_id = ? AND expires_at > ?",
+                                   (user_id, time.time())).fetchone()
+        return FlowState.from_json(row[0]) if row else None
+
+    def set(self, user_id, st: FlowState):
+        self._conn().execute(
+            "INSERT INTO flow_state (user_id, data, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at",
+            (user_id, st.to_json(), time.time() + self.ttl))
+        self._writes += 1
+        if self._writes % _SWEEP_EVERY == 0:
+            self.sweep()
+
+    def pop(self, user_id):
+        self._conn().execute("DELETE FROM flow_state WHERE user_id = ?", (user_id,))
+
+    def sweep(self):
+        conn = self._conn()
+        conn.execute("DELETE FROM flow_state WHERE expires_at <= ?", (time.time(),))
+        # over the bound: drop the flows closest to expiry (least recently touched)
+        conn.execute("DELETE FROM flow_state WHERE user_id IN (SELECT user_id FROM flow_state "
+                     "ORDER BY expires_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM flow_state").fetchone()[0]
+
+
+def make_store(backend: str = STATE_BACKEND):
+    if backend == "sqlite":
+        return SQLiteStateStore()
+    if backend != "memory":
+        raise SystemExit(f"Unknown STATE_BACKEND {backend!r} (use memory or sqlite)")
+    return MemoryStateStore()
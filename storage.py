@@ -0,0 +1,761 @@
+#!/usr/bin/env python3
+# storage.py - pooled SQLite access layer for bot99
+#
+# One connection per thread (sqlite3 connections must not be shared across
+# threads), opened once in WAL mode and reused for every query that thread
+# makes. Statements are run in autocommit mode so a single write costs one
+# WAL append instead of a connect + journal fsync + close cycle; use
+# transaction() to group several writes.
+#
+# Structure texts are stored once per distinct content in structure_blobs
+# (keyed by a content hash). saved_structures holds a user's saved references
+# to them; every generation first lands in drafts, a short-lived area that
+# gc_drafts() empties after DRAFT_TTL seconds.
+
+import os
+import hashlib
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+
+import metrics
+
+DB_PATH = os.environ.get("DB_PATH", "bot_data.db")
+
+# size of sqlite3's per-connection prepared statement cache; every query in
+# this module is a constant SQL string so each is compiled once per thread
+STATEMENT_CACHE_SIZE = 128
+# unsaved generations are kept this long so their Save button keeps working
+DRAFT_TTL = int(os.environ.get("DRAFT_TTL", str(24 * 3600)))
+
+PRAGMAS = (
+    # free pages go back to the OS a batch at a time (maintenance.py) instead
+    # of only by a full VACUUM; it has to come before journal_mode, which
+    # writes the header of a new database. An existing database keeps its
+    # mode until its next VACUUM (compact(), or maintenance's one-off convert)
+    "PRAGMA auto_vacuum=INCREMENTAL",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",     # fsync on checkpoint only, safe with WAL
+    "PRAGMA cache_size=-8192",       # 8 MiB page cache per connection
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+_local = threading.local()
+_all_conns = []
+_all_lock = threading.Lock()
+_generation = 0   # bumped by close_all() so threads drop stale connections
+
+
+def configure(path: str):
+    """Point the pool at another database file (closes open connections)."""
+    global DB_PATH
+    close_all()
+    DB_PATH = path
+
+
+def _open() -> sqlite3.Connection:
+    conn = sqlite3.connect(
+        DB_PATH,
+        isolation_level=None,               # autocommit; see transaction()
+        check_same_thread=False,            # close_all() runs on another thread
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    # used by the structure_blobs migration to hash existing rows in SQL
+    conn.create_function("content_hash", 1, content_hash, deterministic=True)
+    with _all_lock:
+        _all_conns.append(conn)
+    return conn
+
+
+def connection() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "gen", None) != _generation:
+        conn = _open()
+        _local.conn = conn
+        _local.gen = _generation
+    return conn
+
+
+def close_thread():
+    """Close the calling thread's connection, if it has one.
+
+    Short-lived threads (exports, broadcasts, ...) call this when they are
+    done; otherwise each keeps a file handle and a WAL reader slot until
+    close_all().
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        return
+    _local.conn = None
+    with _all_lock:
+        if conn in _all_conns:
+            _all_conns.remove(conn)
+    try:
+        conn.close()
+    except sqlite3.Error:
+        pass
+
+
+def close_all():
+    global _generation
+    with _all_lock:
+        conns = list(_all_conns)
+        _all_conns.clear()
+        _generation += 1
+    for conn in conns:
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+
+def content_hash(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+def _observe(sql: str, start: float):
+    op, table = metrics.sql_labels(sql)
+    metrics.db_seconds.observe(time.perf_counter() - start, op=op, table=table)
+
+
+def execute(sql: str, params=()) -> sqlite3.Cursor:
+    start = time.perf_counter()
+    try:
+        return connection().execute(sql, params)
+    finally:
+        _observe(sql, start)
+
+
+def fetchone(sql: str, params=()):
+    start = time.perf_counter()
+    try:
+        return connection().execute(sql, params).fetchone()
+    finally:
+        _observe(sql, start)
+
+
+def fetchall(sql: str, params=()) -> list:
+    start = time.perf_counter()
+    try:
+        return connection().execute(sql, params).fetchall()
+    finally:
+        _observe(sql, start)
+
+
+@contextmanager
+def transaction():
+    conn = connection()
+    if conn.in_transaction:
+        # nested use joins the outer transaction
+        yield conn
+        return
+    start = time.perf_counter()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+    # BEGIN to COMMIT; statements run on conn directly aren't timed one by one
+    metrics.db_seconds.observe(time.perf_counter() - start, op="transaction", table="")
+
+
+# ----------------- SCHEMA -----------------
+# Counters read by the owner/settings screens. Triggers keep them in step with
+# users/saved_structures; these statements rebuild them from scratch.
+STATS_REBUILD = (
+    "DELETE FROM stats_totals",
+    "DELETE FROM stats_daily",
+    "DELETE FROM user_stats",
+    "INSERT INTO stats_totals (name, value) VALUES "
+    "('users', (SELECT COUNT(*) FROM users)), ('structures', (SELECT COUNT(*) FROM saved_structures))",
+    "INSERT INTO stats_daily (day, new_users, structures) "
+    "SELECT day, SUM(u), SUM(s) FROM ("
+    "  SELECT date(first_seen, 'unixepoch') AS day, 1 AS u, 0 AS s FROM users WHERE first_seen IS NOT NULL"
+    "  UNION ALL"
+    "  SELECT date(created_at, 'unixepoch'), 0, 1 FROM saved_structures"
+    ") GROUP BY day",
+    "INSERT INTO user_stats (tg_id, structures) "
+    "SELECT user_tg_id, COUNT(*) FROM saved_structures GROUP BY user_tg_id",
+)
+
+# STATS_REBUILD as released with migration 2 (counting the legacy structures table)
+_STATS_REBUILD_V2 = (
+    "DELETE FROM stats_totals",
+    "DELETE FROM stats_daily",
+    "DELETE FROM user_stats",
+    "INSERT INTO stats_totals (name, value) VALUES "
+    "('users', (SELECT COUNT(*) FROM users)), ('structures', (SELECT COUNT(*) FROM structures))",
+    "INSERT INTO stats_daily (day, new_users, structures) "
+    "SELECT day, SUM(u), SUM(s) FROM ("
+    "  SELECT date(first_seen, 'unixepoch') AS day, 1 AS u, 0 AS s FROM users WHERE first_seen IS NOT NULL"
+    "  UNION ALL"
+    "  SELECT date(created_at, 'unixepoch'), 0, 1 FROM structures WHERE created_at IS NOT NULL"
+    ") GROUP BY day",
+    "INSERT INTO user_stats (tg_id, structures) "
+    "SELECT user_tg_id, COUNT(*) FROM structures WHERE user_tg_id IS NOT NULL GROUP BY user_tg_id",
+)
+
+# Migrations are applied in order by init_schema(); PRAGMA user_version holds
+# the last one applied. Append new steps, never edit released ones.
+MIGRATIONS = [
+    # 1: index the per-user listing / "latest structure" lookups and the
+    #    first_seen range scans used by the owner stats
+    (
+        "CREATE INDEX IF NOT EXISTS idx_structures_user_created ON structures(user_tg_id, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS idx_users_first_seen ON users(first_seen)",
+    ),
+    # 2: trigger-maintained counters: totals, per-UTC-day buckets and per-user
+    #    number of rows in structures (what "Saved Structures" lists)
+    (
+        "CREATE TABLE IF NOT EXISTS stats_totals (name TEXT PRIMARY KEY, value INTEGER NOT NULL DEFAULT 0)",
+        "CREATE TABLE IF NOT EXISTS stats_daily (day TEXT PRIMARY KEY, new_users INTEGER NOT NULL DEFAULT 0, "
+        "structures INTEGER NOT NULL DEFAULT 0)",
+        "CREATE TABLE IF NOT EXISTS user_stats (tg_id INTEGER PRIMARY KEY, structures INTEGER NOT NULL DEFAULT 0)",
+        """CREATE TRIGGER IF NOT EXISTS trg_users_insert AFTER INSERT ON users BEGIN
+            UPDATE stats_totals SET value = value + 1 WHERE name = 'users';
+            INSERT INTO stats_daily (day, new_users) VALUES (date(NEW.first_seen, 'unixepoch'), 1)
+                ON CONFLICT(day) DO UPDATE SET new_users = new_users + 1;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_users_delete AFTER DELETE ON users BEGIN
+            UPDATE stats_totals SET value = value - 1 WHERE name = 'users';
+            UPDATE stats_daily SET new_users = new_users - 1 WHERE day = date(OLD.first_seen, 'unixepoch');
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_structures_insert AFTER INSERT ON structures BEGIN
+            UPDATE stats_totals SET value = value + 1 WHERE name = 'structures';
+            INSERT INTO stats_daily (day, structures) VALUES (date(NEW.created_at, 'unixepoch'), 1)
+                ON CONFLICT(day) DO UPDATE SET structures = structures + 1;
+            INSERT INTO user_stats (tg_id, structures) VALUES (NEW.user_tg_id, 1)
+                ON CONFLICT(tg_id) DO UPDATE SET structures = structures + 1;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_structures_delete AFTER DELETE ON structures BEGIN
+            UPDATE stats_totals SET value = value - 1 WHERE name = 'structures';
+            UPDATE stats_daily SET structures = structures - 1 WHERE day = date(OLD.created_at, 'unixepoch');
+            UPDATE user_stats SET structures = structures - 1 WHERE tg_id = OLD.user_tg_id;
+        END""",
+    ) + _STATS_REBUILD_V2,
+    # 3: content-addressed storage. Saved rows become (user, blob) references
+    #    to one copy of each distinct text, unsaved rows younger than
+    #    DRAFT_TTL become drafts (ids kept, so existing buttons still work),
+    #    older unsaved rows and the legacy structures table are dropped.
+    #    The counters now track saved structures.
+    (
+        "CREATE TABLE structure_blobs (id INTEGER PRIMARY KEY, hash BLOB NOT NULL UNIQUE, text TEXT NOT NULL)",
+        "CREATE TABLE saved_structures (id INTEGER PRIMARY KEY AUTOINCREMENT, user_tg_id INTEGER NOT NULL, "
+        "blob_id INTEGER NOT NULL REFERENCES structure_blobs(id), created_at INTEGER NOT NULL, "
+        "UNIQUE(user_tg_id, blob_id))",
+        "CREATE INDEX idx_saved_user_created ON saved_structures(user_tg_id, created_at, id)",
+        "CREATE INDEX idx_saved_blob ON saved_structures(blob_id)",
+        "CREATE TABLE drafts (id INTEGER PRIMARY KEY AUTOINCREMENT, user_tg_id INTEGER NOT NULL, "
+        "blob_id INTEGER NOT NULL REFERENCES structure_blobs(id), created_at INTEGER NOT NULL)",
+        "CREATE INDEX idx_drafts_user ON drafts(user_tg_id, id)",
+        "CREATE INDEX idx_drafts_created ON drafts(created_at)",
+        "CREATE INDEX idx_drafts_blob ON drafts(blob_id)",
+        "CREATE TEMP TABLE _keep AS SELECT id, user_tg_id, text, COALESCE(created_at, 0) AS created_at, saved, "
+        "content_hash(text) AS hash FROM structures WHERE text IS NOT NULL AND user_tg_id IS NOT NULL "
+        f"AND (saved = 1 OR created_at >= CAST(strftime('%s', 'now') AS INTEGER) - {DRAFT_TTL})",
+        "INSERT OR IGNORE INTO structure_blobs (hash, text) SELECT hash, text FROM _keep",
+        # a user's duplicate saves collapse into one reference (latest id and time)
+        "INSERT INTO saved_structures (id, user_tg_id, blob_id, created_at) "
+        "SELECT MAX(k.id), k.user_tg_id, b.id, MAX(k.created_at) FROM _keep k "
+        "JOIN structure_blobs b ON b.hash = k.hash WHERE k.saved = 1 GROUP BY k.user_tg_id, b.id",
+        "INSERT INTO drafts (id, user_tg_id, blob_id, created_at) "
+        "SELECT k.id, k.user_tg_id, b.id, k.created_at FROM _keep k "
+        "JOIN structure_blobs b ON b.hash = k.hash WHERE k.saved != 1",
+        "DROP TABLE _keep",
+        "DROP TRIGGER IF EXISTS trg_structures_insert",
+        "DROP TRIGGER IF EXISTS trg_structures_delete",
+        "DROP TABLE structures",
+        """CREATE TRIGGER trg_saved_insert AFTER INSERT ON saved_structures BEGIN
+            UPDATE stats_totals SET value = value + 1 WHERE name = 'structures';
+            INSERT INTO stats_daily (day, structures) VALUES (date(NEW.created_at, 'unixepoch'), 1)
+                ON CONFLICT(day) DO UPDATE SET structures = structures + 1;
+            INSERT INTO user_stats (tg_id, structures) VALUES (NEW.user_tg_id, 1)
+                ON CONFLICT(tg_id) DO UPDATE SET structures = structures + 1;
+        END""",
+        """CREATE TRIGGER trg_saved_delete AFTER DELETE ON saved_structures BEGIN
+            UPDATE stats_totals SET value = value - 1 WHERE name = 'structures';
+            UPDATE stats_daily SET structures = structures - 1 WHERE day = date(OLD.created_at, 'unixepoch');
+            UPDATE user_stats SET structures = structures - 1 WHERE tg_id = OLD.user_tg_id;
+        END""",
+    ) + STATS_REBUILD,
+    # 4: owner broadcasts (broadcast.py): the message, its counters and the
+    #    checkpoint - every user up to last_tg_id has been sent to
+    (
+        "CREATE TABLE broadcasts (id INTEGER PRIMARY KEY AUTOINCREMENT, text TEXT NOT NULL, "
+        "owner_chat_id INTEGER NOT NULL, status TEXT NOT NULL, total INTEGER NOT NULL DEFAULT 0, "
+        "last_tg_id INTEGER NOT NULL DEFAULT 0, sent INTEGER NOT NULL DEFAULT 0, "
+        "blocked INTEGER NOT NULL DEFAULT 0, failed INTEGER NOT NULL DEFAULT 0, "
+        "created_at INTEGER NOT NULL, updated_at INTEGER NOT NULL)",
+    ),
+    # 5: background maintenance (maintenance.py): when each job last ran,
+    #    how long it took and what it did
+    (
+        "CREATE TABLE maintenance (name TEXT PRIMARY KEY, last_run INTEGER NOT NULL, "
+        "seconds REAL NOT NULL DEFAULT 0, result TEXT NOT NULL DEFAULT '')",
+    ),
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version() -> int:
+    return fetchone("PRAGMA user_version")[0]
+
+
+def init_schema():
+    version = schema_version()
+    if version == SCHEMA_VERSION:
+        # the common case on every restart: one PRAGMA read, no write lock, no DDL
+        return
+    if version == 0:
+        # later migrations replace some base tables (structures); don't recreate them
+        _create_base_tables()
+    migrate()
+
+
+def migrate(target: int = SCHEMA_VERSION):
+    with transaction() as conn:
+        current = conn.execute("PRAGMA user_version").fetchone()[0]
+        for version in range(current + 1, target + 1):
+            for stmt in MIGRATIONS[version - 1]:
+                conn.execute(stmt)
+            # PRAGMA can't take parameters; version is always an int here
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+    optimize()
+
+
+def optimize():
+    """PRAGMA optimize: refresh the planner statistics that are out of date (usually none)."""
+    execute("PRAGMA optimize")
+
+
+def _create_base_tables():
+    with transaction() as conn:
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            tg_id INTEGER UNIQUE,
+            username TEXT,
+            full_name TEXT,
+            first_seen INTEGER,
+            structures_count INTEGER DEFAULT 0
+        )""")
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS structures (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_tg_id INTEGER,
+            text TEXT,
+            created_at INTEGER,
+            saved INTEGER DEFAULT 0,
+            FOREIGN KEY(user_tg_id) REFERENCES users(tg_id)
+        )""")
+
+
+# ----------------- QUERIES -----------------
+def upsert_user(tg_id: int, username: str, full_name: str, now: Optional[int] = None):
+    # one statement instead of SELECT + INSERT/UPDATE; first_seen is kept
+    execute(
+        "INSERT INTO users (tg_id, username, full_name, first_seen, structures_count) VALUES (?, ?, ?, ?, 0) "
+        "ON CONFLICT(tg_id) DO UPDATE SET username=excluded.username, full_name=excluded.full_name",
+        (tg_id, username, full_name, int(now if now is not None else time.time()))
+    )
+
+
+def increment_structures_count(tg_id: int, amount: int = 1):
+    execute("UPDATE users SET structures_count = structures_count + ? WHERE tg_id = ?", (amount, tg_id))
+
+
+def _blob_id(conn, text: str) -> int:
+    h = content_hash(text)
+    conn.execute("INSERT OR IGNORE INTO structure_blobs (hash, text) VALUES (?, ?)", (h, text))
+    return conn.execute("SELECT id FROM structure_blobs WHERE hash = ?", (h,)).fetchone()[0]
+
+
+def _drop_orphan_blob(conn, blob_id: int):
+    conn.execute("DELETE FROM structure_blobs WHERE id = ? "
+                 "AND NOT EXISTS (SELECT 1 FROM saved_structures WHERE blob_id = ?) "
+                 "AND NOT EXISTS (SELECT 1 FROM drafts WHERE blob_id = ?)", (blob_id, blob_id, blob_id))
+
+
+def insert_draft(tg_id: int, text: str, now: Optional[int] = None) -> int:
+    """Store a fresh (unsaved) generation; returns the draft id for its Save button."""
+    with transaction() as conn:
+        blob_id = _blob_id(conn, text)
+        cur = conn.execute("INSERT INTO drafts (user_tg_id, blob_id, created_at) VALUES (?, ?, ?)",
+                           (tg_id, blob_id, int(now if now is not None else time.time())))
+    return cur.lastrowid
+
+
+def draft_exists(draft_id: int, tg_id: int) -> bool:
+    return fetchone("SELECT 1 FROM drafts WHERE id = ? AND user_tg_id = ?", (draft_id, tg_id)) is not None
+
+
+def save_structure(tg_id: int, text: str, now: Optional[int] = None):
+    """Add text to the user's saved structures (no-op if it is already there)."""
+    with transaction() as conn:
+        blob_id = _blob_id(conn, text)
+        conn.execute("INSERT INTO saved_structures (user_tg_id, blob_id, created_at) VALUES (?, ?, ?) "
+                     "ON CONFLICT(user_tg_id, blob_id) DO NOTHING",
+                     (tg_id, blob_id, int(now if now is not None else time.time())))
+
+
+def save_draft(draft_id: int, tg_id: int, now: Optional[int] = None) -> bool:
+    """Save one of the user's drafts; False if it has expired (or isn't theirs)."""
+    row = fetchone("SELECT blob_id FROM drafts WHERE id = ? AND user_tg_id = ?", (draft_id, tg_id))
+    if row is None:
+        return False
+    execute("INSERT INTO saved_structures (user_tg_id, blob_id, created_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(user_tg_id, blob_id) DO NOTHING",
+            (tg_id, row[0], int(now if now is not None else time.time())))
+    return True
+
+
+def save_last_draft(tg_id: int, now: Optional[int] = None) -> bool:
+    row = fetchone("SELECT id FROM drafts WHERE user_tg_id = ? ORDER BY id DESC LIMIT 1", (tg_id,))
+    return row is not None and save_draft(row[0], tg_id, now)
+
+
+def gc_drafts(max_age: int = DRAFT_TTL, now: Optional[int] = None,
+              limit: Optional[int] = None) -> Tuple[int, int]:
+    """Drop drafts older than max_age and the blobs only they used; returns (drafts, blobs) removed.
+
+    limit: drop at most that many of the oldest ones, so the write lock is
+    held briefly; call again until it returns fewer.
+    """
+    cutoff = int(now if now is not None else time.time()) - max_age
+    with transaction() as conn:
+        last = (1 << 63) - 1
+        if limit is not None:
+            # ids grow with created_at: the oldest drafts are the lowest ids
+            last = conn.execute("SELECT MAX(id) FROM (SELECT id FROM drafts WHERE created_at < ? "
+                                "ORDER BY id LIMIT ?)", (cutoff, limit)).fetchone()[0]
+            if last is None:
+                return 0, 0
+        blobs = conn.execute(
+            "DELETE FROM structure_blobs WHERE id IN (SELECT blob_id FROM drafts WHERE created_at < ? AND id <= ?) "
+            "AND NOT EXISTS (SELECT 1 FROM saved_structures WHERE blob_id = structure_blobs.id) "
+            "AND NOT EXISTS (SELECT 1 FROM drafts WHERE blob_id = structure_blobs.id "
+            "AND (created_at >= ? OR id > ?))",
+            (cutoff, last, cutoff, last)).rowcount
+        drafts = conn.execute("DELETE FROM drafts WHERE created_at < ? AND id <= ?", (cutoff, last)).rowcount
+    return drafts, blobs
+
+
+_SAVED_COLUMNS = "SELECT s.id, b.text, s.created_at FROM saved_structures s JOIN structure_blobs b ON b.id = s.blob_id "
+
+
+def list_structures(tg_id: int) -> List[dict]:
+    rows = fetchall(_SAVED_COLUMNS + "WHERE s.user_tg_id = ? ORDER BY s.created_at DESC, s.id DESC", (tg_id,))
+    return [{"id": r[0], "text": r[1], "created_at": r[2]} for r in rows]
+
+
+def structures_page(tg_id: int, cursor=None, newer: bool = False, limit: int = 10) -> List[dict]:
+    """Keyset page of a user's saved structures, starting next to cursor = (created_at, id).
+
+    Older rows (newer=False) come newest-first; newer rows come oldest-first,
+    i.e. always starting from the row closest to the cursor.
+    """
+    if cursor is None:
+        rows = fetchall(_SAVED_COLUMNS + "WHERE s.user_tg_id = ? "
+                        "ORDER BY s.created_at DESC, s.id DESC LIMIT ?", (tg_id, limit))
+    elif newer:
+        rows = fetchall(_SAVED_COLUMNS + "WHERE s.user_tg_id = ? AND (s.created_at, s.id) > (?, ?) "
+                        "ORDER BY s.created_at ASC, s.id ASC LIMIT ?", (tg_id, cursor[0], cursor[1], limit))
+    else:
+        rows = fetchall(_SAVED_COLUMNS + "WHERE s.user_tg_id = ? AND (s.created_at, s.id) < (?, ?) "
+                        "ORDER BY s.created_at DESC, s.id DESC LIMIT ?", (tg_id, cursor[0], cursor[1], limit))
+    return [{"id": r[0], "text": r[1], "created_at": r[2]} for r in rows]
+
+
+def has_structures_beyond(tg_id: int, cursor, newer: bool) -> bool:
+    if newer:
+        sql = "SELECT 1 FROM saved_structures WHERE user_tg_id = ? AND (created_at, id) > (?, ?) LIMIT 1"
+    else:
+        sql = "SELECT 1 FROM saved_structures WHERE user_tg_id = ? AND (created_at, id) < (?, ?) LIMIT 1"
+    return fetchone(sql, (tg_id, cursor[0], cursor[1])) is not None
+
+
+def delete_structure(struct_id: int, tg_id: int):
+    with transaction() as conn:
+        row = conn.execute("SELECT blob_id FROM saved_structures WHERE id = ? AND user_tg_id = ?",
+                           (struct_id, tg_id)).fetchone()
+        if row is None:
+            return
+        conn.execute("DELETE FROM saved_structures WHERE id = ?", (struct_id,))
+        _drop_orphan_blob(conn, row[0])
+
+
+def get_user_row(tg_id: int):
+    return fetchone("SELECT structures_count, first_seen FROM users WHERE tg_id = ?", (tg_id,))
+
+
+def count_users() -> int:
+    return fetchone("SELECT COUNT(*) FROM users")[0]
+
+
+def count_structures() -> int:
+    return fetchone("SELECT COUNT(*) FROM saved_structures")[0]
+
+
+# ----------------- COUNTERS (O(1) reads) -----------------
+def today() -> str:
+    return time.strftime("%Y-%m-%d", time.gmtime())
+
+
+def stats_totals() -> dict:
+    totals = {"users": 0, "structures": 0}
+    totals.update(fetchall("SELECT name, value FROM stats_totals"))
+    return totals
+
+
+def stats_day(day: Optional[str] = None) -> dict:
+    row = fetchone("SELECT new_users, structures FROM stats_daily WHERE day = ?", (day or today(),))
+    return {"new_users": row[0] if row else 0, "structures": row[1] if row else 0}
+
+
+def user_structures_total(tg_id: int) -> int:
+    row = fetchone("SELECT structures FROM user_stats WHERE tg_id = ?", (tg_id,))
+    return row[0] if row else 0
+
+
+def rebuild_stats():
+    with transaction() as conn:
+        for stmt in STATS_REBUILD:
+            conn.execute(stmt)
+
+
+def check_stats() -> List[str]:
+    """Compare the counters against full scans; returns one line per mismatch."""
+    problems = []
+    totals = stats_totals()
+    for name, actual in (("users", count_users()), ("structures", count_structures())):
+        if totals[name] != actual:
+            problems.append(f"total {name}: counter {totals[name]} != actual {actual}")
+    for day, have_u, want_u, have_s, want_s in fetchall(
+            "SELECT day, SUM(hu), SUM(wu), SUM(hs), SUM(ws) FROM ("
+            "  SELECT day, new_users AS hu, 0 AS wu, structures AS hs, 0 AS ws FROM stats_daily"
+            "  UNION ALL SELECT date(first_seen, 'unixepoch'), 0, 1, 0, 0 FROM users WHERE first_seen IS NOT NULL"
+            "  UNION ALL SELECT date(created_at, 'unixepoch'), 0, 0, 0, 1 FROM saved_structures"
+            ") GROUP BY day HAVING SUM(hu) != SUM(wu) OR SUM(hs) != SUM(ws)"):
+        problems.append(f"day {day}: counter users/structures {have_u}/{have_s} != actual {want_u}/{want_s}")
+    for tg_id, have, want in fetchall(
+            "SELECT tg_id, SUM(have), SUM(want) FROM ("
+            "  SELECT tg_id, structures AS have, 0 AS want FROM user_stats"
+            "  UNION ALL SELECT user_tg_id, 0, COUNT(*) FROM saved_structures GROUP BY user_tg_id"
+            ") GROUP BY tg_id HAVING SUM(have) != SUM(want)"):
+        problems.append(f"user {tg_id}: counter {have} != actual {want}")
+    return problems
+
+
+def count_users_since(ts: int) -> int:
+    return fetchone("SELECT COUNT(*) FROM users WHERE first_seen >= ?", (ts,))[0]
+
+
+def recent_users(limit: int) -> list:
+    return fetchall("SELECT tg_id, username, full_name FROM users ORDER BY first_seen DESC LIMIT ?", (limit,))
+
+
+def recently_active_users(limit: int) -> List[int]:
+    """Ids of the users who generated something most recently (from drafts), newest first."""
+    rows = fetchall("SELECT user_tg_id FROM drafts GROUP BY user_tg_id ORDER BY MAX(id) DESC LIMIT ?", (limit,))
+    return [r[0] for r in rows]
+
+
+# ----------------- STREAMING READS -----------------
+# Whole-table walks (broadcasts, exports) read one page at a time, each page
+# a short query resuming after the last key seen: memory stays flat and no
+# read transaction is held open for the minutes a walk can take (that would
+# keep the WAL from being checkpointed).
+def _pages(sql: str, after: int, batch: int) -> Iterator[list]:
+    # sql filters on "<first column> > ?", orders by it and ends in LIMIT ?
+    while True:
+        rows = fetchall(sql, (after, batch))
+        if not rows:
+            return
+        yield rows
+        after = rows[-1][0]
+
+
+def user_id_batches(after: int = 0, batch: int = 500) -> Iterator[List[int]]:
+    """Lists of up to batch user ids greater than after, in ascending order."""
+    for rows in _pages("SELECT tg_id FROM users WHERE tg_id > ? ORDER BY tg_id LIMIT ?", after, batch):
+        yield [r[0] for r in rows]
+
+
+def iter_users(batch: int = 1000) -> Iterator[tuple]:
+    """(tg_id, username, full_name, first_seen, structures_count) of every user."""
+    for rows in _pages("SELECT tg_id, username, full_name, first_seen, structures_count FROM users "
+                       "WHERE tg_id > ? ORDER BY tg_id LIMIT ?", 0, batch):
+        yield from rows
+
+
+def iter_saved_structures(batch: int = 500) -> Iterator[tuple]:
+    """(id, user_tg_id, created_at, text) of every saved structure."""
+    for rows in _pages("SELECT s.id, s.user_tg_id, s.created_at, b.text FROM saved_structures s "
+                       "JOIN structure_blobs b ON b.id = s.blob_id WHERE s.id > ? ORDER BY s.id LIMIT ?",
+                       0, batch):
+        yield from rows
+
+
+# ----------------- BROADCASTS -----------------
+_BROADCAST_COLUMNS = ("id", "text", "owner_chat_id", "status", "total", "last_tg_id",
+                      "sent", "blocked", "failed", "created_at", "updated_at")
+
+
+def create_broadcast(text: str, owner_chat_id: int, now: Optional[int] = None) -> int:
+    now = int(now if now is not None else time.time())
+    return execute(
+        "INSERT INTO broadcasts (text, owner_chat_id, status, total, created_at, updated_at) "
+        "VALUES (?, ?, 'running', COALESCE((SELECT value FROM stats_totals WHERE name = 'users'), 0), ?, ?)",
+        (text, owner_chat_id, now, now)).lastrowid
+
+
+def get_broadcast(broadcast_id: Optional[int] = None) -> Optional[dict]:
+    """A broadcast as a dict (the latest one when broadcast_id is None)."""
+    sql = f"SELECT {', '.join(_BROADCAST_COLUMNS)} FROM broadcasts "
+    row = (fetchone(sql + "WHERE id = ?", (broadcast_id,)) if broadcast_id is not None
+           else fetchone(sql + "ORDER BY id DESC LIMIT 1"))
+    return dict(zip(_BROADCAST_COLUMNS, row)) if row else None
+
+
+def checkpoint_broadcast(broadcast_id: int, status: str, last_tg_id: int, sent: int, blocked: int,
+                         failed: int, now: Optional[int] = None):
+    execute("UPDATE broadcasts SET status = ?, last_tg_id = ?, sent = ?, blocked = ?, failed = ?, updated_at = ? "
+            "WHERE id = ?",
+            (status, last_tg_id, sent, blocked, failed, int(now if now is not None else time.time()),
+             broadcast_id))
+
+
+# ----------------- SPACE -----------------
+def space_used() -> dict:
+    page_size = fetchone("PRAGMA page_size")[0]
+    return {"bytes": fetchone("PRAGMA page_count")[0] * page_size,
+            "free_bytes": fetchone("PRAGMA freelist_count")[0] * page_size, "page_size": page_size}
+
+
+# ----------------- MAINTENANCE -----------------
+# Steps for maintenance.py's jobs; each one is short (a bounded number of
+# pages or rows) so it never holds the write lock for long.
+_AUTO_VACUUM_MODES = ("none", "full", "incremental")
+
+
+def auto_vacuum_mode() -> str:
+    return _AUTO_VACUUM_MODES[fetchone("PRAGMA auto_vacuum")[0]]
+
+
+def free_pages() -> int:
+    return fetchone("PRAGMA freelist_count")[0]
+
+
+def incremental_vacuum(pages: int) -> int:
+    """Return up to pages free pages to the OS (auto_vacuum=incremental only); how many were."""
+    before = free_pages()
+    with transaction() as conn:
+        # sqlite3 steps a pragma without result columns once, which moves
+        # one page, so PRAGMA incremental_vacuum(N) would stop after the first
+        for _ in range(min(pages, before)):
+            conn.execute("PRAGMA incremental_vacuum(1)")
+    return before - free_pages()
+
+
+def analyze(analysis_limit: int = 400):
+    """Refresh the planner statistics, reading about analysis_limit rows per index."""
+    execute(f"PRAGMA analysis_limit = {int(analysis_limit)}")
+    execute("ANALYZE")
+
+
+def wal_checkpoint(mode: str = "PASSIVE") -> Tuple[int, int, int]:
+    """(busy, WAL frames, frames checkpointed); PASSIVE never waits for readers or writers."""
+    if mode not in ("PASSIVE", "FULL", "RESTART", "TRUNCATE"):
+        raise ValueError(f"unknown checkpoint mode {mode!r}")
+    return tuple(fetchone(f"PRAGMA wal_checkpoint({mode})"))
+
+
+def backup(path: str, pages: int = 256, sleep: float = 0.01, progress=None):
+    """Online copy of the database into path (replaced), pages at a time.
+
+    Readers and writers carry on meanwhile; progress(status, remaining,
+    total) is called after each step and may raise to abandon the copy.
+    """
+    dst = sqlite3.connect(path)
+    try:
+        connection().backup(dst, pages=pages, progress=progress, sleep=sleep)
+    finally:
+        dst.close()
+
+
+def maintenance_runs() -> dict:
+    """Job name -> {"last_run", "seconds", "result"} of its latest run."""
+    rows = fetchall("SELECT name, last_run, seconds, result FROM maintenance")
+    return {r[0]: {"last_run": r[1], "seconds": r[2], "result": r[3]} for r in rows}
+
+
+def record_maintenance_run(name: str, seconds: float, result: str, now: Optional[int] = None):
+    execute("INSERT INTO maintenance (name, last_run, seconds, result) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET last_run = excluded.last_run, seconds = excluded.seconds, "
+            "result = excluded.result",
+            (name, int(now if now is not None else time.time()), seconds, result))
+
+
+def _table_exists(name: str) -> bool:
+    return fetchone("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)) is not None
+
+
+def compact() -> dict:
+    """Apply pending migrations, expire drafts and VACUUM; returns a space report."""
+    report = {"before": space_used()["bytes"], "legacy_rows": 0, "legacy_text_bytes": 0}
+    if _table_exists("structures"):
+        report["legacy_rows"], report["legacy_text_bytes"] = fetchone(
+            "SELECT COUNT(*), COALESCE(SUM(length(CAST(text AS BLOB))), 0) FROM structures")
+    init_schema()
+    report["drafts_expired"], report["blobs_dropped"] = gc_drafts()
+    # the rebuild also switches an older database to auto_vacuum=incremental (PRAGMAS)
+    execute("VACUUM")
+    execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    report["after"] = space_used()["bytes"]
+    report["reclaimed"] = report["before"] - report["after"]
+    report["blobs"], report["blob_text_bytes"] = fetchone(
+        "SELECT COUNT(*), COALESCE(SUM(length(CAST(text AS BLOB))), 0) FROM structure_blobs")
+    report["saved"] = count_structures()
+    report["drafts"] = fetchone("SELECT COUNT(*) FROM drafts")[0]
+    return report
+
+
+def format_space_report(r: dict) -> str:
+    mb = lambda n: f"{n / (1024 * 1024):.1f} MB"  # noqa: E731
+    lines = [f"size: {mb(r['before'])} -> {mb(r['after'])} (reclaimed {mb(r['reclaimed'])})"]
+    if r["legacy_rows"]:
+        lines.append(f"legacy structures: {r['legacy_rows']} rows, {mb(r['legacy_text_bytes'])} of text")
+    lines.append(f"blobs: {r['blobs']} distinct texts, {mb(r['blob_text_bytes'])}")
+    lines.append(f"saved references: {r['saved']}, drafts: {r['drafts']}")
+    lines.append(f"expired: {r['drafts_expired']} drafts, {r['blobs_dropped']} blobs")
+    return "\n".join(lines)
+
+
+# ----------------- CLI -----------------
+# python storage.py rebuild-stats | check-stats | compact   (uses DB_PATH)
+#   compact: migrate an existing DB to deduplicated storage, expire drafts,
+#   VACUUM and print how much space was reclaimed
+if __name__ == "__main__":
+    import sys
+    cmd = sys.argv[1] if len(sys.argv) > 1 else ""
+    if cmd == "compact":
+        print(format_space_report(compact()))
+        sys.exit(0)
+    init_schema()
+    if cmd == "rebuild-stats":
+        rebuild_stats()
+        print("stats rebuilt")
+    elif cmd == "check-stats":
+        problems = check_stats()
+        print("\n".join(problems) if problems else "stats OK")
+        sys.exit(1 if problems else 0)
+    else:
+        print("usage: storage.py rebuild-stats | check-stats | compact")
+        sys.exit(2)
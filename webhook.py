@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# webhook.py - Starlette/uvicorn webhook receiver for bot99
+#
+# Telegram POSTs each update to WEBHOOK_PATH. The request is acknowledged as
+# soon as the update is parsed and queued on the UpdateDispatcher; handlers
+# run afterwards on its worker pool. When the pool is full we answer 503 and
+# Telegram redelivers the update later.
+#
+# GET /metrics serves metrics.render() for Prometheus; set METRICS_TOKEN to
+# require "Authorization: Bearer <token>". In polling mode there is no web
+# server, so bot99 serves /metrics alone on METRICS_PORT when that is set.
+#
+# Starlette and uvicorn are imported only when an app is built: polling mode
+# and the worker processes never need them. (Plain Starlette rather than
+# FastAPI: none of FastAPI's validation or docs are used, and importing it
+# took a third of a second of every cold start.)
+
+import os
+import asyncio
+import hashlib
+import logging
+import threading
+from contextlib import asynccontextmanager
+
+import telebot
+
+import metrics
+
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/telegram/webhook")
+# Render sets RENDER_EXTERNAL_URL for web services
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL") or os.environ.get("RENDER_EXTERNAL_URL", "")
+PORT = int(os.environ.get("PORT", "8080"))
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+
+
+def default_secret(token: str) -> str:
+    # stable per bot so redeploys don't need a new env var
+    return hashlib.sha256(("webhook:" + token).encode()).hexdigest()[:48]
+
+
+def create_app(bot, dispatcher, secret_token=None, public_url=None):
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse, Response
+    stats = {"received": 0, "rejected": 0}
+
+    async def set_webhook():
+        url = public_url.rstrip("/") + WEBHOOK_PATH
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(
+                None, lambda: bot.set_webhook(url=url, secret_token=secret_token,
+                                              max_connections=40))
+            logging.info("Webhook set to %s", url)
+        except Exception as e:
+            logging.exception("set_webhook failed: %s", e)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        # not awaited: on a cold start the update that woke the service is
+        # waiting for the port, and the webhook is usually already set
+        task = asyncio.create_task(set_webhook()) if public_url else None
+        yield
+        if task is not None and not task.done():
+            task.cancel()
+        # uvicorn has stopped accepting requests; finish what was acknowledged
+        await dispatcher.shutdown()
+
+    app = Starlette(lifespan=lifespan)
+
+    async def receive(request):
+        if secret_token and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != secret_token:
+            return Response(status_code=403)
+        body = await request.body()
+        try:
+            update = telebot.types.Update.de_json(body.decode("utf-8"))
+        except Exception as e:
+            logging.info("Bad update payload: %s", e)
+            # a 2xx stops Telegram from retrying an update we can never parse
+            return Response(status_code=200)
+        if dispatcher.feed_nowait(update) is None:
+            stats["rejected"] += 1
+            return Response(status_code=503, headers={"Retry-After": "1"})
+        stats["received"] += 1
+        return Response(status_code=200)
+
+    async def health(request):
+        return JSONResponse({"ok": True, "in_flight": dispatcher.in_flight(), **stats})
+
+    app.add_route(WEBHOOK_PATH, receive, methods=["POST"])
+    app.add_route("/", health, methods=["GET"])
+    add_metrics_route(app)
+    return app
+
+
+def add_metrics_route(app):
+    from starlette.responses import Response
+
+    async def prometheus(request):
+        if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+            return Response(status_code=401)
+        return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
+    app.add_route("/metrics", prometheus, methods=["GET"])
+
+
+async def serve(bot, dispatcher, public_url=WEBHOOK_URL, port=PORT, secret_token=None, on_ready=None):
+    """Run the webhook server until it is stopped; on_ready() runs once it is listening."""
+    import uvicorn
+    app = create_app(bot, dispatcher, secret_token=secret_token, public_url=public_url)
+    config = uvicorn.Config(app, host="0.0.0.0", port=port, log_level="warning",
+                            access_log=False)
+    server = uvicorn.Server(config)
+
+    async def ready():
+        while not server.started:
+            if server.should_exit:
+                return
+            await asyncio.sleep(0.01)
+        on_ready()
+
+    waiter = asyncio.create_task(ready()) if on_ready else None
+    try:
+        await server.serve()
+    finally:
+        if waiter is not None:
+            waiter.cancel()
+
+
+def start_metrics_server(port=METRICS_PORT) -> threading.Thread:
+    """Serve only GET /metrics on a background thread (polling mode)."""
+    import uvicorn
+    from starlette.applications import Starlette
+    app = Starlette()
+    add_metrics_route(app)
+    config = uvicorn.Config(app, host="0.0.0.0", port=port, log_level="warning",
+                            access_log=False)
+    # off the main thread uvicorn leaves the bot's signal handlers alone
+    thread = threading.Thread(target=uvicorn.Server(config).run, name="metrics-http", daemon=True)
+    thread.start()
+    return thread
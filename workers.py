@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# workers.py - run bot99 as several worker processes behind one receiver
+#
+#   python workers.py [--workers N] [--polling | --webhook]
+#
+# The main process receives updates (webhook or long polling, as bot99.py
+# does) and hands each one to worker update_shard(update, N): every update of
+# a user goes to the same worker, whose UpdateDispatcher runs them in order,
+# so the flows behave exactly as with one process. Workers run the bot99
+# handlers and share flow state through the sqlite state backend.
+#
+# The main process is the only DB writer: workers send their writes to it
+# (writebehind.RemoteWriter) and it commits them through its own
+# WriteBehindQueue. Reads go straight to the database (WAL allows that).
+# Each worker gets 1/N of the outbox's global send rate. Workers send their
+# metrics snapshot to the main process every metrics.PUSH_SECONDS, so its
+# /metrics covers all of them.
+
+import os
+import sys
+import queue
+import signal
+import asyncio
+import logging
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import storage
+import writebehind
+from dispatcher import UpdateDispatcher, update_user_key, MAX_PENDING
+
+WORKERS = int(os.environ.get("BOT_WORKERS", str(os.cpu_count() or 1)))
+# seconds to wait for workers to start / finish their queues
+START_TIMEOUT = 60
+STOP_TIMEOUT = 30
+
+
+def update_shard(update, workers: int) -> int:
+    key = update_user_key(update)
+    if isinstance(key, tuple):
+        # no user (e.g. channel posts): spread by update id
+        key = key[1]
+    return key % workers
+
+
+# ----------------- WORKER PROCESS -----------------
+def worker_main(index, updates, requests, replies, ready, pushes=None, init=None):
+    # the main process decides when workers stop (it sends None)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    writebehind.use_remote(requests, replies, index)
+    import bot99
+    if init is not None:
+        init(bot99)
+    if pushes is not None:
+        metrics.start_push(pushes, index)
+    try:
+        asyncio.run(_worker_loop(bot99.bot, updates, ready))
+    finally:
+        bot99.outbox.close()
+        if pushes is not None:
+            metrics.push_now(pushes, index)
+        bot99.db_writer.close()
+        storage.close_all()
+
+
+async def _worker_loop(bot, updates, ready):
+    dispatcher = UpdateDispatcher(bot)
+    loop = asyncio.get_running_loop()
+    reader = ThreadPoolExecutor(1, thread_name_prefix="updates")
+    parent = os.getppid()
+    ready.set()
+    while True:
+        try:
+            update = await loop.run_in_executor(reader, updates.get, True, 1.0)
+        except queue.Empty:
+            if os.getppid() != parent:
+                logging.warning("Main process is gone; worker stopping")
+                break
+            continue
+        if update is None:
+            break
+        await dispatcher.feed(update)
+    await dispatcher.shutdown()
+    reader.shutdown(wait=False)
+
+
+# ----------------- MAIN PROCESS -----------------
+class WorkerPool(UpdateDispatcher):
+    """Feeds updates to worker processes.
+
+    Takes the place of UpdateDispatcher in webhook.serve() and run_polling():
+    feed()/feed_nowait() queue the update for its worker instead of running it.
+    writer is the main process's WriteBehindQueue, which runs the workers' writes.
+    init, if given, is a picklable function called with the bot99 module in
+    each worker right after import (used by the load test to stub the Bot API).
+    """
+
+    def __init__(self, bot, writer, workers: int = WORKERS, max_pending: int = MAX_PENDING, init=None):
+        super().__init__(bot, workers=1, max_pending=max_pending)
+        self._ctx = multiprocessing.get_context("spawn")
+        self.workers = workers
+        self._init = init
+        self._writer = writer
+        self._requests = self._ctx.Queue()
+        self._replies = [self._ctx.Queue() for _ in range(workers)]
+        self._updates = [self._ctx.Queue(max_pending) for _ in range(workers)]
+        self._procs = [None] * workers
+        self._relay = threading.Thread(target=writebehind.serve_remote, name="db-relay", daemon=True,
+                                       args=(writer, self._requests, self._replies))
+        self._pushes = self._ctx.Queue()
+        self._metrics = threading.Thread(target=metrics.serve_pushes, name="metrics-pull", daemon=True,
+                                         args=(self._pushes,))
+        self._closed = False
+        self.fed = [0] * workers
+        self.restarts = 0
+
+    def _spawn(self, i):
+        ready = self._ctx.Event()
+        proc = self._ctx.Process(target=worker_main, name=f"bot-worker-{i}",
+                                 args=(i, self._updates[i], self._requests, self._replies[i], ready,
+                                       self._pushes, self._init))
+        proc.start()
+        self._procs[i] = proc
+        return ready
+
+    def start(self, timeout: float = START_TIMEOUT):
+        self._relay.start()
+        self._metrics.start()
+        pending = [self._spawn(i) for i in range(self.workers)]
+        for i, ready in enumerate(pending):
+            if not ready.wait(timeout):
+                raise RuntimeError(f"worker {i} did not start within {timeout}s")
+        logging.info("%d workers started", self.workers)
+        return self
+
+    def feed_nowait(self, update):
+        i = update_shard(update, self.workers)
+        if not self._procs[i].is_alive():
+            logging.error("Worker %d died (exit code %s); restarting", i, self._procs[i].exitcode)
+            self.restarts += 1
+            # its counters died with it; /metrics shouldn't keep adding them in
+            metrics.forget(i)
+            self._spawn(i)
+        try:
+            self._updates[i].put_nowait(update)
+        except queue.Full:
+            return None
+        self.fed[i] += 1
+        self.received += 1
+        return True
+
+    async def feed(self, update):
+        while self.feed_nowait(update) is None:
+            await asyncio.sleep(0.01)
+        return True
+
+    def in_flight(self) -> int:
+        # updates queued for the workers (not counting those they are running)
+        try:
+            return sum(q.qsize() for q in self._updates)
+        except NotImplementedError:   # macOS
+            return 0
+
+    async def drain(self):
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    async def shutdown(self):
+        await self.drain()
+        self._poller.shutdown(wait=False)
+
+    def close(self, timeout: float = STOP_TIMEOUT):
+        """Let the workers finish their queues, then stop them and the write relay."""
+        if self._closed:
+            return
+        self._closed = True
+        for q in self._updates:
+            q.put(None)
+        for i, proc in enumerate(self._procs):
+            if proc is None:
+                continue
+            proc.join(timeout)
+            if proc.is_alive():
+                # workers ignore SIGTERM (see worker_main)
+                logging.warning("Worker %d did not stop in %ss; killing it", i, timeout)
+                proc.kill()
+        if self._relay.is_alive():
+            self._requests.put(None)
+            self._relay.join(timeout)
+        if self._metrics.is_alive():
+            self._pushes.put(None)
+            self._metrics.join(timeout)
+        for i in range(self.workers):
+            metrics.forget(i)
+        self._writer.flush()
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", type=int, default=WORKERS)
+    ap.add_argument("--polling", action="store_true")
+    ap.add_argument("--webhook", action="store_true")
+    args = ap.parse_args(argv)
+    # must be set before bot99 (and state.py / outbox.py) are imported here
+    # and in the spawned workers
+    os.environ.setdefault("STATE_BACKEND", "sqlite")
+    os.environ["OUTBOX_GLOBAL_RATE"] = str(float(os.environ.get("OUTBOX_GLOBAL_RATE", "30")) / args.workers)
+    import bot99
+    mode = bot99.run_mode(argv)
+    pool = WorkerPool(bot99.bot, bot99.db_writer, workers=args.workers)
+    logging.info("Bot started (%s, %d workers).", mode, args.workers)
+    try:
+        pool.start()
+        asyncio.run(bot99.run_bot(mode, dispatcher=pool))
+    except Exception as e:
+        logging.exception("Bot crashed: %s", e)
+    finally:
+        bot99.maintainer.stop()
+        pool.close()
+        bot99.db_writer.close()
+        storage.close_all()
+
+
+if __name__ == "__main__":
+    main()
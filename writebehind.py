@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# writebehind.py - background writer that batches DB writes into one transaction
+#
+# Writes are storage.py functions queued with submit(); a single writer thread
+# drains the queue and commits everything collected within FLUSH_MS (or
+# BATCH_ROWS items) in one transaction, so a burst of /start upserts costs one
+# commit instead of one each. call() runs a write on the same thread, after
+# everything queued before it, and blocks until it is committed so the caller
+# gets its result (e.g. a new row id).
+#
+# With several worker processes (workers.py) only one process writes: workers
+# get a RemoteWriter with the same submit()/call()/flush() interface, which
+# ships each write to the writer process's WriteBehindQueue over a queue.
+
+import os
+import queue
+import threading
+import time
+import logging
+import itertools
+from concurrent.futures import Future
+from typing import Dict
+
+import metrics
+import storage
+
+FLUSH_MS = int(os.environ.get("WRITE_FLUSH_MS", "50"))
+BATCH_ROWS = int(os.environ.get("WRITE_BATCH_ROWS", "200"))
+
+_STOP = object()
+
+
+class _Barrier:
+    # queued by flush(); resolves once everything ahead of it is committed
+    def __init__(self):
+        self.future = Future()
+
+
+class WriteBehindQueue:
+    def __init__(self, flush_ms: int = FLUSH_MS, batch_rows: int = BATCH_ROWS):
+        self.flush_interval = flush_ms / 1000.0
+        self.batch_rows = batch_rows
+        self._q = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.rows = 0
+        self.errors = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+        return self
+
+    def submit(self, fn, *args):
+        """Queue fn(*args) to run on the writer thread; returns immediately."""
+        self._ensure_running()
+        self._q.put((fn, args, None))
+
+    def call(self, fn, *args, timeout=None):
+        """Run fn(*args) on the writer thread after pending writes and return its result once committed."""
+        if threading.current_thread() is self._thread:
+            return fn(*args)
+        return self.call_async(fn, *args).result(timeout)
+
+    def call_async(self, fn, *args) -> Future:
+        """Like call(), but returns a Future instead of waiting."""
+        self._ensure_running()
+        fut = Future()
+        self._q.put((fn, args, fut))
+        return fut
+
+    def flush(self, timeout=None):
+        """Block until every write queued so far is committed."""
+        if self._thread is None or threading.current_thread() is self._thread:
+            return
+        self.flush_async().result(timeout)
+
+    def flush_async(self) -> Future:
+        """Future that resolves once every write queued so far is committed."""
+        self._ensure_running()
+        barrier = _Barrier()
+        self._q.put(barrier)
+        return barrier.future
+
+    def close(self, timeout=None):
+        """Durable shutdown: commit everything queued, checkpoint the WAL, stop the thread."""
+        with self._lock:
+            thread = self._thread
+            if thread is None:
+                return
+            self._q.put(_STOP)
+        thread.join(timeout)
+        with self._lock:
+            self._thread = None
+
+    def pending(self) -> int:
+        return self._q.qsize()
+
+    def _ensure_running(self):
+        if self._thread is None:
+            self.start()
+
+    # ----------------- WRITER THREAD -----------------
+    def _run(self):
+        stop = False
+        while not stop:
+            batch = [self._q.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_rows:
+                last = batch[-1]
+                # someone is waiting: commit now rather than at the deadline
+                if last is _STOP or isinstance(last, _Barrier) or last[2] is not None:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._q.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            if batch[-1] is _STOP:
+                batch.pop()
+                stop = True
+            # anything queued behind the stop marker still gets written
+            if stop:
+                while True:
+                    try:
+                        item = self._q.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not _STOP:
+                        batch.append(item)
+            self._commit(batch)
+        try:
+            storage.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except Exception as e:
+            logging.info("WAL checkpoint on shutdown failed: %s", e)
+
+    def _commit(self, batch):
+        results = []
+        start = time.perf_counter()
+        try:
+            with storage.transaction() as conn:
+                for item in batch:
+                    if isinstance(item, _Barrier):
+                        results.append((item.future, None, None))
+                        continue
+                    fn, args, fut = item
+                    # savepoint per write so one bad row doesn't drop the batch
+                    conn.execute("SAVEPOINT w")
+                    try:
+                        res = fn(*args)
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO w")
+                        self.errors += 1
+                        if fut is None:
+                            logging.exception("Queued DB write %s failed", getattr(fn, "__name__", fn))
+                        results.append((fut, None, e))
+                    else:
+                        results.append((fut, res, None))
+                    conn.execute("RELEASE w")
+        except Exception as e:
+            logging.exception("DB write batch of %d failed", len(batch))
+            self.errors += len(batch)
+            results = [(r[0], None, r[2] or e) for r in results]
+            results += [(getattr(item, "future", None) or item[2], None, e) for item in batch[len(results):]]
+        metrics.db_batch_seconds.observe(time.perf_counter() - start)
+        metrics.db_batch_rows.inc(len(batch))
+        self.batches += 1
+        self.rows += len(batch)
+        for fut, res, err in results:
+            if fut is None:
+                continue
+            if err is not None:
+                fut.set_exception(err)
+            else:
+                fut.set_result(res)
+
+
+# ----------------- MULTI-PROCESS -----------------
+_remote = None   # (requests, replies, worker index), set in worker processes
+
+
+def use_remote(requests, replies, worker: int):
+    """Make open_writer() return a RemoteWriter (called before bot99 is imported)."""
+    global _remote
+    _remote = (requests, replies, worker)
+
+
+def open_writer():
+    if _remote is not None:
+        return RemoteWriter(*_remote)
+    return WriteBehindQueue()
+
+
+class RemoteWriter:
+    """Stand-in for WriteBehindQueue in worker processes; writes run in the writer process.
+
+    requests is shared by all workers and carries (worker, request id, fn, args);
+    fn must be a module-level (picklable) function such as storage.insert_draft.
+    Replies come back on this worker's own replies queue.
+    """
+
+    def __init__(self, requests, replies, worker: int):
+        self._requests = requests
+        self._replies = replies
+        self._worker = worker
+        self._ids = itertools.count(1)
+        self._waiting: Dict[int, Future] = {}
+        self._lock = threading.Lock()
+        self._closed = False
+        self._reader = threading.Thread(target=self._read_replies, name="db-replies", daemon=True)
+        self._reader.start()
+
+    def submit(self, fn, *args):
+        self._requests.put((self._worker, 0, fn, args))
+
+    def call_async(self, fn, *args) -> Future:
+        fut = Future()
+        with self._lock:
+            req = next(self._ids)
+            self._waiting[req] = fut
+        self._requests.put((self._worker, req, fn, args))
+        return fut
+
+    def call(self, fn, *args, timeout=None):
+        return self.call_async(fn, *args).result(timeout)
+
+    def flush(self, timeout=None):
+        # fn=None is a barrier: answered once everything before it is committed
+        self.call_async(None).result(timeout)
+
+    def close(self, timeout=None):
+        # also registered with atexit by bot99; the second call is a no-op
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self.flush(timeout)
+        finally:
+            self._replies.put(None)
+            self._reader.join(timeout)
+
+    def pending(self) -> int:
+        return len(self._waiting)
+
+    def _read_replies(self):
+        while True:
+            item = self._replies.get()
+            if item is None:
+                return
+            req, ok, value = item
+            with self._lock:
+                fut = self._waiting.pop(req, None)
+            if fut is None:
+                continue
+            if ok:
+                fut.set_result(value)
+            else:
+                fut.set_exception(value)
+
+
+def serve_remote(writer: WriteBehindQueue, requests, replies):
+    """Writer-process loop: run RemoteWriter requests on writer until a None arrives."""
+    def answer(worker, req, fut):
+        try:
+            replies[worker].put((req, True, fut.result()))
+        except Exception as e:
+            # exceptions are re-created so they always unpickle in the worker
+            replies[worker].put((req, False, RuntimeError(f"{type(e).__name__}: {e}")))
+
+    while True:
+        item = requests.get()
+        if item is None:
+            return
+        worker, req, fn, args = item
+        if not req:
+            writer.submit(fn, *args)
+            continue
+        fut = writer.flush_async() if fn is None else writer.call_async(fn, *args)
+        fut.add_done_callback(lambda f, w=worker, r=req: answer(w, r, f))